@@ -2,14 +2,17 @@
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import matching.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
+# ★ 先に Django を初期化してからルーティング（consumers → models）を import する
+#   （逆だと AppRegistryNotReady で起動できない）
 django_asgi_app = get_asgi_application()
 
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import matching.routing  # noqa: E402
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
 
@@ -0,0 +1,84 @@
+# config/gunicorn.conf.py
+"""
+本番用の gunicorn 設定（ASGI: uvicorn ワーカー）。
+
+  gunicorn config.asgi:application -c config/gunicorn.conf.py
+
+WSGI（config.wsgi）だと WebSocket（/ws/call/, /ws/chat/）が動かないので、
+gunicorn はプロセス管理だけにして、各ワーカーは uvicorn で config.asgi を動かす。
+
+普通の（同期の）ビューは Django が thread_sensitive な sync_to_async で
+ワーカーごとに1本のスレッドで順番に実行する（DB 接続もそのスレッドで使い回す）。
+なので「同期ビューを同時に何本さばけるか」≒ ワーカー数。
+
+環境変数（すべて任意）:
+  PORT                      待ち受けポート（Render などが設定する）     デフォルト 8000
+  WEB_CONCURRENCY           ワーカー数                                  下を参照
+  GUNICORN_TIMEOUT          応答がないワーカーを再起動するまでの秒数    30
+  GUNICORN_GRACEFUL_TIMEOUT 再起動・停止時に処理中のリクエストを待つ秒数 30
+  GUNICORN_KEEPALIVE        keep-alive 接続を保つ秒数                    5
+  GUNICORN_MAX_REQUESTS     この回数ごとにワーカーを入れ替える（0 = しない） 1000
+  GUNICORN_LOG_LEVEL        ログレベル                                   info
+
+ワーカー数のデフォルト:
+  CHANNEL_LAYER_BACKEND=memory のときは 1（プロセスをまたぐと通話の相手に届かないため）
+  sqlite / redis のときは CPU 数（最大 8）。
+  下の計測のとおり、CPU 数より多くしても同期ビューの処理は速くならない。
+
+計測（python manage.py http_loadtest --concurrency 16 --duration 20,
+      1 vCPU を負荷をかける側と共有, SQLite, 検索対象 3000 件）:
+
+                                     ASGI 2 ワーカー     ASGI 1 ワーカー     （参考）旧 WSGI 1 ワーカー
+  /accounts/login/（匿名）           57 req/s p50 278ms  63 req/s p50 243ms  95 req/s p50 167ms
+  /profile/list/（ログイン）         20 req/s p50 841ms  25 req/s p50 644ms  31 req/s p50 517ms
+  /media/avatars/…（2.7MB 全体）     58 req/s p50 271ms
+  /media/avatars/…（304 応答）      172 req/s p50  90ms
+
+  旧 WSGI は WebSocket を一切扱えないので比較は参考まで。
+  ASGI は同期ビューごとにスレッドへの受け渡しが入るぶん、1リクエストあたりは少し重い。
+  WebSocket（/ws/call/, /ws/chat/）は 2 ワーカー + sqlite レイヤーで動くことを確認済み
+  （プロセスをまたぐ中継そのものは channel_layer_loadtest で確認できる）。
+"""
+import multiprocessing
+import os
+
+
+def _int_env(name, default):
+    return int(os.environ.get(name, default))
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = "uvicorn_worker.UvicornWorker"
+
+_channel_layer = os.environ.get("CHANNEL_LAYER_BACKEND", "memory")
+if _channel_layer == "memory":
+    _default_workers = 1
+else:
+    _default_workers = min(multiprocessing.cpu_count(), 8)
+workers = _int_env("WEB_CONCURRENCY", _default_workers)
+
+timeout = _int_env("GUNICORN_TIMEOUT", 30)
+graceful_timeout = _int_env("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _int_env("GUNICORN_KEEPALIVE", 5)
+
+# メモリが少しずつ増えても、ワーカーを順番に入れ替えてリセットする（同時に全部は落ちない）
+max_requests = _int_env("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = max_requests // 10
+
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+accesslog = "-"
+errorlog = "-"
+
+# Render などのロードバランサの後ろで X-Forwarded-* を信用する
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "*")
+
+
+def on_starting(server):
+    if _channel_layer == "memory" and workers > 1:
+        server.log.warning(
+            "CHANNEL_LAYER_BACKEND=memory でワーカーが %s 個あります。"
+            "別のワーカーに入った相手には通話・チャットのイベントが届きません。"
+            "sqlite か redis を使ってください。",
+            workers,
+        )
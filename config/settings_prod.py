@@ -37,6 +37,7 @@ ALLOWED_HOSTS = [
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # ← runserver も ASGI（WebSocket 込み）で動かすため先頭に
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -52,10 +53,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # 静的ファイルはフロントの Web サーバが STATIC_ROOT から返す前提なので、
+    # config/settings.py の AsyncWhiteNoiseMiddleware（WhiteNoise の async 版）は入れない
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    "matching.profiles.CurrentProfileMiddleware",  # ← request.profile / request.aprofile()
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -135,6 +139,32 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# メディア配信（matching.media）
+#   MEDIA_ACCEL        : "" = Django が返す / "nginx" = X-Accel-Redirect / "sendfile" = X-Sendfile
+#   MEDIA_ACCEL_PREFIX : nginx の internal location（例: location /protected-media/ { internal; alias .../media/; }）
+#   MEDIA_CACHE_MAX_AGE : キャッシュ秒数（切れたら ETag で確かめ直す。同じ名前で作り直すことがあるので immutable にはしない）
+MEDIA_ACCEL = os.environ.get("MEDIA_ACCEL", "")
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-media/")
+MEDIA_CACHE_MAX_AGE = 3600
+
+# チャットの添付ファイル（matching.attachments）
+#   /media/ からは出さず、署名付き URL（/profile/chat/attachments/...）だけで配信する。
+#   nginx で /media/ を直接返す場合は、この2つのディレクトリを deny しておくこと。
+MEDIA_PRIVATE_PREFIXES = ("chat_images/", "chat_videos/")
+ATTACHMENT_URL_TTL = 30 * 60  # 署名付き URL の有効期限の区切り（秒）
+
+# チャット動画の分割アップロード（matching.uploads）
+#   1チャンクずつ送るので、DATA_UPLOAD_MAX_MEMORY_SIZE を超える動画も送れる。
+#   上限 MAX_VIDEO_SIZE_MB は開始時と受信中の両方で判定する。
+MAX_VIDEO_SIZE_MB = 30
+CHAT_UPLOAD_CHUNK_SIZE = 1024 * 1024  # クライアントに伝えるチャンクサイズ（1MB）
+CHAT_UPLOAD_TEMP_DIR = BASE_DIR / "upload_tmp"
+CHAT_UPLOAD_EXPIRY_HOURS = 24  # 放置されたアップロードを消すまでの時間
+
+# アップロード画像のサムネイル / WebP 生成（matching.images）
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_RENDITIONS_SYNC = os.environ.get("IMAGE_RENDITIONS_SYNC", "False") == "True"
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -147,14 +177,85 @@ LOGIN_URL = "login"                 # ログインしてないとき飛ばされ
 LOGIN_REDIRECT_URL = "profile_list" # ログイン後に飛ぶ先（好きに変えてOK）
 LOGOUT_REDIRECT_URL = "/accounts/login/"  # ログアウト後に飛ぶ先（片方に統一）
 
+# ログイン中ユーザーのプロフィール（matching.profiles）
+#   ProfileModelBackend : セッションから User を引くときに UserProfile も JOIN する
+#   ModelBackend        : 切り替え前にログインしたセッション用（そのまま使えるように残す）
+#   PROFILE_CACHE_TIMEOUT : JOIN できなかったときにプロセス内で覚えておく秒数（0 で無効）
+AUTHENTICATION_BACKENDS = [
+    "matching.profiles.ProfileModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+PROFILE_CACHE_TIMEOUT = 30
+
+# キャッシュ（通知バッジ・いいね/ブロック関係・公開ページ・掲示板一覧）
+#   locmem : プロセス内（デフォルト。ワーカー間では共有されない）
+#   file   : CACHE_LOCATION のディレクトリ（同じマシンのワーカー間で共有。外部サービス不要）
+#   PAGE_CACHE_TIMEOUT  : 未ログイン向けの静的ページをまるごと覚えておく秒数（matching.caching）
+#   BOARD_CACHE_TIMEOUT : 掲示板一覧の投稿リスト（テンプレート断片）を覚えておく秒数
+#   SEARCH_SNAPSHOT_TIMEOUT : プロフィール検索の結果（並び順どおりの ID）を覚えておく秒数（matching.saved_search）
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "locmem")
+
+if CACHE_BACKEND == "file":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("CACHE_LOCATION", str(BASE_DIR / "django_cache")),
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "matching",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        },
+    }
+
+PAGE_CACHE_TIMEOUT = int(os.environ.get("PAGE_CACHE_TIMEOUT", 60 * 10))
+BOARD_CACHE_TIMEOUT = int(os.environ.get("BOARD_CACHE_TIMEOUT", 60 * 5))
+SEARCH_SNAPSHOT_TIMEOUT = int(os.environ.get("SEARCH_SNAPSHOT_TIMEOUT", 60 * 2))
+
+# おすすめ順のスコアリング用の表（matching.scoring）を置くディレクトリ
+# 同じマシンのワーカーは memmap で共有して読む。消しても次に使うときに DB から作り直す
+SCORING_DIR = os.environ.get("SCORING_DIR", str(BASE_DIR / "scoring"))
+
 
 # Channels / ASGI
 ASGI_APPLICATION = "config.asgi.application"
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+
+# チャネルレイヤー（WebSocket のメッセージをプロセス間で中継する仕組み）
+#   memory : 1プロセスの中だけ（開発用。ワーカーが複数だと相手に届かない）
+#   sqlite : 同じマシン上の複数プロセスで SQLite ファイルを共有（外部サービス不要）
+#   redis  : 複数マシンで共有（channels-redis + REDIS_URL）
+CHANNEL_LAYER_BACKEND = os.environ.get("CHANNEL_LAYER_BACKEND", "memory")
+
+if CHANNEL_LAYER_BACKEND == "redis":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/0")],
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == "sqlite":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "matching.channel_layers.SQLiteChannelLayer",
+            "CONFIG": {
+                "path": os.environ.get(
+                    "CHANNEL_LAYER_PATH", str(BASE_DIR / "channels.sqlite3")
+                ),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 
 # ファイルアップロードサイズ制限（20MB）
@@ -5,7 +5,6 @@ from django.urls import path, include, re_path
 from django.contrib.auth import views as auth_views
 from matching import views as matching_views
 from django.conf import settings
-from django.views.static import serve
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
 urlpatterns = [
@@ -45,11 +44,11 @@ handler404 = "matching.views.custom_404"
 handler500 = "matching.views.custom_500"
 
 # ★ media 配信（DEBUG 関係なし）
+#   Range / ETag / 304 対応。MEDIA_ACCEL を設定すると本体は nginx などが送る
 urlpatterns += [
     re_path(
         r"^media/(?P<path>.*)$",
-        serve,
-        {"document_root": settings.MEDIA_ROOT},
+        matching_views.serve_media,
         name="media",
     ),
 ]
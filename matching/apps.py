@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class MatchingConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "matching"
+
+    def ready(self):
+        # キャッシュ更新などのシグナルハンドラを登録
+        from . import signals  # noqa: F401
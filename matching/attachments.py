@@ -0,0 +1,74 @@
+# matching/attachments.py
+"""
+チャットの添付ファイル（chat_images/, chat_videos/）を署名付き URL で渡すためのヘルパー。
+
+/media/ からは直接見えないようにして（MEDIA_PRIVATE_PREFIXES）、
+ルームのメンバーであることを確認したビュー（chat_room / chat_history / ChatConsumer）
+だけが、期限付きの URL を発行する。
+
+  /profile/chat/attachments/chat_images/foo.jpg?e=<期限>&s=<HMAC>
+
+検証は HMAC と期限の比較だけなので DB を見ない。
+中身は個人のチャットのファイルなので Cache-Control は private（ブラウザだけがキャッシュする）。
+共有のプロキシに載せると、URL が漏れたときに期限までプロキシから配られてしまう。
+
+期限は ATTACHMENT_URL_TTL ごとの区切りに丸めるので、
+同じ区切りの間は同じ URL になり、ブラウザのキャッシュに再利用される。
+"""
+import hmac
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.http import urlencode
+
+SIGNATURE_SALT = "matching.attachments"
+
+
+def _signature(path, expires):
+    return signing.Signer(salt=SIGNATURE_SALT).signature(f"{path}:{expires}")
+
+
+def _expires(now=None):
+    """今の区切りの次の区切りまで有効（TTL 〜 2×TTL 秒）"""
+    ttl = settings.ATTACHMENT_URL_TTL
+    now = int(now if now is not None else time.time())
+    return (now // ttl + 2) * ttl
+
+
+def is_attachment_path(path):
+    return any(path.startswith(prefix) for prefix in settings.MEDIA_PRIVATE_PREFIXES)
+
+
+def attachment_url(fieldfile):
+    """
+    添付ファイルの署名付き URL（ファイルがなければ空文字）。
+    呼び出し側でルームのメンバーであることを確認しておくこと。
+    """
+    if not fieldfile:
+        return ""
+    path = fieldfile.name
+    expires = _expires()
+    query = urlencode({"e": expires, "s": _signature(path, expires)})
+    return f"{reverse('chat_attachment', args=[path])}?{query}"
+
+
+def verify_attachment(path, expires, signature):
+    """
+    署名と期限を確かめる。OK なら残り秒数、だめなら None。
+    """
+    if not is_attachment_path(path):
+        return None
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+
+    remaining = expires - int(time.time())
+    if remaining <= 0:
+        return None
+    # compare_digest は ASCII 以外の str を渡すと TypeError になるので bytes で比べる
+    if not hmac.compare_digest(_signature(path, expires).encode(), (signature or "").encode()):
+        return None
+    return remaining
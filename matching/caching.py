@@ -0,0 +1,81 @@
+# matching/caching.py
+"""
+Django のキャッシュフレームワーク（settings.CACHES）の上に載せた、ページ / 断片キャッシュ。
+
+  cache_public_page : 利用規約などの静的ページを、未ログインのときだけまるごと覚えておく。
+                      ログイン中はナビの通知バッジが人ごとに違うので毎回描画する
+                      （= ログイン状態で出し分ける）。
+  掲示板一覧        : 投稿リスト部分を {% cache %} の断片キャッシュにする。
+                      キーに board_version() を含め、BoardPost の作成・削除で
+                      bump_board_version() すると全部のページが一斉に作り直しになる。
+
+※ CACHE_BACKEND=locmem（デフォルト）だとバージョンの更新は保存したプロセスにしか見えず、
+  他のワーカーでは最長 BOARD_CACHE_TIMEOUT 秒、古い一覧が出うる。
+  ワーカー間で共有したいときは CACHE_BACKEND=file にする。
+"""
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+PAGE_KEY_PREFIX = "matching:page"
+BOARD_VERSION_KEY = "matching:board:version"
+
+
+def _page_key(request):
+    return f"{PAGE_KEY_PREFIX}:{request.get_full_path()}"
+
+
+def _cacheable(request, response):
+    """他の人に同じものを返してよいレスポンスか"""
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    # CSRF トークンを埋め込んだページ・messages を表示したページは人ごとに違う
+    if request.META.get("CSRF_COOKIE_NEEDS_UPDATE"):
+        return False
+    storage = getattr(request, "_messages", None)
+    if storage is not None and storage.used:
+        return False
+    return True
+
+
+def cache_public_page(view):
+    """未ログインの GET / HEAD だけ、レスポンスを PAGE_CACHE_TIMEOUT 秒キャッシュする"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response = response.render()
+        if _cacheable(request, response):
+            cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
+
+
+# ========== 掲示板一覧の断片キャッシュ ==========
+
+
+def board_version():
+    """掲示板の断片キャッシュのキーに混ぜるバージョン"""
+    version = cache.get(BOARD_VERSION_KEY)
+    if version is None:
+        version = bump_board_version()
+    return version
+
+
+def bump_board_version():
+    """掲示板の断片キャッシュをまとめて無効にする（signals.py から呼ばれる）"""
+    version = time.time_ns()
+    cache.set(BOARD_VERSION_KEY, version, None)
+    return version
@@ -0,0 +1,262 @@
+# matching/channel_layers.py
+"""
+SQLite ファイルを共有して使うチャネルレイヤー。
+
+InMemoryChannelLayer はプロセスの中だけで完結するので、
+daphne / uvicorn のワーカーを複数立てると、別プロセスに入った相手に
+通話のシグナリング（offer / answer / candidate）が届かない。
+
+本番は Redis（channels_redis）を使う想定だが、Redis を用意できない環境や
+ローカルでの複数プロセス確認用に、同じマシン上のプロセス同士で
+1つの SQLite ファイルをキューとして共有するレイヤーを用意しておく。
+
+  CHANNEL_LAYERS = {
+      "default": {
+          "BACKEND": "matching.channel_layers.SQLiteChannelLayer",
+          "CONFIG": {"path": "/path/to/channels.sqlite3"},
+      },
+  }
+
+受信はポーリング（最短 poll_interval 〜 最長 max_poll_interval 秒）。
+同じプロセス内の宛先にはポーリングを待たずにすぐ起こす。
+"""
+import asyncio
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_channel_idx
+    ON channel_messages (channel, id);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    grp TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (grp, channel)
+);
+"""
+
+# 期限切れメッセージの掃除は send 何回かに1回
+CLEANUP_EVERY = 200
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.05,
+    ):
+        super().__init__(
+            expiry=expiry,
+            capacity=capacity,
+            channel_capacity=channel_capacity,
+        )
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+
+        # SQLite への書き込みは専用スレッド1本に寄せる（接続もそのスレッドで持つ）
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-layer")
+        self._local = threading.local()
+        self._sends = 0
+
+        # このプロセス内で受信待ちしているチャネル → 起こすための Event
+        self._waiters = {}
+
+    # ---- SQLite まわり（専用スレッドで実行される） ----
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _insert(self, conn, channel, payload, now):
+        """容量オーバーなら False"""
+        (queued,) = conn.execute(
+            "SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?",
+            (channel, now),
+        ).fetchone()
+        if queued >= self.get_capacity(channel):
+            return False
+        conn.execute(
+            "INSERT INTO channel_messages (channel, payload, expires) VALUES (?, ?, ?)",
+            (channel, payload, now + self.expiry),
+        )
+        return True
+
+    def _send_sync(self, channel, payload):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ok = self._insert(conn, channel, payload, now)
+
+        self._sends += 1
+        if self._sends % CLEANUP_EVERY == 0:
+            self._cleanup_sync(conn, now)
+        return ok
+
+    def _pop_sync(self, channel):
+        """
+        先頭のメッセージを1件取り出す（なければ None）。
+        空のキューを見るだけなら書き込みロックは取らない（WAL なので SELECT は書き込みと並行できる）。
+        ロックを取るのは行があったときの DELETE だけにして、待ち受けているだけの接続が
+        他のプロセスの送受信を止めないようにする。
+        """
+        conn = self._connection()
+        while True:
+            row = conn.execute(
+                "SELECT id, payload FROM channel_messages "
+                "WHERE channel = ? AND expires > ? ORDER BY id LIMIT 1",
+                (channel, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            deleted = conn.execute(
+                "DELETE FROM channel_messages WHERE id = ?", (row[0],)
+            ).rowcount
+            if deleted:
+                return row[1]
+            # 同じチャネルを別の受信者が先に取った → 次の行を見る
+
+    def _group_add_sync(self, group, channel):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO channel_groups (grp, channel, expires) "
+                "VALUES (?, ?, ?)",
+                (group, channel, time.time() + self.group_expiry),
+            )
+
+    def _group_discard_sync(self, group, channel):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM channel_groups WHERE grp = ? AND channel = ?",
+                (group, channel),
+            )
+
+    def _group_send_sync(self, group, payload):
+        """グループのメンバーに配る。容量オーバーのメンバーは黙って飛ばす（channels_redis と同じ）"""
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            channels = [
+                channel
+                for (channel,) in conn.execute(
+                    "SELECT channel FROM channel_groups WHERE grp = ? AND expires > ?",
+                    (group, now),
+                )
+            ]
+            for channel in channels:
+                self._insert(conn, channel, payload, now)
+        return channels
+
+    def _cleanup_sync(self, conn, now):
+        with conn:
+            conn.execute("DELETE FROM channel_messages WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM channel_groups WHERE expires <= ?", (now,))
+
+    def _flush_sync(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM channel_messages")
+            conn.execute("DELETE FROM channel_groups")
+
+    # ---- チャネルレイヤー API ----
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+
+        payload = msgpack.packb(message, use_bin_type=True)
+        if not await self._run(self._send_sync, channel, payload):
+            raise ChannelFull(channel)
+        self._wake(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+
+        event = self._waiters.setdefault(channel, asyncio.Event())
+        delay = self.poll_interval
+        try:
+            while True:
+                payload = await self._run(self._pop_sync, channel)
+                if payload is not None:
+                    return msgpack.unpackb(payload, raw=False)
+
+                # 別プロセスからの送信はポーリングで拾う（だんだん間隔を空ける）
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=delay)
+                    delay = self.poll_interval
+                except asyncio.TimeoutError:
+                    delay = min(delay * 2, self.max_poll_interval)
+        finally:
+            if self._waiters.get(channel) is event:
+                del self._waiters[channel]
+
+    async def new_channel(self, prefix="specific"):
+        return f"{prefix}.sqlite.{secrets.token_hex(12)}"
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add_sync, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_discard_sync, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+
+        payload = msgpack.packb(message, use_bin_type=True)
+        for channel in await self._run(self._group_send_sync, group, payload):
+            self._wake(channel)
+
+    async def flush(self):
+        await self._run(self._flush_sync)
+
+    async def close(self):
+        pass
+
+    def _wake(self, channel):
+        """同じプロセス内で待っている受信者がいれば、ポーリングを待たずに起こす"""
+        event = self._waiters.get(channel)
+        if event is not None:
+            event.set()
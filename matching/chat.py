@@ -0,0 +1,165 @@
+# matching/chat.py
+"""
+チャットルームの既読状態（ChatReadState）の非正規化フィールドを保つヘルパー。
+
+  - ルーム作成時      : 参加者2人分の ChatReadState を用意
+  - メッセージ保存時  : 最新メッセージ・最終アクティビティを更新し、受信側の未読数 +1
+  - ルームを開いたとき: 未読数を 0 に戻して既読時刻を更新
+
+チャット一覧はこれで ChatReadState の1クエリだけで描画できる。
+
+メッセージ履歴のページング（新しい方から N 件ずつ、(created_at, id) のカーソル）もここ。
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import F, Q
+from django.utils import dateformat, timezone
+
+from .attachments import attachment_url
+from .models import ChatReadState, Message
+from .pagination import encode_cursor, decode_cursor
+
+# 一度も開いていないルームの既読時刻
+NEVER_READ = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+PREVIEW_LENGTH = 100
+
+# チャット画面で一度に読み込むメッセージ数
+CHAT_PAGE_SIZE = 50
+
+HISTORY_CURSOR_SALT = "matching.chat.history"
+
+
+def message_preview(message):
+    """チャット一覧に出す最新メッセージの抜粋（画像/動画のみなら空）"""
+    return (message.text or "")[:PREVIEW_LENGTH]
+
+
+def ensure_read_states(room):
+    """ルームの参加者2人分の ChatReadState を（なければ）作る"""
+    ChatReadState.objects.bulk_create(
+        [
+            ChatReadState(
+                user_id=user_id,
+                room=room,
+                last_read_at=NEVER_READ,
+                last_activity_at=room.created_at,
+            )
+            for user_id in (room.user1_id, room.user2_id)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def record_message(message):
+    """新しいメッセージを両者の ChatReadState に反映する"""
+    states = ChatReadState.objects.filter(room_id=message.room_id)
+    values = {
+        "last_message": message,
+        "last_message_preview": message_preview(message),
+        "last_activity_at": message.created_at,
+    }
+    if states.update(**values) < 2:
+        # 既読状態がまだないルーム（古いデータなど）は作ってからもう一度
+        ensure_read_states(message.room)
+        states.update(**values)
+
+    states.exclude(user_id=message.sender_id).update(
+        unread_count=F("unread_count") + 1,
+    )
+
+
+def mark_room_read(me, room):
+    """自分の既読状態を「今」にして未読数を 0 に戻す"""
+    mine = ChatReadState.objects.filter(user=me, room=room)
+    values = {"last_read_at": timezone.now(), "unread_count": 0}
+    if not mine.update(**values):
+        ensure_read_states(room)
+        mine.update(**values)
+
+
+# ========== メッセージ履歴 ==========
+
+
+def _message_page_queryset(room, before, page_size):
+    """before より古いメッセージを新しい順に page_size + 1 件取る QuerySet"""
+    qs = (
+        Message.objects.filter(room=room)
+        .select_related("sender")
+        .order_by("-created_at", "-id")
+    )
+
+    position = decode_cursor(before, salt=HISTORY_CURSOR_SALT)
+    if position:
+        created_at = datetime.fromisoformat(position["t"])
+        qs = qs.filter(
+            Q(created_at__lt=created_at)
+            | Q(created_at=created_at, id__lt=position["id"])
+        )
+
+    return qs[: page_size + 1]
+
+
+def fetch_message_page(room, before=None, page_size=CHAT_PAGE_SIZE):
+    """
+    before（カーソル）より古いメッセージを新しい方から page_size 件取り、
+    表示用に古い → 新しい順に並べて返す。
+    さらに古いものがあれば、そのためのカーソルも返す（なければ None）。
+    """
+    rows = list(_message_page_queryset(room, before, page_size))
+    page = rows[:page_size]
+
+    older_cursor = None
+    if len(rows) > page_size:
+        oldest = page[-1]
+        older_cursor = encode_cursor(
+            {"t": oldest.created_at.isoformat(), "id": oldest.id},
+            salt=HISTORY_CURSOR_SALT,
+        )
+
+    page.reverse()
+    return page, older_cursor
+
+
+def message_payload(message):
+    """
+    フロント（WebSocket / 履歴 API）に渡すメッセージ1件分の JSON。
+    添付ファイルは署名付き URL（呼び出し側でメンバー確認済みの前提）。
+    """
+    created_at = timezone.localtime(message.created_at)
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "sender_nickname": message.sender.nickname,
+        "text": message.text,
+        "image_url": attachment_url(message.image),
+        "video_url": attachment_url(message.video),
+        "created_at": created_at.isoformat(),
+        "created_at_display": dateformat.format(created_at, "Y-m-d H:i"),
+    }
+
+
+def broadcast_message(message):
+    """
+    HTTP 側で作ったメッセージ（分割アップロードの動画など）を、
+    ルームを開いている WebSocket（ChatConsumer）にも流す。
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    async_to_sync(layer.group_send)(
+        f"chat_{message.room_id}",
+        {"type": "chat_message", "sender": None, "data": message_payload(message)},
+    )
+
+
+def close_room_sockets(room_id):
+    """
+    ブロック・ルームの削除で使えなくなったルームの WebSocket（ChatConsumer）を閉じさせる。
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    async_to_sync(layer.group_send)(f"chat_{room_id}", {"type": "chat_closed"})
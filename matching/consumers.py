@@ -1,39 +1,66 @@
 # matching/consumers.py
+import asyncio
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .chat import mark_room_read, message_payload
+from .models import ChatRoom, Message
+from .profiles import get_profile
+from .relations import is_blocked_between
 
 
 class CallConsumer(AsyncWebsocketConsumer):
+    """
+    WebRTC 通話のシグナリング中継。
+      /ws/call/<room_id>/
+
+    相手のチャネル名がわかったら、グループ全体へのブロードキャストではなく
+    channel_layer.send で相手にだけ直接送る（自分宛てのコピーを捨てる無駄をなくす）。
+    trickle ICE の candidate は短い間まとめてから1メッセージで送る。
+
+    相手を知る流れ:
+      接続時に peer_join をグループへ → 受け取った側が相手を記録し、
+      peer_hello で自分のチャネル名を直接返す → 双方が相手を知る
+    """
+
+    # candidate をまとめる時間（秒）と最大件数
+    ICE_BATCH_DELAY = 0.02
+    ICE_BATCH_MAX = 20
+
     async def connect(self):
         # /ws/call/<room_id>/ から room_id を取得
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
         self.room_group_name = f"call_{self.room_id}"
+        self.peer_channel = None
+        self.pending_candidates = []
+        self.flush_task = None
 
         # グループに参加
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
-        # 他の参加者に「誰か入ったよ」と通知（必要なら使う）
+        # 他の参加者に「誰か入ったよ」と通知（相手のチャネル名を知るのにも使う）
         await self.channel_layer.group_send(
             self.room_group_name,
             {
-                "type": "signal_message",
-                "event": "join",
+                "type": "peer_join",
                 "sender": self.channel_name,
-                "data": None,
             },
         )
 
     async def disconnect(self, close_code):
-        # 離脱通知
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        # 残っている candidate を送ってから離脱通知
+        await self.flush_candidates()
+        await self.deliver(
             {
                 "type": "signal_message",
                 "event": "leave",
                 "sender": self.channel_name,
                 "data": None,
-            },
+            }
         )
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
@@ -55,30 +82,268 @@ class CallConsumer(AsyncWebsocketConsumer):
         event = payload.get("event")
         data = payload.get("data")
 
-        # ルーム内の全員にブロードキャスト（自分自身には後で除外）
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        # candidate はまとめて送る
+        if event == "candidate":
+            self.pending_candidates.append(data)
+            if len(self.pending_candidates) >= self.ICE_BATCH_MAX:
+                await self.flush_candidates()
+            elif self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush_candidates_later())
+            return
+
+        # それ以外は順番が崩れないよう、溜まっている candidate を先に送る
+        await self.flush_candidates()
+        await self.deliver(
             {
                 "type": "signal_message",
                 "event": event,
                 "sender": self.channel_name,
                 "data": data,
-            },
+            }
+        )
+
+    # ---- 送信まわり ----
+
+    async def deliver(self, message):
+        """相手がわかっていれば直接、まだならグループ経由で送る"""
+        if self.peer_channel:
+            await self.channel_layer.send(self.peer_channel, message)
+        else:
+            await self.channel_layer.group_send(self.room_group_name, message)
+
+    async def flush_candidates_later(self):
+        await asyncio.sleep(self.ICE_BATCH_DELAY)
+        self.flush_task = None
+        await self.flush_candidates()
+
+    async def flush_candidates(self):
+        if self.flush_task is not None and self.flush_task is not asyncio.current_task():
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        if not self.pending_candidates:
+            return
+        candidates, self.pending_candidates = self.pending_candidates, []
+        await self.deliver(
+            {
+                "type": "signal_batch",
+                "event": "candidate",
+                "sender": self.channel_name,
+                "data": candidates,
+            }
         )
 
+    # ---- channel layer から呼ばれるハンドラ ----
+
+    async def peer_join(self, event):
+        """相手が入ってきた：相手を記録して、自分のチャネル名を直接教える"""
+        if event["sender"] == self.channel_name:
+            return
+
+        self.peer_channel = event["sender"]
+        await self.channel_layer.send(
+            self.peer_channel,
+            {"type": "peer_hello", "sender": self.channel_name},
+        )
+        await self.send_signal("join", None)
+
+    async def peer_hello(self, event):
+        """先にいた相手からの返事：相手を記録する"""
+        self.peer_channel = event["sender"]
+
     async def signal_message(self, event):
         """
-        group_send で呼ばれる。
-        自分が送ったものはスキップして「相手」にだけ送る。
+        相手から届いたシグナリングをフロントに渡す。
+        グループ経由で届いた自分自身のものはスキップする。
         """
         if event["sender"] == self.channel_name:
             return
 
-        await self.send(
-            text_data=json.dumps(
+        if event["event"] == "leave" and event["sender"] == self.peer_channel:
+            self.peer_channel = None
+
+        await self.send_signal(event["event"], event.get("data"))
+
+    async def signal_batch(self, event):
+        """まとめて届いた candidate を1件ずつフロントに渡す（フロント側は今まで通り）"""
+        if event["sender"] == self.channel_name:
+            return
+
+        for data in event["data"]:
+            await self.send_signal(event["event"], data)
+
+    async def send_signal(self, name, data):
+        await self.send(text_data=json.dumps({"event": name, "data": data}))
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    チャットルームのリアルタイム配信。
+      /ws/chat/<room_id>/
+
+    フロントとやりとりする JSON は CallConsumer と同じ形:
+      { "event": "message" | "typing" | "read", "data": {...} }
+
+      - message : メッセージを保存してルーム全員に配信
+      - typing  : 入力中表示（相手にだけ届く）
+      - read    : 既読にして、相手に既読を知らせる
+
+    参加者・ブロックの確認は connect のあとも続ける。
+      - ブロック・ルームの削除があると signals.py から chat_closed がグループに届くので閉じる
+      - message / read の前にもルームが残っていて、ブロックされていないかを DB で確かめる
+        （chat_closed が届く前に送られたぶんや、別プロセスのレイヤーで取りこぼしたぶん）
+      - それでも保存の瞬間にルームが消えていたら、例外にせず閉じる
+    """
+
+    async def connect(self):
+        self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
+        self.room_group_name = f"chat_{self.room_id}"
+
+        # AuthMiddlewareStack がセッションからユーザーを入れてくれる
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        # 参加者でない / ブロック関係にあるなら接続させない
+        self.me = await self.get_member_profile(user)
+        if self.me is None:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, "me", None) is not None:
+            await self.channel_layer.group_discard(
+                self.room_group_name, self.channel_name
+            )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not text_data:
+            return
+
+        try:
+            payload = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+
+        event = payload.get("event")
+        data = payload.get("data") or {}
+
+        if event in ("message", "read") and not await self.is_still_member():
+            await self.close()
+            return
+
+        if event == "message":
+            text = str(data.get("text", "")).strip()
+            if not text:
+                return
+            message = await self.save_message(text)
+            if message is None:
+                await self.close()
+                return
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    "type": "chat_message",
+                    "sender": self.channel_name,
+                    "data": message,
+                },
+            )
+
+        elif event == "typing":
+            await self.channel_layer.group_send(
+                self.room_group_name,
                 {
-                    "event": event["event"],
-                    "data": event.get("data"),
-                }
+                    "type": "chat_typing",
+                    "sender": self.channel_name,
+                    "data": {"user_id": self.me.id},
+                },
             )
+
+        elif event == "read":
+            read_at = await self.mark_read()
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    "type": "chat_read",
+                    "sender": self.channel_name,
+                    "data": {"user_id": self.me.id, "read_at": read_at},
+                },
+            )
+
+    # ---- group_send で呼ばれるハンドラ ----
+
+    async def chat_message(self, event):
+        # メッセージは送信者の画面にも返す（保存済みの内容で描画するため）
+        await self.send_event("message", event["data"])
+
+    async def chat_typing(self, event):
+        if event["sender"] == self.channel_name:
+            return
+        await self.send_event("typing", event["data"])
+
+    async def chat_read(self, event):
+        if event["sender"] == self.channel_name:
+            return
+        await self.send_event("read", event["data"])
+
+    async def chat_closed(self, event):
+        # ブロック・ルームの削除（signals.py の close_room_sockets から）
+        await self.close()
+
+    async def send_event(self, name, data):
+        await self.send(text_data=json.dumps({"event": name, "data": data}))
+
+    # ---- DB アクセス ----
+
+    @database_sync_to_async
+    def get_member_profile(self, user):
+        me = get_profile(user)
+        room = (
+            ChatRoom.objects.filter(pk=self.room_id)
+            .select_related("user1", "user2")
+            .first()
         )
+        if me is None or room is None:
+            return None
+
+        if room.user1_id == me.id:
+            partner = room.user2
+        elif room.user2_id == me.id:
+            partner = room.user1
+        else:
+            return None
+
+        if is_blocked_between(me, partner):
+            return None
+
+        self.room = room
+        return me
+
+    @database_sync_to_async
+    def is_still_member(self):
+        """connect のあとにルームが消えたり、ブロックされたりしていないか"""
+        if not ChatRoom.objects.filter(pk=self.room_id).exists():
+            return False
+        partner = self.room.user2 if self.room.user1_id == self.me.id else self.room.user1
+        return not is_blocked_between(self.me, partner)
+
+    @database_sync_to_async
+    def save_message(self, text):
+        """保存したメッセージの payload。ルームがもうなければ None"""
+        # 未読数・通知キャッシュの更新は post_save シグナル側で行われる
+        try:
+            message = Message.objects.create(room=self.room, sender=self.me, text=text)
+        except IntegrityError:
+            # 確認のあとにルームが消えた（外部キー違反）
+            return None
+        return message_payload(message)
+
+    @database_sync_to_async
+    def mark_read(self):
+        mark_room_read(self.me, self.room)
+        return timezone.now().isoformat()
+
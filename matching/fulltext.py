@@ -0,0 +1,209 @@
+# matching/fulltext.py
+"""
+プロフィール（自己紹介・職業・エリア）と掲示板（タイトル・本文）の全文検索。
+
+日本語は空白で単語が区切られないので、文字の 2-gram（bigram）で索引を作る。
+
+  「東京でカフェ巡り」 → 東京 京で でカ カフ フェ ェ巡 巡り り
+
+塊の最後の1文字も単独で入れておく。1文字の検索語は「その文字で始まる語」の前方一致で
+探すので、最後の文字（「東京」の「京」）は bigram の先頭に来ず、これがないと見つからない。
+
+索引は「bigram を空白でつないだ文字列」として持ち、DB ごとの全文検索に任せる。
+
+  SQLite     : FTS5 の仮想テーブル（rowid = 元の行の pk）
+  PostgreSQL : tsvector 列 + GIN インデックス（'simple' 設定）
+
+filter_matching(qs, kind, q) で qs に「pk IN (索引の検索)」のサブクエリを足して使う。
+遅延評価のままなので async ビューでもそのまま使え、既存の絞り込み・並び順と1クエリで組み合わさる。
+（一覧の並び順はユーザーが選んだもの（おすすめ順・新着順など）なので、関連度では並べない）
+
+索引は signals.py から保存・削除と同じトランザクションで更新する。
+作り直すときは python manage.py rebuild_search_index。
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+PROFILE = "profile"
+BOARD_POST = "board_post"
+
+# 種類 → (索引のテーブル名, 索引に入れるフィールド)
+INDEXES = {
+    PROFILE: ("matching_profile_search", ("nickname", "bio", "job", "area")),
+    BOARD_POST: ("matching_boardpost_search", ("title", "body")),
+}
+
+# 記号・空白で区切り、それぞれの塊を bigram にする
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """全角英数 → 半角、大文字 → 小文字などをそろえる"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def bigrams(text):
+    """文字列 → bigram のリスト（1文字だけの塊はそのまま）"""
+    grams = []
+    for word in WORD_RE.findall(normalize(text)):
+        if len(word) == 1:
+            grams.append(word)
+        else:
+            grams.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+def _trailing_unigrams(text):
+    """各塊の最後の1文字（1文字だけの塊は bigrams() に入っているので除く）"""
+    return [word[-1] for word in WORD_RE.findall(normalize(text)) if len(word) > 1]
+
+
+def document(obj, kind):
+    """索引に入れる文字列（bigram を空白でつないだもの）"""
+    fields = INDEXES[kind][1]
+    text = " ".join(str(getattr(obj, f) or "") for f in fields)
+    return " ".join(bigrams(text) + _trailing_unigrams(text))
+
+
+def _query_terms(q):
+    """検索語 → (bigram のリスト, 前方一致か)。1文字だけなら前方一致で探す"""
+    grams = list(dict.fromkeys(bigrams(q)))
+    prefix = len(grams) == 1 and len(grams[0]) == 1
+    return grams, prefix
+
+
+# ========== DB ごとの実装 ==========
+
+
+class SQLiteBackend:
+    """FTS5。unicode61 で空白区切りの bigram をそのまま1トークンとして扱う"""
+
+    def create(self, cursor, table):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+            f"USING fts5(document, tokenize='unicode61 remove_diacritics 0')"
+        )
+
+    def drop(self, cursor, table):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def upsert(self, cursor, table, pk, doc):
+        cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [pk])
+        cursor.execute(f"INSERT INTO {table} (rowid, document) VALUES (%s, %s)", [pk, doc])
+
+    def delete(self, cursor, table, pk):
+        cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [pk])
+
+    def match_sql(self, table, grams, prefix):
+        # "東京" "京都" → すべての bigram を含む（AND）
+        match = " ".join(f'"{g}"' for g in grams) + ("*" if prefix else "")
+        return f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match]
+
+
+class PostgresBackend:
+    """tsvector + GIN。bigram は 'simple' 設定でそのまま語として入る"""
+
+    def create(self, cursor, table):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id bigint PRIMARY KEY, document tsvector NOT NULL)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_gin ON {table} USING gin (document)")
+
+    def drop(self, cursor, table):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def upsert(self, cursor, table, pk, doc):
+        cursor.execute(
+            f"INSERT INTO {table} (id, document) VALUES (%s, to_tsvector('simple', %s)) "
+            f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+            [pk, doc],
+        )
+
+    def delete(self, cursor, table, pk):
+        cursor.execute(f"DELETE FROM {table} WHERE id = %s", [pk])
+
+    def _tsquery(self, grams, prefix):
+        if prefix:
+            return "to_tsquery('simple', %s)", grams[0] + ":*"
+        # plainto_tsquery はすべての bigram の AND になる
+        return "plainto_tsquery('simple', %s)", " ".join(grams)
+
+    def match_sql(self, table, grams, prefix):
+        query, term = self._tsquery(grams, prefix)
+        return f"SELECT id FROM {table} WHERE document @@ {query}", [term]
+
+
+def get_backend(conn=None):
+    vendor = (conn or connection).vendor
+    if vendor == "sqlite":
+        return SQLiteBackend()
+    if vendor == "postgresql":
+        return PostgresBackend()
+    raise NotImplementedError(f"{vendor} の全文検索には対応していません")
+
+
+# ========== 索引の作成・更新・検索 ==========
+
+
+def create_indexes(conn=None):
+    conn = conn or connection
+    backend = get_backend(conn)
+    with conn.cursor() as cursor:
+        for table, _fields in INDEXES.values():
+            backend.create(cursor, table)
+
+
+def drop_indexes(conn=None):
+    conn = conn or connection
+    backend = get_backend(conn)
+    with conn.cursor() as cursor:
+        for table, _fields in INDEXES.values():
+            backend.drop(cursor, table)
+
+
+def index_object(obj, kind):
+    table = INDEXES[kind][0]
+    with connection.cursor() as cursor:
+        get_backend().upsert(cursor, table, obj.pk, document(obj, kind))
+
+
+def remove_object(pk, kind):
+    table = INDEXES[kind][0]
+    with connection.cursor() as cursor:
+        get_backend().delete(cursor, table, pk)
+
+
+def rebuild(kind, objects, conn=None):
+    """索引を空にして objects で作り直す（マイグレーション / 管理コマンド用）"""
+    conn = conn or connection
+    backend = get_backend(conn)
+    table = INDEXES[kind][0]
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+        count = 0
+        for obj in objects:
+            backend.upsert(cursor, table, obj.pk, document(obj, kind))
+            count += 1
+    return count
+
+
+def filter_matching(qs, kind, q):
+    """
+    qs を検索語 q にマッチするものだけに絞る（サブクエリなのでここでは DB に触らない）。
+    検索語から bigram が1つも作れなければ0件にする。
+    """
+    grams, prefix = _query_terms(q)
+    if not grams:
+        return qs.none()
+    sql, params = get_backend().match_sql(INDEXES[kind][0], grams, prefix)
+    return qs.filter(pk__in=RawSQL(sql, params))
+
+
+def needs_reindex(kind, update_fields):
+    """save(update_fields=...) で索引の対象フィールドが変わったか"""
+    if update_fields is None:
+        return True
+    return bool(set(update_fields) & set(INDEXES[kind][1]))
@@ -0,0 +1,203 @@
+# matching/images.py
+"""
+アップロード画像の派生サイズ（レンディション）を作るパイプライン。
+
+  icon   : 丸アイコン用（96x96 切り抜き）
+  thumb  : 一覧カード用（360x480 切り抜き, 3:4）
+  detail : 詳細ページ用（長辺 1080 に収める）
+
+それぞれ JPEG と WebP を作り、EXIF（位置情報など）は向きだけ反映して捨てる。
+生成はリクエストのスレッドではなく、コミット後にワーカースレッドのプールで行う。
+
+元画像も /media/ から配るので、ストレージに保存する前に EXIF を取り除いておく
+（strip_upload_metadata。signals.py の pre_save から呼ぶ）。
+
+保存先は元ファイル名（拡張子まで）から決まる:
+  avatars/foo.png → renditions/avatars/foo.png.thumb.jpg / renditions/avatars/foo.png.thumb.webp
+拡張子を落とすと avatars/foo.png と avatars/foo.jpg が同じレンディションを指してしまうので残す。
+まだできていないうちは、テンプレートからは元画像の URL が使われる。
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITION_ROOT = "renditions"
+
+# name: (幅, 高さ, 切り抜くか)
+RENDITIONS = {
+    "icon": (96, 96, True),
+    "thumb": (360, 480, True),
+    "detail": (1080, 1080, False),
+}
+
+FORMATS = {
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+}
+
+# 元画像を EXIF なしで保存し直すときの形式（GIF などはそのまま）
+STRIP_FORMATS = {
+    "JPEG": ("JPEG", {"quality": 90}),
+    "MPO": ("JPEG", {"quality": 90}),  # iPhone などの JPEG
+    "PNG": ("PNG", {"optimize": True}),
+    "WEBP": ("WEBP", {"quality": 90}),
+}
+
+# EXIF の Orientation タグ
+ORIENTATION = 0x0112
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "IMAGE_WORKERS", 2),
+    thread_name_prefix="renditions",
+)
+
+# 生成済みとわかっているレンディション名（毎回ストレージを見に行かないため）
+_known = set()
+
+
+def rendition_name(name, rendition, fmt="jpg"):
+    """元ファイル名 → レンディションの保存名（元の拡張子も名前に残す）"""
+    return f"{RENDITION_ROOT}/{name}.{rendition}.{fmt}"
+
+
+def rendition_exists(name):
+    if name in _known:
+        return True
+    if default_storage.exists(name):
+        _known.add(name)
+        return True
+    return False
+
+
+def rendition_url(fieldfile, rendition, fmt="jpg", fallback=True):
+    """
+    レンディションの URL。まだなければ元画像の URL（fallback=False なら空文字）。
+    """
+    if not fieldfile:
+        return ""
+    name = rendition_name(fieldfile.name, rendition, fmt)
+    if rendition_exists(name):
+        return default_storage.url(name)
+    return fieldfile.url if fallback else ""
+
+
+def _render(image, size, crop):
+    if crop:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    return copy
+
+
+def generate_renditions(name):
+    """元画像 name からすべてのレンディションを作って保存する"""
+    with default_storage.open(name, "rb") as f:
+        image = Image.open(f)
+        image.load()
+
+    # スマホ写真の向きを反映してから RGB に（EXIF はここで捨てる）
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    for rendition, (width, height, crop) in RENDITIONS.items():
+        rendered = _render(image, (width, height), crop)
+        for fmt, (pil_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            rendered.save(buffer, format=pil_format, **options)
+
+            target = rendition_name(name, rendition, fmt)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+            _known.add(target)
+
+
+def _without_metadata(f, name):
+    """
+    画像ファイル f → EXIF を取り除いた ContentFile（名前は name）。
+    EXIF がない・画像として開けない・対象外の形式なら None。
+    """
+    f.seek(0)
+    try:
+        image = Image.open(f)
+        image.load()
+    except Exception:
+        # 画像かどうかの判定はフォーム側に任せる
+        return None
+    finally:
+        f.seek(0)
+
+    if image.format not in STRIP_FORMATS or not (image.getexif() or "exif" in image.info):
+        return None
+
+    pil_format, options = STRIP_FORMATS[image.format]
+    options = dict(options)
+    if pil_format == "JPEG" and image.getexif().get(ORIENTATION, 1) == 1:
+        # 回転しなくてよければ元の量子化テーブルのまま保存する（再圧縮で劣化させない）
+        options["quality"] = "keep"
+    else:
+        # 向きは画素に反映してから捨てる
+        image = ImageOps.exif_transpose(image)
+    if image.info.get("icc_profile"):
+        options["icc_profile"] = image.info["icc_profile"]
+
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format, **options)
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+def strip_metadata(fieldfile):
+    """まだ保存していないアップロード画像 → EXIF を取り除いた ContentFile（要らなければ None）"""
+    if not fieldfile or fieldfile._committed:
+        return None
+    return _without_metadata(fieldfile.file, os.path.basename(fieldfile.name))
+
+
+def strip_stored_metadata(name):
+    """保存済みの画像 name から EXIF を取り除いて上書きする。書き換えたら True"""
+    with default_storage.open(name, "rb") as f:
+        cleaned = _without_metadata(f, name)
+    if cleaned is None:
+        return False
+    default_storage.delete(name)
+    default_storage.save(name, cleaned)
+    return True
+
+
+def strip_upload_metadata(instance, field_name):
+    """instance.<field_name> が新しいアップロードなら、EXIF を取り除いたものに差し替える"""
+    cleaned = strip_metadata(getattr(instance, field_name))
+    if cleaned is not None:
+        setattr(instance, field_name, cleaned)
+
+
+def _generate_safely(name):
+    try:
+        generate_renditions(name)
+    except Exception:
+        logger.exception("failed to generate renditions for %s", name)
+
+
+def enqueue_renditions(fieldfile):
+    """
+    コミット後にワーカープールでレンディションを作る。
+    すでにあるもの（同じファイル名で生成済み）は作り直さない。
+    """
+    if not fieldfile:
+        return
+    name = fieldfile.name
+    if rendition_exists(rendition_name(name, "detail", "webp")):
+        return
+
+    if getattr(settings, "IMAGE_RENDITIONS_SYNC", False):
+        transaction.on_commit(lambda: _generate_safely(name))
+    else:
+        transaction.on_commit(lambda: _executor.submit(_generate_safely, name))
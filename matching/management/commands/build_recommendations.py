@@ -0,0 +1,41 @@
+# matching/management/commands/build_recommendations.py
+"""
+検索タブの「おすすめ順」を全員分まとめて事前計算する（matching.recommendations）。
+
+  python manage.py build_recommendations               # 未計算・stale な人だけ（数分おき）
+  python manage.py build_recommendations --full        # 全員作り直す（1日1回など）
+  python manage.py build_recommendations --workers 4   # 並列に計算するプロセス数
+
+cron などで定期的に回す想定。未計算・stale な人は、検索タブを開いたときに
+これまでどおり DB のクエリで並べるので、止まっていても表示が壊れることはない。
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from matching.recommendations import build, TOP_K, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "おすすめ順の上位候補を全ユーザー分事前計算する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="stale でない人も含めて全員作り直す")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1,
+            help="並列に計算するプロセス数",
+        )
+        parser.add_argument("--top-k", type=int, default=TOP_K, help="1人あたり保存する件数")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="1タスクで計算する人数")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = build(
+            full=options["full"],
+            workers=options["workers"],
+            top_k=options["top_k"],
+            chunk_size=options["chunk_size"],
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{count} 人分のおすすめを計算しました（{elapsed:.1f} 秒）"))
@@ -0,0 +1,224 @@
+# matching/management/commands/channel_layer_loadtest.py
+"""
+チャネルレイヤーが「プロセスをまたいで」通話のシグナリングを中継できるかの負荷テスト。
+
+  CHANNEL_LAYER_BACKEND=sqlite python manage.py channel_layer_loadtest --processes 4 --pairs 100
+
+通話ペアごとに、発信側と着信側を別々のプロセスに置き、CallConsumer と同じ流れで
+  peer_join（group_send）→ peer_hello（send で直接）
+  → offer → answer → candidate を ICE_BATCH_MAX 件ずつまとめた signal_batch
+をやりとりする。peer_hello 以降は CallConsumer と同じく channel_layer.send で相手に直接送る。
+1ペアでも届かなければ失敗（終了コード 1）。
+InMemoryChannelLayer のままだと、プロセスが2つ以上なら必ず失敗する。
+
+--idle で、何も届かないまま receive で待ち続ける接続をプロセスごとに足せる
+（開いているだけのソケットが多いときに、中継が遅くならないかを見る）。
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _group(pair):
+    return f"loadtest_call_{pair}"
+
+
+async def _next_event(layer, channel, me, timeout):
+    """自分が送ったもの以外の次のメッセージを待つ（peer_join は自分にも届く）"""
+    while True:
+        message = await asyncio.wait_for(layer.receive(channel), timeout=timeout)
+        if message.get("sender") != me:
+            return message
+
+
+async def _join(layer, pair):
+    channel = await layer.new_channel()
+    await layer.group_add(_group(pair), channel)
+    return channel
+
+
+async def _idle(layer, channel):
+    """届かないメッセージを待ち続けるだけの接続（終わったらキャンセルされる）"""
+    await layer.receive(channel)
+
+
+async def _run_peer(layer, channel, pair, role, candidates, batch, timeout):
+    def signal(event, data=None, kind="signal_message"):
+        return {"type": kind, "event": event, "sender": channel, "data": data}
+
+    rtt = None
+    try:
+        if role == "caller":
+            # 入室の通知はグループへ、返事（相手のチャネル名）は直接届く
+            await layer.group_send(_group(pair), {"type": "peer_join", "sender": channel})
+            message = await _next_event(layer, channel, channel, timeout)
+            if message["type"] != "peer_hello":
+                return False, None
+            peer = message["sender"]
+
+            started = time.perf_counter()
+            await layer.send(peer, signal("offer", {"pair": pair}))
+            message = await _next_event(layer, channel, channel, timeout)
+            if message["event"] != "answer":
+                return False, None
+            rtt = time.perf_counter() - started
+
+            for i in range(0, candidates, batch):
+                numbers = list(range(i, min(i + batch, candidates)))
+                await layer.send(peer, signal("candidate", numbers, kind="signal_batch"))
+        else:
+            message = await _next_event(layer, channel, channel, timeout)
+            if message["type"] != "peer_join":
+                return False, None
+            peer = message["sender"]
+            await layer.send(peer, {"type": "peer_hello", "sender": channel})
+
+            message = await _next_event(layer, channel, channel, timeout)
+            if message["event"] != "offer" or message["data"]["pair"] != pair:
+                return False, None
+            await layer.send(peer, signal("answer", {"pair": pair}))
+
+            received = []
+            while len(received) < candidates:
+                message = await _next_event(layer, channel, channel, timeout)
+                if message["type"] != "signal_batch":
+                    return False, None
+                received.extend(message["data"])
+            if received != list(range(candidates)):
+                return False, None
+        return True, rtt
+    except asyncio.TimeoutError:
+        return False, None
+    finally:
+        await layer.group_discard(_group(pair), channel)
+
+
+def relayed_per_pair(candidates, batch):
+    """1ペアで中継するメッセージ数（peer_join + peer_hello + offer + answer + candidate のまとまり）"""
+    return 4 + -(-candidates // batch)
+
+
+def _worker(roles, candidates, batch, idle, barrier, results, timeout):
+    """子プロセス：担当する (pair, role) をまとめて並行に走らせる"""
+    import django
+
+    django.setup()
+    from channels.layers import get_channel_layer
+
+    async def main():
+        layer = get_channel_layer()
+        channels = await asyncio.gather(*[_join(layer, pair) for pair, role in roles])
+        idlers = [
+            asyncio.create_task(_idle(layer, await layer.new_channel()))
+            for _ in range(idle)
+        ]
+
+        # 全プロセスのピアがグループに入り終わるまで待つ
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+        try:
+            return await asyncio.gather(*[
+                _run_peer(layer, channel, pair, role, candidates, batch, timeout)
+                for channel, (pair, role) in zip(channels, roles)
+            ])
+        finally:
+            for task in idlers:
+                task.cancel()
+            await asyncio.gather(*idlers, return_exceptions=True)
+
+    outcomes = asyncio.run(main())
+    results.put([
+        (pair, role, ok, rtt) for (pair, role), (ok, rtt) in zip(roles, outcomes)
+    ])
+
+
+class Command(BaseCommand):
+    help = "チャネルレイヤー経由の通話シグナリングを複数プロセスで中継できるか確認する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--pairs", type=int, default=50)
+        parser.add_argument("--candidates", type=int, default=20)
+        parser.add_argument(
+            "--batch", type=int, default=None,
+            help="candidate を何件ずつまとめるか（デフォルトは CallConsumer.ICE_BATCH_MAX）",
+        )
+        parser.add_argument(
+            "--idle", type=int, default=0,
+            help="プロセスごとに足す、待ち受けているだけの接続の数",
+        )
+        parser.add_argument("--timeout", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        processes = max(1, options["processes"])
+        pairs = options["pairs"]
+        candidates = options["candidates"]
+        idle = max(0, options["idle"])
+
+        from channels.layers import get_channel_layer
+        from matching.consumers import CallConsumer
+
+        batch = max(1, options["batch"] or CallConsumer.ICE_BATCH_MAX)
+        layer = get_channel_layer()
+        self.stdout.write(
+            f"layer={type(layer).__module__}.{type(layer).__name__} "
+            f"processes={processes} pairs={pairs} candidates={candidates} "
+            f"batch={batch} idle={idle}/process"
+        )
+        if hasattr(layer, "flush"):
+            asyncio.run(layer.flush())
+
+        # ペア i の発信側はプロセス i、着信側はプロセス i+1 に置く（別プロセス同士）
+        assignments = [[] for _ in range(processes)]
+        for pair in range(pairs):
+            assignments[pair % processes].append((pair, "caller"))
+            assignments[(pair + 1) % processes].append((pair, "callee"))
+
+        assignments = [roles for roles in assignments if roles]
+
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Manager().Barrier(len(assignments))
+        results = ctx.Queue()
+
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+        started = time.perf_counter()
+        workers = [
+            ctx.Process(
+                target=_worker,
+                args=(roles, candidates, batch, idle, barrier, results, options["timeout"]),
+            )
+            for roles in assignments
+        ]
+        for w in workers:
+            w.start()
+
+        rows = []
+        for _ in workers:
+            rows.extend(results.get(timeout=options["timeout"] * 3 + 60))
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - started
+
+        failed = sorted({pair for pair, role, ok, rtt in rows if not ok})
+        rtts = [rtt for pair, role, ok, rtt in rows if ok and rtt is not None]
+
+        relayed = (pairs - len(failed)) * relayed_per_pair(candidates, batch)
+        self.stdout.write(
+            f"ok={pairs - len(failed)}/{pairs} relayed={relayed} "
+            f"elapsed={elapsed:.2f}s ({relayed / elapsed:.0f} msg/s)"
+        )
+        if rtts:
+            rtts.sort()
+            p95 = rtts[min(len(rtts) - 1, int(len(rtts) * 0.95))]
+            self.stdout.write(
+                f"offer->answer rtt: p50={statistics.median(rtts) * 1000:.1f}ms "
+                f"p95={p95 * 1000:.1f}ms"
+            )
+
+        if failed:
+            raise CommandError(f"{len(failed)} pair(s) failed: {failed[:10]}")
+        self.stdout.write(self.style.SUCCESS("all pairs relayed correctly"))
@@ -0,0 +1,285 @@
+# matching/management/commands/explain_hot_queries.py
+"""
+よく呼ばれるビューのクエリに EXPLAIN をかけて、全件スキャンが出ていないかを確かめる。
+
+  python manage.py explain_hot_queries --profiles 2000
+  python manage.py explain_hot_queries -v 2     # 実行計画も全部表示
+
+トランザクションの中でダミーのユーザー・いいね・チャットなどを入れてから
+ANALYZE し、各クエリの実行計画を調べて、最後にロールバックする（データは残らない）。
+
+  SQLite     : インデックスを使わない「SCAN <テーブル>」があれば失敗
+  PostgreSQL : enable_seqscan=off でも「Seq Scan」が残れば失敗
+               （使えるインデックスがないということ）
+
+検索一覧のように、候補を全部並べ替えるのが仕様のクエリは allow で許可しておく。
+1件でも失敗があれば終了コード 1。
+"""
+import random
+import re
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Exists, OuterRef
+from django.utils import timezone
+
+from matching.chat import _message_page_queryset
+from matching.models import (
+    UserProfile,
+    Like,
+    Match,
+    Block,
+    ChatRoom,
+    Message,
+    ChatReadState,
+    CallRequest,
+    BoardPost,
+)
+from matching.matches import matches_of
+from matching.notifications import notification_state_query
+from matching.relations import _relations_query
+from matching.regions import region_of
+from matching.rooms import room_between, _rooms_with_query
+from matching.search import filter_profiles, parse_search_params, _page_queryset, PROFILE_PAGE_SIZE
+
+USERNAME_PREFIX = "_explain_"
+
+PREFS = ["東京都", "大阪府", "北海道", "福岡県", "愛知県", "宮城県"]
+PURPOSES = ["friend", "love", "both", "hobby", "talk"]
+
+SQLITE_SCAN_RE = re.compile(r"\bSCAN (\S+)(.*)$")
+POSTGRES_SCAN_RE = re.compile(r"Seq Scan on (\S+)")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def sequential_scans(plan):
+    """実行計画のテキスト → 全件スキャンしているテーブル（エイリアス）の一覧"""
+    found = []
+    for line in plan.splitlines():
+        if connection.vendor == "postgresql":
+            found += POSTGRES_SCAN_RE.findall(line)
+            continue
+        match = SQLITE_SCAN_RE.search(line)
+        if not match:
+            continue
+        target, rest = match.groups()
+        # SCAN CONSTANT ROW / SCAN (subquery-1) / インデックス順の走査は対象外
+        if target == "CONSTANT" or target.startswith("(") or "USING" in rest:
+            continue
+        found.append(target)
+    return found
+
+
+# ========== ダミーデータ ==========
+
+
+def seed(profiles, rng):
+    """
+    profiles 人分のデータを入れて、調べるときの基準になるもの（自分・相手・ルーム）を返す。
+    bulk_create なのでシグナル（キャッシュ破棄・画像生成）は動かない。
+    """
+    User = get_user_model()
+    users = User.objects.bulk_create(
+        User(username=f"{USERNAME_PREFIX}{i}", password="!") for i in range(profiles)
+    )
+    # bulk_create は save() を通らないので、region も prefecture から自分で入れる
+    prefectures = [rng.choice(PREFS) for _ in users]
+    people = UserProfile.objects.bulk_create(
+        UserProfile(
+            user=user,
+            nickname=f"explain{i}",
+            gender="M" if i % 2 == 0 else "F",
+            prefecture=prefectures[i],
+            region=region_of(prefectures[i]),
+            purpose=rng.choice(PURPOSES),
+            age_range=rng.choice(["20代", "30代", "40代"]),
+            income=rng.randrange(200, 1200, 50),
+        )
+        for i, user in enumerate(users)
+    )
+    ids = [p.pk for p in people]
+
+    likes = set()
+    for a in ids:
+        for b in rng.sample(ids, 10):
+            if a != b:
+                likes.add((a, b))
+    Like.objects.bulk_create(Like(from_user_id=a, to_user_id=b) for a, b in likes)
+    Match.objects.bulk_create(
+        Match(profile_id=a, partner_id=b) for a, b in likes if (b, a) in likes
+    )
+
+    blocks = {(a, b) for a, b in ((rng.choice(ids), rng.choice(ids)) for _ in range(profiles // 5)) if a != b}
+    Block.objects.bulk_create(Block(blocker_id=a, blocked_id=b) for a, b in blocks)
+
+    pairs = {(a, b) for a, b in likes if a < b and (b, a) in likes}
+    pairs |= {(min(a, b), max(a, b)) for a, b in ((rng.choice(ids), rng.choice(ids)) for _ in range(profiles * 2)) if a != b}
+    rooms = ChatRoom.objects.bulk_create(ChatRoom(user1_id=a, user2_id=b) for a, b in pairs)
+
+    now = timezone.now()
+    messages = []
+    states = []
+    calls = []
+    for room in rooms:
+        for n in range(rng.randrange(1, 30)):
+            sender = room.user1_id if n % 2 == 0 else room.user2_id
+            messages.append(Message(room=room, sender_id=sender, text=f"message {n}"))
+        for user_id in (room.user1_id, room.user2_id):
+            states.append(
+                ChatReadState(user_id=user_id, room=room, last_activity_at=now - timedelta(minutes=rng.randrange(10000)))
+            )
+        if rng.random() < 0.2:
+            calls.append(
+                CallRequest(
+                    room=room,
+                    caller_id=room.user1_id,
+                    callee_id=room.user2_id,
+                    mode="audio",
+                    is_active=rng.random() < 0.3,
+                    is_accepted=rng.choice([None, True, False]),
+                )
+            )
+    Message.objects.bulk_create(messages, batch_size=2000)
+    ChatReadState.objects.bulk_create(states, batch_size=2000)
+    CallRequest.objects.bulk_create(calls)
+
+    BoardPost.objects.bulk_create(
+        (
+            BoardPost(author_id=rng.choice(ids), title=f"post {n}", is_call_invite=rng.random() < 0.3)
+            for n in range(profiles * 2)
+        ),
+        batch_size=2000,
+    )
+
+    room = rooms[0]
+    me = UserProfile.objects.select_related("user").get(pk=room.user1_id)
+    partner = UserProfile.objects.get(pk=room.user2_id)
+    return me, partner, room
+
+
+# ========== 調べるクエリ（ビューと同じ形で組み立てる） ==========
+
+
+def hot_queries(me, partner, room):
+    """(名前, QuerySet, 全件スキャンを許すテーブル) の一覧"""
+    since = timezone.now() - timedelta(days=1)
+    filters = parse_search_params({})
+    partner_ids = list(Match.objects.filter(profile=me).values_list("partner_id", flat=True)) + [partner.pk]
+
+    return [
+        # profile_list: おすすめ順は候補全員の id を取って matching.scoring で並べる、
+        # 新しい順も候補全体から選ぶので、どちらもプロフィール表の走査は仕様
+        (
+            "profile_list (recommended candidates)",
+            filter_profiles(me, filters).values_list("id", flat=True),
+            {"matching_userprofile"},
+        ),
+        # 地方での絞り込みは UserProfile.region のインデックスで引けること
+        (
+            "profile_list region filter",
+            filter_profiles(me, parse_search_params({"region": "関東"})).values_list("id", flat=True),
+            set(),
+        ),
+        (
+            "profile_list liked me",
+            Like.objects.filter(to_user=me).values_list("from_user_id", flat=True),
+            set(),
+        ),
+        (
+            "profile_list (new)",
+            _page_queryset(filter_profiles(me, filters), "new", None, None, PROFILE_PAGE_SIZE),
+            {"matching_userprofile"},
+        ),
+        ("relations", _relations_query(me.pk), set()),
+        ("notifications", notification_state_query(me.user_id), set()),
+        # like_inbox
+        ("like_inbox new matches", matches_of(me, since=since), set()),
+        (
+            "like_inbox incoming",
+            Like.objects.filter(to_user=me)
+            .exclude(Exists(Match.objects.filter(profile=me, partner=OuterRef("from_user"))))
+            .select_related("from_user").order_by("-id"),
+            set(),
+        ),
+        ("like_inbox rooms", _rooms_with_query(me.pk, partner_ids), set()),
+        # match_list / send_like / start_chat
+        ("match_list", matches_of(me), set()),
+        ("is_matched", Match.objects.filter(profile=me, partner=partner), set()),
+        # chat_list
+        (
+            "chat_list",
+            ChatReadState.objects.filter(user=me).select_related("room__user1", "room__user2")
+            .order_by(F("last_activity_at").desc(nulls_last=True), "-room_id"),
+            set(),
+        ),
+        # chat_room / chat_history
+        ("chat_room messages", _message_page_queryset(room, None, 50), set()),
+        (
+            "chat_room incoming call",
+            CallRequest.objects.filter(room=room, callee=me, is_active=True, is_accepted__isnull=True)
+            .order_by("-created_at")[:1],
+            set(),
+        ),
+        ("mark_room_read", ChatReadState.objects.filter(user=me, room=room), set()),
+        ("record_message", ChatReadState.objects.filter(room_id=room.pk), set()),
+        # send_call_request（古いリクエストの無効化）
+        (
+            "send_call_request",
+            CallRequest.objects.filter(room=room, caller=me, callee=partner, is_active=True),
+            set(),
+        ),
+        # board_list
+        ("board_list", BoardPost.objects.select_related("author").order_by("-created_at")[:20], set()),
+        (
+            "board_list call_only",
+            BoardPost.objects.select_related("author").filter(is_call_invite=True).order_by("-created_at")[:20],
+            set(),
+        ),
+        # send_like / start_chat / block_user
+        ("room_between", room_between(me, partner), set()),
+    ]
+
+
+class Command(BaseCommand):
+    help = "よく使うクエリの実行計画を調べ、全件スキャンがあれば失敗する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=2000, help="ダミーのプロフィール数")
+        parser.add_argument("--seed", type=int, default=1, help="乱数のシード")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            raise CommandError(f"{connection.vendor} には対応していません")
+
+        rng = random.Random(options["seed"])
+        failures = []
+        try:
+            with transaction.atomic():
+                me, partner, room = seed(options["profiles"], rng)
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                    if connection.vendor == "postgresql":
+                        cursor.execute("SET LOCAL enable_seqscan = off")
+
+                for name, qs, allow in hot_queries(me, partner, room):
+                    plan = qs.explain()
+                    scans = [t for t in sequential_scans(plan) if t not in allow]
+                    if scans:
+                        failures.append(name)
+                        self.stdout.write(self.style.ERROR(f"NG  {name}: 全件スキャン {', '.join(scans)}"))
+                    else:
+                        self.stdout.write(f"OK  {name}")
+                    if scans or options["verbosity"] >= 2:
+                        for line in plan.splitlines():
+                            self.stdout.write(f"      {line}")
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        if failures:
+            raise CommandError(f"{len(failures)} 件のクエリで全件スキャンが出ました")
@@ -0,0 +1,84 @@
+# matching/management/commands/generate_renditions.py
+"""
+既存のアップロード画像からサムネイル / WebP（matching.images）をまとめて作る。
+
+  python manage.py generate_renditions            # まだないものだけ
+  python manage.py generate_renditions --force    # 全部作り直す
+  python manage.py generate_renditions --strip-exif  # 元画像の EXIF も消す（アップロード時の削除の導入前の画像用）
+
+アップロード時はシグナルから自動で作られるので、
+導入前の画像や、RENDITIONS のサイズを変えたときに使う。
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from matching.images import generate_renditions, rendition_exists, rendition_name, strip_stored_metadata
+from matching.models import UserProfile, ProfilePhoto, BoardPost
+
+
+def _image_names():
+    names = set()
+    names.update(UserProfile.objects.exclude(avatar="").exclude(avatar__isnull=True)
+                 .values_list("avatar", flat=True))
+    names.update(ProfilePhoto.objects.exclude(image="").values_list("image", flat=True))
+    names.update(BoardPost.objects.exclude(image="").exclude(image__isnull=True)
+                 .values_list("image", flat=True))
+    return sorted(names)
+
+
+class Command(BaseCommand):
+    help = "アップロード済み画像のサムネイル / WebP を生成する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="生成済みでも作り直す")
+        parser.add_argument(
+            "--strip-exif", action="store_true",
+            help="元画像に残っている EXIF（位置情報など）を消して保存し直す",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=settings.IMAGE_WORKERS,
+            help="並列に処理するスレッド数",
+        )
+
+    def handle(self, *args, **options):
+        names = _image_names()
+        if options["strip_exif"]:
+            self._strip_exif(names, options["workers"])
+        if not options["force"]:
+            names = [n for n in names if not rendition_exists(rendition_name(n, "detail", "webp"))]
+
+        def work(name):
+            try:
+                generate_renditions(name)
+                return name, None
+            except Exception as e:  # 壊れた画像・消えたファイルは飛ばす
+                return name, e
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+            for name, error in pool.map(work, names):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"  skip {name}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(names) - failed} 件生成しました（失敗 {failed} 件）"
+        ))
+
+    def _strip_exif(self, names, workers):
+        def work(name):
+            try:
+                return name, strip_stored_metadata(name), None
+            except Exception as e:  # 壊れた画像・消えたファイルは飛ばす
+                return name, False, e
+
+        stripped = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for name, changed, error in pool.map(work, names):
+                if error is not None:
+                    self.stderr.write(f"  skip {name}: {error}")
+                stripped += changed
+
+        self.stdout.write(f"{stripped} 件の元画像から EXIF を消しました")
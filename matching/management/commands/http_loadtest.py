@@ -0,0 +1,119 @@
+# matching/management/commands/http_loadtest.py
+"""
+起動中のサーバーに HTTP リクエストを投げ続けて、スループットと応答時間を測る。
+
+  gunicorn config.asgi:application -c config/gunicorn.conf.py &
+  python manage.py http_loadtest --base-url http://127.0.0.1:8000 \
+      --path /accounts/login/ --path /profile/list/ --user tester \
+      --concurrency 16 --duration 20
+
+--user を付けると、そのユーザーのセッションを DB に作ってクッキーで送る
+（サーバーと同じ DB を見ている必要がある）。
+同時接続ごとに1本のスレッドで keep-alive の接続を使い回す。
+2xx / 3xx / 304 以外が返ったら失敗として数え、1件でもあれば終了コード 1。
+"""
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _session_cookie(username):
+    user = get_user_model().objects.filter(username=username).first()
+    if user is None:
+        raise CommandError(f"ユーザー {username} がいません")
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+
+def _worker(base, path, headers, deadline, results, errors):
+    parts = urlsplit(base)
+    conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_class(parts.hostname, parts.port, timeout=30)
+
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+            conn = conn_class(parts.hostname, parts.port, timeout=30)
+
+        if ok:
+            results.append(time.perf_counter() - started)
+        else:
+            errors.append(path)
+    conn.close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = "起動中のサーバーに HTTP 負荷をかけてスループットを測る"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--path", action="append", dest="paths", help="測るパス（複数可）")
+        parser.add_argument("--user", help="このユーザーでログインした状態で叩く")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--duration", type=float, default=10.0, help="パスごとの秒数")
+        parser.add_argument("--header", action="append", default=[], help="追加ヘッダ Name: value")
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or ["/accounts/login/"]
+        headers = {"Connection": "keep-alive"}
+        for header in options["header"]:
+            name, _, value = header.partition(":")
+            headers[name.strip()] = value.strip()
+        if options["user"]:
+            headers["Cookie"] = _session_cookie(options["user"])
+
+        failed = 0
+        for path in paths:
+            results, errors = [], []
+            deadline = time.perf_counter() + options["duration"]
+            threads = [
+                threading.Thread(
+                    target=_worker,
+                    args=(options["base_url"], path, headers, deadline, results, errors),
+                )
+                for _ in range(options["concurrency"])
+            ]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+
+            failed += len(errors)
+            ms = [r * 1000 for r in results]
+            self.stdout.write(
+                f"{path}: {len(results) / elapsed:.0f} req/s "
+                f"({len(results)} ok, {len(errors)} failed) "
+                f"p50 {_percentile(ms, 50):.0f}ms / p95 {_percentile(ms, 95):.0f}ms / "
+                f"p99 {_percentile(ms, 99):.0f}ms"
+                + (f" / mean {statistics.mean(ms):.0f}ms" if ms else "")
+            )
+
+        if failed:
+            raise CommandError(f"{failed} 件のリクエストが失敗しました")
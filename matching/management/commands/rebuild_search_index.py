@@ -0,0 +1,26 @@
+# matching/management/commands/rebuild_search_index.py
+"""
+全文検索の索引（matching.fulltext）を作り直す。
+
+  python manage.py rebuild_search_index
+
+保存・削除のたびにシグナルで更新されるので普段は要らない。
+bigram の作り方や索引に入れるフィールドを変えたとき、
+シグナルを通らない一括更新（QuerySet.update など）をしたときに使う。
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from matching import fulltext
+from matching.models import UserProfile, BoardPost
+
+
+class Command(BaseCommand):
+    help = "プロフィール・掲示板の全文検索の索引を作り直す"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fulltext.create_indexes()
+            profiles = fulltext.rebuild(fulltext.PROFILE, UserProfile.objects.iterator())
+            posts = fulltext.rebuild(fulltext.BOARD_POST, BoardPost.objects.iterator())
+        self.stdout.write(self.style.SUCCESS(f"プロフィール {profiles} 件 / 掲示板 {posts} 件を索引しました"))
@@ -0,0 +1,76 @@
+# matching/matches.py
+"""
+相互いいね（Match）の作成・削除と参照。
+
+以前は「自分が送ったいいね」と「自分に届いたいいね」を両方取ってきて
+Python の set で積集合を取っていたが、ページを開くたびに いいね数に比例した仕事になる。
+Match は相互いいねが成立した瞬間（後から届いた Like の保存時）に
+双方向の2行として作るので、参照は (profile, created_at) のインデックスを引くだけ。
+
+  like_added / like_removed : signals.py から Like と同じトランザクションで呼ばれる
+  lock_pair                 : 2人が同時にいいねし合ってもマッチを取りこぼさないための行ロック
+"""
+from django.db.models import Q
+
+from .models import Like, Match, UserProfile
+
+
+def lock_pair(a, b):
+    """
+    2人のプロフィール行を pk 順にロックする（トランザクション内で呼ぶこと）。
+    同じペアの「いいね」の保存が直列になり、どちらかが必ず相手の Like を見つける。
+    （SQLite は書き込みが元々直列なので何もしない）
+    """
+    list(
+        UserProfile.objects.select_for_update()
+        .filter(pk__in=[a.pk, b.pk])
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def like_added(like):
+    """相手からもいいねが来ていれば、マッチ（双方向の2行）を作る"""
+    if like.from_user_id == like.to_user_id:
+        return
+    reciprocal = Like.objects.filter(
+        from_user_id=like.to_user_id,
+        to_user_id=like.from_user_id,
+    ).exists()
+    if not reciprocal:
+        return
+
+    Match.objects.bulk_create(
+        [
+            Match(profile_id=like.from_user_id, partner_id=like.to_user_id, created_at=like.created_at),
+            Match(profile_id=like.to_user_id, partner_id=like.from_user_id, created_at=like.created_at),
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def like_removed(like):
+    """いいねが取り消されたらマッチも消す"""
+    Match.objects.filter(
+        Q(profile_id=like.from_user_id, partner_id=like.to_user_id)
+        | Q(profile_id=like.to_user_id, partner_id=like.from_user_id)
+    ).delete()
+
+
+# ========== 参照 ==========
+
+
+def matches_of(me, since=None):
+    """自分のマッチを新しい順に（since 以降だけにもできる）"""
+    qs = Match.objects.filter(profile=me)
+    if since is not None:
+        qs = qs.filter(created_at__gt=since)
+    return qs.select_related("partner").order_by("-created_at")
+
+
+def is_matched(me, other):
+    return Match.objects.filter(profile=me, partner=other).exists()
+
+
+async def ais_matched(me, other):
+    return await Match.objects.filter(profile=me, partner=other).aexists()
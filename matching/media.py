@@ -0,0 +1,220 @@
+# matching/media.py
+"""
+MEDIA_ROOT 以下のファイルを返すためのヘルパー。
+
+django.views.static.serve の代わりに使う。違いは:
+  - Range リクエスト（動画のシーク）に 206 で答える
+  - ETag / Last-Modified を付けて、変わっていなければ 304 だけ返す
+  - キャッシュは MEDIA_CACHE_MAX_AGE 秒だけにして、切れたら ETag で確かめ直させる
+    （ファイル名は中身のハッシュではなく、同じ名前で作り直すこともあるので immutable にはしない。
+      レンディションの作り直し・generate_renditions --strip-exif など）
+  - ASGI では非同期イテレータ、WSGI では普通のイテレータで少しずつ送る
+  - MEDIA_ACCEL を設定すれば、本体の送信はフロントのプロキシ
+    （nginx の X-Accel-Redirect / Apache の X-Sendfile）に任せる
+
+  MEDIA_ACCEL = ""          # Django がそのまま返す（デフォルト）
+  MEDIA_ACCEL = "nginx"     # X-Accel-Redirect: MEDIA_ACCEL_PREFIX + パス
+  MEDIA_ACCEL = "sendfile"  # X-Sendfile: 絶対パス（Apache mod_xsendfile など）
+"""
+import asyncio
+import mimetypes
+import os
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def resolve_media_path(path):
+    """URL のパス → MEDIA_ROOT 内の実ファイル（外に出るパスやディレクトリは 404）"""
+    try:
+        fullpath = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404
+    if not fullpath.is_file():
+        raise Http404
+    return fullpath
+
+
+def file_etag(stat):
+    """更新時刻とサイズから作る強い ETag"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Range ヘッダ → (start, end)（end を含む）。
+    Range なし・複数範囲・書式違いは None（全体を返す）、範囲外は "invalid"。
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # bytes=-500 → 末尾 500 バイト（空のファイルには返せる範囲がない）
+        length = int(last)
+        if length == 0 or size == 0:
+            return "invalid"
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return "invalid"
+    return start, min(end, size - 1)
+
+
+def _if_range_passes(request, etag, last_modified):
+    """If-Range が付いていて、ファイルが変わっていたら Range を無視する"""
+    value = request.META.get("HTTP_IF_RANGE")
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag
+    since = parse_http_date_safe(value)
+    return since is not None and last_modified <= since
+
+
+def _iter_range_sync(fullpath, start, length):
+    """ファイルの一部を CHUNK_SIZE ずつ返すイテレータ（WSGI 用）"""
+    with open(fullpath, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _iter_range(fullpath, start, length):
+    """
+    ファイルの一部を CHUNK_SIZE ずつ返す非同期イテレータ。
+    ASGI では同期イテレータだと Django が全部読み込んでから送るので、非同期で渡す。
+    """
+    f = await asyncio.to_thread(open, fullpath, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _range_iterator(request, fullpath, start, length):
+    """
+    サーバーに合わせたイテレータ。
+    WSGI で非同期イテレータを渡すと、今度は Django が全部読み込んでから送ってしまう。
+    """
+    if isinstance(request, ASGIRequest):
+        return _iter_range(fullpath, start, length)
+    return _iter_range_sync(fullpath, start, length)
+
+
+def serve_file(request, fullpath, cache_control, accel_path=None):
+    """
+    fullpath のファイルを条件付き GET / Range 対応で返す。
+
+    cache_control : Cache-Control ヘッダの値
+    accel_path    : MEDIA_ACCEL="nginx" のときに X-Accel-Redirect に載せるパス
+    """
+    stat = os.stat(fullpath)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    # 304 / 412
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        for key, value in headers.items():
+            conditional.headers.setdefault(key, value)
+        return conditional
+
+    content_type, encoding = mimetypes.guess_type(str(fullpath))
+    content_type = content_type or "application/octet-stream"
+
+    # 本体の送信をフロントのプロキシに任せる（Range もプロキシが処理する）
+    # 日本語などのファイル名はそのままだと Django が MIME エンコードしてしまうので、
+    # パーセントエンコードして ASCII にしておく（プロキシ側でデコードされる）
+    accel = getattr(settings, "MEDIA_ACCEL", "")
+    if accel:
+        response = HttpResponse(content_type=content_type)
+        if accel == "nginx":
+            response["X-Accel-Redirect"] = quote(accel_path)
+        else:
+            response["X-Sendfile"] = quote(str(fullpath))
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if _if_range_passes(request, etag, last_modified):
+        byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+
+    if byte_range == "invalid":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type)
+        response["Content-Length"] = str(size)
+    elif byte_range is None:
+        response = StreamingHttpResponse(
+            _range_iterator(request, fullpath, 0, size),
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _range_iterator(request, fullpath, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if encoding:
+        response["Content-Encoding"] = encoding
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+def media_cache_control(path):
+    """公開メディアの Cache-Control（期限が切れたら ETag / Last-Modified で確かめ直す）"""
+    max_age = getattr(settings, "MEDIA_CACHE_MAX_AGE", 3600)
+    return f"public, max-age={max_age}"
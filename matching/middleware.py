@@ -0,0 +1,39 @@
+# matching/middleware.py
+"""
+プロジェクト独自のミドルウェア。
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    async 対応の WhiteNoise。
+
+    WhiteNoiseMiddleware は同期専用なので、MIDDLEWARE に1つ入っているだけで
+    ASGI でもそれより内側がすべて同期扱いになり、async ビューがスレッドに押し込まれる。
+    static ファイルの判定・配信は今まで通りで、それ以外は await で次に渡す。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _static_file(self, request):
+        if self.autorefresh:
+            return self.find_file(request.path_info)
+        return self.files.get(request.path_info)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self._static_file(request)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:57
+
+import django.db.models.deletion
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations, models
+
+
+def backfill_read_states(apps, schema_editor):
+    """既存ルームの ChatReadState を作り、未読数・最新メッセージを埋める"""
+    ChatRoom = apps.get_model("matching", "ChatRoom")
+    ChatReadState = apps.get_model("matching", "ChatReadState")
+    Message = apps.get_model("matching", "Message")
+
+    never_read = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+    for room in ChatRoom.objects.all().iterator():
+        latest = Message.objects.filter(room=room).order_by("-created_at", "-id").first()
+
+        for user_id in (room.user1_id, room.user2_id):
+            state, _ = ChatReadState.objects.get_or_create(
+                user_id=user_id,
+                room=room,
+                defaults={"last_read_at": never_read},
+            )
+            state.unread_count = (
+                Message.objects.filter(room=room, created_at__gt=state.last_read_at)
+                .exclude(sender_id=user_id)
+                .count()
+            )
+            state.last_message = latest
+            state.last_message_preview = (latest.text or "")[:100] if latest else ""
+            state.last_activity_at = latest.created_at if latest else room.created_at
+            state.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0016_alter_chatroom_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='matching.message'),
+        ),
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatreadstate',
+            index=models.Index(fields=['user', '-last_activity_at'], name='readstate_user_activity_idx'),
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0017_chatreadstate_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'created_at'], name='message_room_created_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:10
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0018_message_room_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('total_size', models.PositiveBigIntegerField()),
+                ('received', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='matching.message')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matching.chatroom')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='matching.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='chatupload_updated_idx')],
+            },
+        ),
+    ]
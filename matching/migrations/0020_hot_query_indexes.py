@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0019_chatupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='block',
+            index=models.Index(fields=['blocked', 'blocker'], name='block_blocked_blocker_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boardpost',
+            index=models.Index(fields=['-created_at'], name='boardpost_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boardpost',
+            index=models.Index(fields=['is_call_invite', '-created_at'], name='boardpost_call_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrequest',
+            index=models.Index(condition=models.Q(('is_accepted__isnull', True), ('is_active', True)), fields=['room', 'callee', '-created_at'], name='callreq_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['room', 'caller'], name='callreq_active_caller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['to_user', 'created_at'], name='like_to_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'sender', 'created_at'], name='message_room_sender_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def backfill_matches(apps, schema_editor):
+    """既存の相互いいねから Match（双方向の2行）を作る。成立時刻は後の方のいいね"""
+    Like = apps.get_model("matching", "Like")
+    Match = apps.get_model("matching", "Match")
+
+    reciprocal = Like.objects.filter(
+        from_user=OuterRef("to_user"),
+        to_user=OuterRef("from_user"),
+    )
+    matched_at = {}
+    rows = (
+        Like.objects.filter(Exists(reciprocal))
+        .values_list("from_user_id", "to_user_id", "created_at")
+        .iterator()
+    )
+    for from_id, to_id, created_at in rows:
+        pair = (min(from_id, to_id), max(from_id, to_id))
+        matched_at[pair] = max(matched_at.get(pair, created_at), created_at)
+
+    Match.objects.bulk_create(
+        [
+            Match(profile_id=profile_id, partner_id=partner_id, created_at=created_at)
+            for (a, b), created_at in matched_at.items()
+            for profile_id, partner_id in ((a, b), (b, a))
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0020_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matching.userprofile')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='matching.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['profile', '-created_at'], name='match_profile_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'partner'), name='unique_match_pair')],
+            },
+        ),
+        migrations.RunPython(backfill_matches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:29
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def _refresh_read_states(room, ChatReadState, Message):
+    """統合したルームの未読数・最新メッセージを数え直す"""
+    latest = Message.objects.filter(room=room).order_by("-created_at", "-id").first()
+    for state in ChatReadState.objects.filter(room=room):
+        state.unread_count = (
+            Message.objects.filter(room=room, created_at__gt=state.last_read_at)
+            .exclude(sender_id=state.user_id)
+            .count()
+        )
+        state.last_message = latest
+        state.last_message_preview = (latest.text or "")[:100] if latest else ""
+        state.last_activity_at = latest.created_at if latest else room.created_at
+        state.save()
+
+
+def normalize_rooms(apps, schema_editor):
+    """
+    (user1, user2) を (小さい pk, 大きい pk) の順にそろえる。
+    逆順のルームが両方あるときは、正しい順の方にメッセージなどを寄せて1つにまとめる。
+    自分自身とのルームは CheckConstraint を満たせないので消す。
+    """
+    ChatRoom = apps.get_model("matching", "ChatRoom")
+    ChatReadState = apps.get_model("matching", "ChatReadState")
+    Message = apps.get_model("matching", "Message")
+    CallRequest = apps.get_model("matching", "CallRequest")
+    ChatUpload = apps.get_model("matching", "ChatUpload")
+
+    ChatRoom.objects.filter(user1_id=F("user2_id")).delete()
+
+    for room in ChatRoom.objects.filter(user1_id__gt=F("user2_id")).iterator():
+        canonical = ChatRoom.objects.filter(user1_id=room.user2_id, user2_id=room.user1_id).first()
+        if canonical is None:
+            ChatRoom.objects.filter(pk=room.pk).update(
+                user1_id=F("user2_id"),
+                user2_id=F("user1_id"),
+            )
+            continue
+
+        for model in (Message, CallRequest, ChatUpload):
+            model.objects.filter(room_id=room.pk).update(room_id=canonical.pk)
+
+        # 既読時刻は2つのルームの新しい方を引き継ぐ
+        for old_state in ChatReadState.objects.filter(room_id=room.pk):
+            state, created = ChatReadState.objects.get_or_create(
+                user_id=old_state.user_id,
+                room_id=canonical.pk,
+                defaults={"last_read_at": old_state.last_read_at},
+            )
+            if not created and old_state.last_read_at > state.last_read_at:
+                state.last_read_at = old_state.last_read_at
+                state.save(update_fields=["last_read_at"])
+
+        ChatRoom.objects.filter(pk=room.pk).delete()
+        _refresh_read_states(canonical, ChatReadState, Message)
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL では、同じトランザクションで行を書き換えたテーブルに ALTER TABLE できない
+    # （pending trigger events）。データの整理を先にコミットしてから制約を足す。
+    # normalize_rooms は何度流しても同じ結果になるので、制約の追加で失敗しても流し直せる。
+    atomic = False
+
+    dependencies = [
+        ('matching', '0021_match'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_rooms, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('user1__lt', models.F('user2'))), name='chatroom_ordered_pair'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:35
+
+from django.db import migrations
+
+from matching import fulltext
+
+
+def create_search_indexes(apps, schema_editor):
+    """全文検索の索引テーブルを作り、既存のプロフィール・掲示板投稿を入れる"""
+    UserProfile = apps.get_model("matching", "UserProfile")
+    BoardPost = apps.get_model("matching", "BoardPost")
+    conn = schema_editor.connection
+
+    fulltext.create_indexes(conn)
+    fulltext.rebuild(fulltext.PROFILE, UserProfile.objects.iterator(), conn)
+    fulltext.rebuild(fulltext.BOARD_POST, BoardPost.objects.iterator(), conn)
+
+
+def drop_search_indexes(apps, schema_editor):
+    fulltext.drop_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0022_chatroom_ordered_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
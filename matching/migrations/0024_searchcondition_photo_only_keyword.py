@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0023_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchcondition',
+            name='keyword',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='searchcondition',
+            name='photo_only',
+            field=models.BooleanField(default=False),
+        ),
+    ]
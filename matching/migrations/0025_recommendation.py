@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0024_searchcondition_photo_only_keyword'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation', serialize=False, to='matching.userprofile')),
+                ('candidate_ids', models.BinaryField()),
+                ('sort_keys', models.BinaryField()),
+                ('stale', models.BooleanField(default=False)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('stale', True)), fields=['profile'], name='recommendation_stale_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:45
+
+from django.db import migrations, models
+
+from matching.regions import REGION_PREFECTURES
+
+
+def backfill_regions(apps, schema_editor):
+    """既存のプロフィールの region を都道府県から埋める（地方ごとに UPDATE 1回）"""
+    UserProfile = apps.get_model("matching", "UserProfile")
+    for region, prefectures in REGION_PREFECTURES.items():
+        UserProfile.objects.filter(prefecture__in=prefectures).update(region=region)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0025_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchcondition',
+            name='region',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='region',
+            field=models.CharField(blank=True, choices=[('北海道', '北海道'), ('東北', '東北'), ('関東', '関東'), ('中部', '中部'), ('近畿', '近畿'), ('中国', '中国'), ('四国', '四国'), ('九州・沖縄', '九州・沖縄')], db_index=True, editable=False, max_length=10, verbose_name='地方'),
+        ),
+        migrations.RunPython(backfill_regions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 10:12
+
+from django.db import migrations
+
+from matching import fulltext
+
+
+def rebuild_search_indexes(apps, schema_editor):
+    """索引の文字列に各塊の最後の1文字を足したので、既存の行を入れ直す"""
+    UserProfile = apps.get_model("matching", "UserProfile")
+    BoardPost = apps.get_model("matching", "BoardPost")
+    conn = schema_editor.connection
+
+    fulltext.rebuild(fulltext.PROFILE, UserProfile.objects.iterator(), conn)
+    fulltext.rebuild(fulltext.BOARD_POST, BoardPost.objects.iterator(), conn)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0027_userprofile_search_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_search_indexes, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 # matching/models.py
 from django.contrib.auth import get_user_model
 
+from .regions import REGION_CHOICES, region_of
+
 User = get_user_model()
 class CallRequest(models.Model):
     MODE_CHOICES = (
@@ -20,6 +24,22 @@ class CallRequest(models.Model):
     is_accepted = models.BooleanField(null=True, blank=True)  # None=保留, True=受けた, False=拒否
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # チャット画面の着信チェック（保留中のものだけの部分インデックス）
+            models.Index(
+                fields=["room", "callee", "-created_at"],
+                name="callreq_pending_idx",
+                condition=models.Q(is_active=True, is_accepted__isnull=True),
+            ),
+            # 発信時に自分の古いリクエストを無効化する UPDATE 用
+            models.Index(
+                fields=["room", "caller"],
+                name="callreq_active_caller_idx",
+                condition=models.Q(is_active=True),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.caller} -> {self.callee} ({self.mode})"
 
@@ -113,6 +133,15 @@ class UserProfile(models.Model):
         blank=True,
         verbose_name="居住地",
     )
+    # 都道府県から決まる地方（save() で入れる。地方での絞り込み・おすすめ順に使う）
+    region = models.CharField(
+        max_length=10,
+        choices=REGION_CHOICES,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="地方",
+    )
     gender = models.CharField(
         max_length=1,
         choices=GENDER_CHOICES,
@@ -134,6 +163,28 @@ class UserProfile(models.Model):
     last_checked_likes = models.DateTimeField(null=True, blank=True)
     last_checked_matches = models.DateTimeField(null=True, blank=True)
 
+    # 検索・おすすめ順に効く項目（SEARCH_FIELDS）が最後に変わった時刻（新規登録を含む。save() で入れる）
+    # 事前計算したおすすめに、そのあと登録・変更した人を混ぜるのに使う（null = 記録を始める前から同じ）
+    search_updated_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+
+    # 変わると検索結果・おすすめ順が変わりうるフィールド
+    SEARCH_FIELDS = frozenset({"gender", "prefecture", "region", "age_range", "purpose", "income", "avatar"})
+
+    def save(self, *args, **kwargs):
+        self.region = region_of(self.prefecture)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or self.SEARCH_FIELDS & set(update_fields):
+            self.search_updated_at = timezone.now()
+        if update_fields is not None:
+            extra = set()
+            if "prefecture" in update_fields:
+                extra.add("region")
+            if self.SEARCH_FIELDS & set(update_fields):
+                extra.add("search_updated_at")
+            if extra:
+                kwargs["update_fields"] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         # user が None の可能性も一応考慮
         if self.nickname:
@@ -179,11 +230,58 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ("from_user", "to_user")
+        indexes = [
+            # 自分宛ての「いいね」を新しい順・last_checked_* 以降で引く用
+            models.Index(
+                fields=["to_user", "created_at"],
+                name="like_to_user_created_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.from_user} → {self.to_user}"
 
 
+class Match(models.Model):
+    """
+    相互いいね（マッチ）。
+
+    1組のマッチにつき、双方向の2行（profile → partner / partner → profile）を持つ。
+    「自分のマッチ一覧」「last_checked_matches 以降の新着マッチ」が
+    (profile, created_at) のインデックス1本の範囲検索で済む。
+    （作成・削除は matching/matches.py 経由：Like の保存 / 削除時）
+    """
+    profile = models.ForeignKey(
+        UserProfile,
+        related_name="matches",
+        on_delete=models.CASCADE,
+    )
+    partner = models.ForeignKey(
+        UserProfile,
+        related_name="+",
+        on_delete=models.CASCADE,
+    )
+    # マッチが成立した時刻（後から届いた方の「いいね」の時刻）
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile", "partner"],
+                name="unique_match_pair",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["profile", "-created_at"],
+                name="match_profile_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.profile} ♥ {self.partner}"
+
+
 class ChatRoom(models.Model):
     user1 = models.ForeignKey(
         UserProfile,
@@ -202,9 +300,21 @@ class ChatRoom(models.Model):
             models.UniqueConstraint(
                 fields=["user1", "user2"],
                 name="unique_chatroom_pair",
-            )
+            ),
+            # 2人の組は常に (小さい pk, 大きい pk) の順で持つ。
+            # どちらから引いても unique_chatroom_pair のインデックス1回で見つかる
+            models.CheckConstraint(
+                condition=models.Q(user1__lt=models.F("user2")),
+                name="chatroom_ordered_pair",
+            ),
         ]
 
+    def save(self, *args, **kwargs):
+        # 逆順で渡されても並べ直して保存する（検索は matching/rooms.py 経由）
+        if self.user1_id and self.user2_id and self.user1_id > self.user2_id:
+            self.user1, self.user2 = self.user2, self.user1
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Room {self.pk}: {self.user1} & {self.user2}"
 
@@ -222,6 +332,18 @@ class Message(models.Model):
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # ルームごとの履歴ページング（created_at の範囲スキャン）用
+            models.Index(
+                fields=["room", "created_at"],
+                name="message_room_created_idx",
+            ),
+            # 通知の「相手が送った新着」判定（sender の除外も索引だけで済ませる）
+            models.Index(
+                fields=["room", "sender", "created_at"],
+                name="message_room_sender_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"[{self.created_at:%H:%M}] {self.sender}: {self.text[:20]}"
@@ -230,17 +352,76 @@ class Message(models.Model):
 class ChatReadState(models.Model):
     """
     ユーザーごと・チャットルームごとの「最後に読んだ時刻」を持つモデル。
+
+    チャット一覧をこのテーブル1本から描画できるように、
+    未読数・最新メッセージ・最終アクティビティ時刻も非正規化して持つ。
+    （更新は matching/chat.py 経由：メッセージ保存時 / ルームを開いたとき）
     """
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
     last_read_at = models.DateTimeField(default=timezone.now)
 
+    # ▼ 非正規化フィールド（チャット一覧用）
+    unread_count = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = ("user", "room")
+        indexes = [
+            models.Index(
+                fields=["user", "-last_activity_at"],
+                name="readstate_user_activity_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} @ {self.room} : {self.last_read_at}"
 
+
+class ChatUpload(models.Model):
+    """
+    チャット動画の分割アップロード（途中から再開できる）。
+
+    チャンクは一時ファイル（CHAT_UPLOAD_TEMP_DIR/<id>.part）に追記していき、
+    total_size まで届いたらストレージに移して Message を作る。
+    （処理は matching/uploads.py）
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
+    uploader = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    total_size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+
+    # 完了したら作られたメッセージ
+    message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at"], name="chatupload_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.uploader} → {self.room} : {self.received}/{self.total_size}"
+
 class Block(models.Model):
     blocker = models.ForeignKey(
         UserProfile, related_name="blocks_sent", on_delete=models.CASCADE
@@ -252,6 +433,13 @@ class Block(models.Model):
 
     class Meta:
         unique_together = ("blocker", "blocked")
+        indexes = [
+            # 「自分をブロックしている人」を索引だけで引く用
+            models.Index(
+                fields=["blocked", "blocker"],
+                name="block_blocked_blocker_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.blocker} blocks {self.blocked}"
@@ -277,6 +465,9 @@ class SearchCondition(models.Model):
     income_min = models.IntegerField(null=True, blank=True)
     income_max = models.IntegerField(null=True, blank=True)
     purpose = models.CharField(max_length=100, blank=True)
+    region = models.CharField(max_length=10, blank=True)            # 地方（完全一致）
+    photo_only = models.BooleanField(default=False)                 # 写真ありのみ
+    keyword = models.CharField(max_length=100, blank=True)          # 全文検索のキーワード
 
     # いつ使われたか（自動更新）
     last_used_at = models.DateTimeField(auto_now=True)
@@ -284,6 +475,41 @@ class SearchCondition(models.Model):
     def __str__(self):
         return f"SearchCondition({self.owner}, {self.order}, age={self.age_filter})"
 
+class Recommendation(models.Model):
+    """
+    おすすめ順の事前計算結果（1人1行）。
+    python manage.py build_recommendations が作り、検索タブ（おすすめ順・条件なし）が読む。
+
+    上位 K 人の id と並び順のキー（matching.scoring の sort_key）を
+    int64 の配列のまま詰めて持つので、K 人分でも1行・1回の読み込みで済む。
+    いいね / ブロック / 自分のプロフィール変更で stale になり、次の差分実行で作り直される。
+    computed_at より後に登録・変更した人（UserProfile.search_updated_at）は、読むときに混ぜる。
+    """
+    profile = models.OneToOneField(
+        UserProfile,
+        primary_key=True,
+        related_name="recommendation",
+        on_delete=models.CASCADE,
+    )
+    candidate_ids = models.BinaryField()  # int64 の配列（おすすめ順）
+    sort_keys = models.BinaryField()      # 同じ並びの sort_key（int64）
+    stale = models.BooleanField(default=False)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # 差分実行で「作り直しが必要な人」を拾う
+            models.Index(
+                fields=["profile"],
+                name="recommendation_stale_idx",
+                condition=models.Q(stale=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Recommendation({self.profile_id}, stale={self.stale})"
+
+
 class BoardPost(models.Model):
     """掲示板の投稿"""
 
@@ -308,6 +534,14 @@ class BoardPost(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # 掲示板一覧（新しい順）と「通話募集だけ」の絞り込み
+            models.Index(fields=["-created_at"], name="boardpost_created_idx"),
+            models.Index(
+                fields=["is_call_invite", "-created_at"],
+                name="boardpost_call_created_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author.nickname}"
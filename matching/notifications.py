@@ -0,0 +1,119 @@
+# matching/notifications.py
+"""
+ナビバーの通知バッジ（新着メッセージ / 新着いいね / 新着マッチ）の状態を返すサービス。
+
+  - 3つのフラグを EXISTS サブクエリ3本の「1クエリ」でまとめて計算
+  - 結果はユーザーごとにキャッシュし、Message / Like（→ Match）/ 既読時刻の更新で破棄
+  - コンテキストプロセッサからは遅延評価で使うので、
+    バッジを表示しないページでは DB にもキャッシュにも触らない
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q, Value, DateTimeField
+from django.db.models.functions import Coalesce
+
+from .models import UserProfile, ChatRoom, Message, Like, Match
+
+NOTIFICATION_CACHE_TIMEOUT = 60 * 5  # 5分
+
+FLAG_NAMES = ("has_new_messages", "has_new_likes", "has_new_matches")
+
+EMPTY_STATE = {name: False for name in FLAG_NAMES}
+
+# last_checked_* が未設定（初回）のときは「全期間」を新着扱いにする
+EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _cache_key(user_id):
+    return f"matching:notifications:{user_id}"
+
+
+def _since(field_name):
+    """プロフィールの last_checked_* （未設定なら EPOCH）"""
+    return Coalesce(
+        OuterRef(field_name),
+        Value(EPOCH),
+        output_field=DateTimeField(),
+    )
+
+
+def notification_state_query(user_id):
+    """通知フラグ3つを annotate したプロフィールの QuerySet（1クエリ）"""
+    me = OuterRef("pk")
+
+    # いいねの送り主とマッチ済み（相互いいね）か
+    matched = Match.objects.filter(
+        profile=OuterRef("to_user"),
+        partner=OuterRef("from_user"),
+    )
+
+    # 🔔 自分が参加しているルームで、最後に見た時刻以降に相手が送ったメッセージ
+    new_messages = Message.objects.filter(
+        Q(room__user1=me) | Q(room__user2=me),
+        created_at__gt=_since("last_checked_messages"),
+    ).exclude(sender=me)
+
+    # 💗 自分宛て & まだいいね返ししていない「いいね」
+    new_likes = Like.objects.filter(
+        to_user=me,
+        created_at__gt=_since("last_checked_likes"),
+    ).exclude(Exists(matched))
+
+    # ❤️‍🔥 最後にマッチ一覧を見てから成立したマッチ
+    new_matches = Match.objects.filter(
+        profile=me,
+        created_at__gt=_since("last_checked_matches"),
+    )
+
+    return (
+        UserProfile.objects.filter(user_id=user_id)
+        .annotate(
+            has_new_messages=Exists(new_messages),
+            has_new_likes=Exists(new_likes),
+            has_new_matches=Exists(new_matches),
+        )
+        .values(*FLAG_NAMES)
+    )
+
+
+def compute_notification_state(user_id):
+    """通知フラグ3つを1クエリで計算する（プロフィールがなければ全部 False）"""
+    row = notification_state_query(user_id).first()
+    if row is None:
+        return dict(EMPTY_STATE)
+    return {name: bool(row[name]) for name in FLAG_NAMES}
+
+
+def get_notification_state(user_id):
+    """キャッシュ経由で通知フラグを返す"""
+    key = _cache_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = compute_notification_state(user_id)
+        cache.set(key, state, NOTIFICATION_CACHE_TIMEOUT)
+    return state
+
+
+# ========== キャッシュ破棄（signals.py から呼ばれる） ==========
+
+
+def invalidate_users(user_ids):
+    cache.delete_many([_cache_key(uid) for uid in user_ids if uid])
+
+
+def invalidate_profiles(profile_ids):
+    """プロフィールID → ユーザーID に引き直して破棄する"""
+    user_ids = UserProfile.objects.filter(
+        pk__in=[pid for pid in profile_ids if pid]
+    ).values_list("user_id", flat=True)
+    invalidate_users(list(user_ids))
+
+
+def invalidate_room(room_id):
+    """ルームの参加者2人分を破棄する（新着メッセージ用）"""
+    user_ids = ChatRoom.objects.filter(pk=room_id).values_list(
+        "user1__user_id", "user2__user_id"
+    ).first()
+    if user_ids:
+        invalidate_users(user_ids)
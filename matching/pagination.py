@@ -0,0 +1,24 @@
+# matching/pagination.py
+"""
+キーセット（カーソル）ページング用の小さなヘルパー。
+
+OFFSET ではなく「前のページの最後の行のキー」を次のページの開始位置にするので、
+何ページ目でも WHERE + ORDER BY + LIMIT の1クエリで済む。
+カーソルは署名付きの文字列にして、クライアントから改ざんされても無視できるようにする。
+"""
+from django.core import signing
+
+
+def encode_cursor(values, salt):
+    """dict などを URL に載せられる署名付き文字列にする"""
+    return signing.dumps(values, salt=salt, compress=True)
+
+
+def decode_cursor(token, salt):
+    """encode_cursor の逆。壊れている・改ざんされている場合は None"""
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=salt)
+    except signing.BadSignature:
+        return None
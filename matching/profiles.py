@@ -0,0 +1,197 @@
+# matching/profiles.py
+"""
+ログイン中ユーザーの UserProfile（= ほぼ全ビューの「me」）を引くヘルパー。
+
+以前はビューのたびに UserProfile.objects.get_or_create(user=...) を投げていた。
+いまは次の順に探し、どこにもなければ DB から get_or_create する。
+
+  1. 同じリクエストで一度引いていればそれ（request._cached_profile）
+  2. 認証時に User と一緒に JOIN して取ってあればそれ（ProfileModelBackend）
+  3. プロセス内に覚えておいたもの（user_id がキー、PROFILE_CACHE_TIMEOUT 秒）
+
+CurrentProfileMiddleware を入れると request.profile（遅延評価）と
+await request.aprofile() が使える（request.user / request.auser() と同じ形）。
+
+※ プロセス内キャッシュは UserProfile の保存・削除で消すが、消えるのはそのプロセスの分だけ。
+  他のワーカーでは最長 PROFILE_CACHE_TIMEOUT 秒、古いプロフィールが見えうる。
+  返すのは毎回コピーなので、ビューで書き換えてもキャッシュ側は変わらない。
+  古いコピーをそのまま save()（全フィールド）すると、他で更新した値（last_checked_* など）を
+  古い値で上書きしてしまう。save(update_fields=...) で書く項目を絞るか、
+  全フィールドを書く（ModelForm など）ときは get_fresh_profile() で DB から引き直すこと。
+"""
+import copy
+import threading
+import time
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.utils.functional import SimpleLazyObject
+
+from .models import UserProfile
+
+_cache = {}  # user_id -> (期限, UserProfile)
+_lock = threading.Lock()
+
+
+def _timeout():
+    return getattr(settings, "PROFILE_CACHE_TIMEOUT", 30)
+
+
+def _remember(profile):
+    if _timeout() > 0:
+        with _lock:
+            _cache[profile.user_id] = (time.monotonic() + _timeout(), profile)
+    return copy.copy(profile)
+
+
+def _recall(user_id):
+    entry = _cache.get(user_id)
+    if entry is None:
+        return None
+    expires, profile = entry
+    if expires < time.monotonic():
+        forget(user_id)
+        return None
+    return copy.copy(profile)
+
+
+def forget(user_id):
+    """プロセス内キャッシュから消す（signals.py から呼ばれる）"""
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def _joined_profile(user):
+    """ProfileModelBackend で JOIN 済みならそのプロフィール（なければ None）"""
+    if user.__class__.profile.is_cached(user):
+        return getattr(user, "profile", None)
+    return None
+
+
+def _create_defaults(user):
+    return {"nickname": user.username}
+
+
+def get_profile(user):
+    """user の UserProfile（なければ作る。未ログインなら None）"""
+    if not user.is_authenticated:
+        return None
+
+    profile = _joined_profile(user) or _recall(user.pk)
+    if profile is None:
+        profile, created = UserProfile.objects.select_related("user").get_or_create(
+            user=user,
+            defaults=_create_defaults(user),
+        )
+        profile = _remember(profile)
+    return profile
+
+
+async def aget_profile(user):
+    """get_profile の async 版"""
+    if not user.is_authenticated:
+        return None
+
+    profile = _joined_profile(user) or _recall(user.pk)
+    if profile is None:
+        profile, created = await UserProfile.objects.select_related("user").aget_or_create(
+            user=user,
+            defaults=_create_defaults(user),
+        )
+        profile = _remember(profile)
+    return profile
+
+
+def get_current_profile(request):
+    """
+    ログイン中ユーザーに対応する UserProfile を返す。
+    なければ作る（ニックネームはユーザー名）。リクエスト内では1回だけ引く。
+    """
+    if not hasattr(request, "_cached_profile"):
+        request._cached_profile = get_profile(request.user)
+    return request._cached_profile
+
+
+async def aget_current_profile(request):
+    """get_current_profile の async 版（request.auser() でユーザーを取る）"""
+    if not hasattr(request, "_cached_profile"):
+        request._cached_profile = await aget_profile(await request.auser())
+    return request._cached_profile
+
+
+def get_fresh_profile(request):
+    """
+    get_current_profile と同じだが、キャッシュは使わず DB の最新を読み直す。
+    全フィールドを保存する前（プロフィール編集のフォームなど）に使う。
+    """
+    profile = get_current_profile(request)
+    if profile is not None:
+        profile.refresh_from_db()
+    return profile
+
+
+# ========== 認証バックエンド / ミドルウェア ==========
+
+
+class ProfileModelBackend(ModelBackend):
+    """セッションから User を引くときに UserProfile も JOIN して取ってくる"""
+
+    def _user_queryset(self):
+        return get_user_model()._default_manager.select_related("profile")
+
+    def get_user(self, user_id):
+        try:
+            user = self._user_queryset().get(pk=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await self._user_queryset().aget(pk=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+class CurrentProfileMiddleware:
+    """
+    request.profile / request.aprofile() を付ける。
+    AuthenticationMiddleware より後ろに置くこと。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _attach(self, request):
+        request.profile = SimpleLazyObject(lambda: get_current_profile(request))
+        request.aprofile = partial(aget_current_profile, request)
+
+        # Django は request.auser() と request.user を別々にキャッシュするので、
+        # async ビューのあとテンプレート（コンテキストプロセッサ）で request.user に触ると
+        # User をもう一度引いてしまう。auser() で引いた User を同期側にも渡しておく。
+        auser = request.auser
+
+        async def shared_auser():
+            user = await auser()
+            request._cached_user = user
+            return user
+
+        request.auser = shared_auser
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._attach(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._attach(request)
+        return await self.get_response(request)
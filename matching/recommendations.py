@@ -0,0 +1,224 @@
+# matching/recommendations.py
+"""
+おすすめ順（matching.scoring）の事前計算。
+
+検索タブを開くたびに候補全員へスコアを付けて並べる代わりに、
+python manage.py build_recommendations で全員分の上位 TOP_K 人を計算して
+Recommendation（1人1行）に入れておき、検索タブ（条件なしのおすすめ順）はそれを読むだけにする。
+
+  1. 属性の表は scoring の memmap（SCORING_DIR/profiles.npy）をそのまま使う。
+  2. いいね・ブロックを「誰が誰に」の dict にまとめておく（load_relations）。
+  3. 1人分は scoring.rank（ベクトル演算1回 + argpartition で上位 K 人）。
+  4. 見る人をチャンクに分け、プロセスプールで CPU コアごとに並列に計算する。
+     ワーカーは fork 後に同じ memmap を開くので、表のコピーは渡さない。
+
+並び順・sort_key は検索タブが自分で並べたときと同じなので、
+事前計算の K 人を読み終えたあとは、同じカーソルのまま scoring に続きを任せられる。
+
+差分実行（デフォルト）では Recommendation がない人と stale な人だけ作り直す。
+stale にするのは signals.py（いいね・ブロック・自分のプロフィールの検索項目の変更）。
+
+計算したあとに新規登録・検索項目を変えた人（UserProfile.search_updated_at > computed_at）は、
+読むとき（aload_entries）にその場でスコアを付けて混ぜる。全件実行を待たずにおすすめに出る。
+混ぜる人が FRESH_LIMIT を超えた人は、差分実行で作り直す（_viewer_ids）。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import scoring
+from .models import UserProfile, Like, Block, Recommendation
+from .search import PROFILE_PAGE_SIZE
+
+# 1人あたり保存する件数（saved_search のスナップショットと同じ 10 ページ分）
+TOP_K = PROFILE_PAGE_SIZE * 10
+
+# 1タスクでまとめて計算する人数
+CHUNK_SIZE = 200
+
+# 読むときに混ぜる「計算したあとに登録・変更した人」の上限（超えたら作り直す）
+FRESH_LIMIT = 200
+
+
+# ========== 入力 ==========
+
+
+def load_relations():
+    """
+    (liked_by_me, liked_me, blocked) の3つの dict（profile_id → 相手 id のリスト）。
+    blocked はどちらがブロックしたかを問わない。
+    """
+    liked_by_me, liked_me, blocked = {}, {}, {}
+    for from_id, to_id in Like.objects.values_list("from_user_id", "to_user_id").iterator():
+        liked_by_me.setdefault(from_id, []).append(to_id)
+        liked_me.setdefault(to_id, []).append(from_id)
+    for blocker_id, blocked_id in Block.objects.values_list("blocker_id", "blocked_id").iterator():
+        blocked.setdefault(blocker_id, []).append(blocked_id)
+        blocked.setdefault(blocked_id, []).append(blocker_id)
+    return liked_by_me, liked_me, blocked
+
+
+# ========== スコアリング（ワーカープロセスで動く部分。DB には触らない） ==========
+
+
+def score_viewer(matrix, viewer_id, liked_me, hidden, top_k=TOP_K):
+    """viewer_id の人から見たおすすめ上位 top_k 人の (candidate_ids, sort_keys)"""
+    viewer = matrix[viewer_id]
+    candidate_ids = scoring.candidate_ids_for(matrix, viewer_id, viewer, hidden)
+    return scoring.rank(matrix, viewer, candidate_ids, liked_me, k=top_k)
+
+
+def _score_chunk(tasks, top_k):
+    """[(viewer_id, liked_me, hidden), ...] → [(viewer_id, ids_bytes, keys_bytes), ...]"""
+    matrix = scoring.load()
+    results = []
+    for viewer_id, liked_me, hidden in tasks:
+        candidate_ids, sort_keys = score_viewer(matrix, viewer_id, liked_me, hidden, top_k)
+        results.append((viewer_id, candidate_ids.tobytes(), sort_keys.tobytes()))
+    return results
+
+
+# ========== まとめて計算して保存 ==========
+
+
+def _fresh_threshold():
+    """
+    この時刻より前に計算したおすすめには、そのあと登録・変更した人が FRESH_LIMIT 人以上いる
+    （= 読むときに混ぜきれないので作り直す）。そこまで変わっていなければ None。
+    """
+    rows = list(
+        UserProfile.objects.filter(search_updated_at__isnull=False)
+        .order_by("-search_updated_at")
+        .values_list("search_updated_at", flat=True)[FRESH_LIMIT - 1:FRESH_LIMIT]
+    )
+    return rows[0] if rows else None
+
+
+def _viewer_ids(full):
+    viewers = UserProfile.objects.filter(user__is_active=True)
+    if not full:
+        outdated = Q(recommendation__isnull=True) | Q(recommendation__stale=True)
+        threshold = _fresh_threshold()
+        if threshold is not None:
+            outdated |= Q(recommendation__computed_at__lte=threshold)
+        viewers = viewers.filter(outdated)
+    return list(viewers.order_by("id").values_list("id", flat=True))
+
+
+def _save(results, computed_at):
+    Recommendation.objects.bulk_create(
+        [
+            Recommendation(
+                profile_id=viewer_id,
+                candidate_ids=ids_bytes,
+                sort_keys=keys_bytes,
+                stale=False,
+                computed_at=computed_at,
+            )
+            for viewer_id, ids_bytes, keys_bytes in results
+        ],
+        update_conflicts=True,
+        unique_fields=["profile"],
+        update_fields=["candidate_ids", "sort_keys", "stale", "computed_at"],
+    )
+
+
+def build(full=False, workers=None, top_k=TOP_K, chunk_size=CHUNK_SIZE):
+    """おすすめを計算して保存する。計算した人数を返す"""
+    # 表を読む前の時刻を computed_at にする（計算中に変わった人は、読むときに混ぜる側に入る）
+    started = timezone.now()
+    if full:
+        scoring.rebuild()
+    viewer_ids = _viewer_ids(full)
+    if not viewer_ids:
+        return 0
+
+    matrix = scoring.ensure(viewer_ids)
+    liked_by_me, liked_me, blocked = load_relations()
+
+    # 途中で退会した人（表に載っていない人）は飛ばす
+    tasks = [
+        (pk, liked_me.get(pk, []), liked_by_me.get(pk, []) + blocked.get(pk, []))
+        for pk in viewer_ids
+        if pk < len(matrix) and matrix["alive"][pk]
+    ]
+    if not tasks:
+        return 0
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            _save(_score_chunk(chunk, top_k), started)
+        return len(tasks)
+
+    # fork したワーカーが親の DB 接続を引き継がないよう、先に閉じておく
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("fork"),
+    ) as pool:
+        for results in pool.map(_score_chunk, chunks, [top_k] * len(chunks)):
+            _save(results, started)
+    return len(tasks)
+
+
+def mark_stale(profile_ids):
+    """作り直しが必要な印を付ける（signals.py から呼ばれる）"""
+    Recommendation.objects.filter(profile_id__in=profile_ids, stale=False).update(stale=True)
+
+
+# ========== 読み込み（検索タブ） ==========
+
+
+def merge_fresh(me, ids, keys, fresh, top_k=TOP_K):
+    """
+    事前計算の (ids, keys) に、そのあと登録・変更した人 fresh（[(id, 自分にいいね済みか), ...]）を
+    付け直したスコアで混ぜ、上位 top_k 人の (ids, keys) にする。
+    """
+    fresh_ids = np.asarray([pk for pk, liked in fresh], dtype=scoring.ID_DTYPE)
+    liked_me = [pk for pk, liked in fresh if liked]
+    matrix = scoring.ensure(fresh_ids)
+    fresh_keys = scoring.sort_keys(matrix, scoring.encode_profile(me), fresh_ids, liked_me)
+
+    # 変更した人は前のスコアの分を消してから入れ直す
+    keep = ~np.isin(ids, fresh_ids)
+    return scoring.top_k(
+        np.concatenate([ids[keep], fresh_ids]),
+        np.concatenate([keys[keep], fresh_keys]),
+        k=top_k,
+    )
+
+
+async def aload_entries(me, qs):
+    """
+    事前計算済みのおすすめ [(id, sort_key), ...]。
+    計算したあとに登録・変更した人のうち qs（検索対象）に入る人は、その場でスコアを付けて混ぜる。
+    まだ計算していない / stale / 混ぜる人が多すぎるなら None（呼び出し側でその場で並べる）。
+    """
+    row = await (
+        Recommendation.objects.filter(profile=me, stale=False)
+        .values_list("candidate_ids", "sort_keys", "computed_at")
+        .afirst()
+    )
+    if row is None:
+        return None
+    candidate_ids, sort_keys, computed_at = row
+
+    fresh_rows = scoring.candidate_rows(qs.filter(search_updated_at__gt=computed_at), me)
+    fresh = [row async for row in fresh_rows[:FRESH_LIMIT + 1]]
+    if len(fresh) > FRESH_LIMIT:
+        await sync_to_async(mark_stale)([me.pk])
+        return None
+
+    ids = np.frombuffer(candidate_ids, dtype=scoring.ID_DTYPE)
+    keys = np.frombuffer(sort_keys, dtype=scoring.ID_DTYPE)
+    if fresh:
+        ids, keys = await sync_to_async(merge_fresh)(me, ids, keys, fresh)
+    return list(zip(ids.tolist(), keys.tolist()))
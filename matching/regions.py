@@ -0,0 +1,77 @@
+# matching/regions.py
+"""
+都道府県 → 地方 → 地方どうしの近さ、の表（アプリ全体でこれ1つを使う）。
+
+  REGION_PREFECTURES : 地方 → 都道府県（8地方区分）
+  REGION_BY_PREF     : 都道府県 → 地方
+  REGION_DISTANCE    : (地方, 地方) → 隣り合う地方を何回たどれば着くか（同じ地方なら 0）
+
+どれも import 時に1回だけ組み立てる。
+UserProfile.region には region_of(prefecture) を保存時に入れてあるので、
+「この地方の人」の絞り込みは DB のインデックスで引ける。
+近くの地方ほど上に出す並べ替えは、おすすめ順のスコア（scoring.REGION_POINTS）で REGION_DISTANCE を使う。
+"""
+from collections import deque
+
+REGION_PREFECTURES = {
+    "北海道": ("北海道",),
+    "東北": ("青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県"),
+    "関東": ("茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県"),
+    "中部": (
+        "新潟県", "富山県", "石川県", "福井県", "山梨県",
+        "長野県", "岐阜県", "静岡県", "愛知県",
+    ),
+    "近畿": ("三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"),
+    "中国": ("鳥取県", "島根県", "岡山県", "広島県", "山口県"),
+    "四国": ("徳島県", "香川県", "愛媛県", "高知県"),
+    "九州・沖縄": (
+        "福岡県", "佐賀県", "長崎県", "熊本県",
+        "大分県", "宮崎県", "鹿児島県", "沖縄県",
+    ),
+}
+
+# 隣り合う地方（陸続き・橋・短い航路でつながっているもの）
+REGION_NEIGHBORS = {
+    "北海道": ("東北",),
+    "東北": ("北海道", "関東", "中部"),
+    "関東": ("東北", "中部"),
+    "中部": ("東北", "関東", "近畿"),
+    "近畿": ("中部", "中国", "四国"),
+    "中国": ("近畿", "四国", "九州・沖縄"),
+    "四国": ("近畿", "中国", "九州・沖縄"),
+    "九州・沖縄": ("中国", "四国"),
+}
+
+REGIONS = tuple(REGION_PREFECTURES)
+REGION_CHOICES = [(region, region) for region in REGIONS]
+
+REGION_BY_PREF = {
+    pref: region
+    for region, prefs in REGION_PREFECTURES.items()
+    for pref in prefs
+}
+
+
+def _distances(start):
+    """start から各地方までの距離（幅優先探索）"""
+    seen = {start: 0}
+    queue = deque([start])
+    while queue:
+        region = queue.popleft()
+        for neighbor in REGION_NEIGHBORS[region]:
+            if neighbor not in seen:
+                seen[neighbor] = seen[region] + 1
+                queue.append(neighbor)
+    return seen
+
+
+REGION_DISTANCE = {
+    (a, b): distance
+    for a in REGIONS
+    for b, distance in _distances(a).items()
+}
+
+
+def region_of(prefecture):
+    """都道府県 → 地方名（該当なしは空文字）"""
+    return REGION_BY_PREF.get(prefecture or "", "")
@@ -0,0 +1,144 @@
+# matching/relations.py
+"""
+ユーザー同士の関係（いいね済み・ブロック）をプロフィールごとにキャッシュするモジュール。
+
+  liked      : 自分が「いいね」した相手ID
+  blocking   : 自分がブロックした相手ID
+  blocked_by : 自分をブロックしている相手ID
+
+Like / Block の作成・削除時に signals.py から当人たちのキャッシュを消すので、
+次に引いたときに DB から作り直される（差分を読み書きすると同時の更新で片方が消えるため、消すだけにする）。
+
+※ キャッシュはプロセス内（LocMemCache）だと他のワーカーには伝わらず、
+  最長 RELATION_CACHE_TIMEOUT の間古い関係が見えうる。表示（いいね済み・ブロック中の表示）にだけ使い、
+  「アクションしてよいか」の判定（is_blocked_between / ais_blocked_between）は毎回 DB に聞く。
+"""
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q, Value, CharField
+
+from .models import Like, Block
+
+RELATION_CACHE_TIMEOUT = 60 * 10  # 10分
+
+LIKED = "liked"
+BLOCKING = "blocking"
+BLOCKED_BY = "blocked_by"
+
+
+def _cache_key(profile_id):
+    return f"matching:relations:{profile_id}"
+
+
+def _relations_query(profile_id):
+    """(相手ID, 種類) の行を UNION ALL で1往復で取るクエリ"""
+    def tagged(qs, column, kind):
+        return qs.annotate(
+            kind=Value(kind, output_field=CharField())
+        ).values_list(column, "kind")
+
+    return tagged(
+        Like.objects.filter(from_user_id=profile_id), "to_user_id", LIKED
+    ).union(
+        tagged(Block.objects.filter(blocker_id=profile_id), "blocked_id", BLOCKING),
+        tagged(Block.objects.filter(blocked_id=profile_id), "blocker_id", BLOCKED_BY),
+        all=True,
+    )
+
+
+def _empty_relations():
+    return {LIKED: set(), BLOCKING: set(), BLOCKED_BY: set()}
+
+
+def _load_relations(profile_id):
+    """DB から関係セットを作る"""
+    relations = _empty_relations()
+    for other_id, kind in _relations_query(profile_id):
+        relations[kind].add(other_id)
+    return relations
+
+
+async def _aload_relations(profile_id):
+    relations = _empty_relations()
+    async for other_id, kind in _relations_query(profile_id):
+        relations[kind].add(other_id)
+    return relations
+
+
+def get_relations(profile_id):
+    """プロフィールの関係セット（dict of set）をキャッシュ経由で返す"""
+    key = _cache_key(profile_id)
+    relations = cache.get(key)
+    if relations is None:
+        relations = _load_relations(profile_id)
+        cache.set(key, relations, RELATION_CACHE_TIMEOUT)
+    return relations
+
+
+async def aget_relations(profile_id):
+    """get_relations の async 版"""
+    key = _cache_key(profile_id)
+    relations = await cache.aget(key)
+    if relations is None:
+        relations = await _aload_relations(profile_id)
+        await cache.aset(key, relations, RELATION_CACHE_TIMEOUT)
+    return relations
+
+
+def has_liked(me, other):
+    """me → other の「いいね」済みか"""
+    return other.pk in get_relations(me.pk)[LIKED]
+
+
+def _blocks_between(me, other):
+    return Block.objects.filter(
+        Q(blocker_id=me.pk, blocked_id=other.pk) | Q(blocker_id=other.pk, blocked_id=me.pk)
+    )
+
+
+def is_blocked_between(me, other):
+    """どちらかがどちらかをブロックしているか（権限チェックなのでキャッシュを使わず DB の EXISTS 1回）"""
+    return _blocks_between(me, other).exists()
+
+
+async def ais_blocked_between(me, other):
+    """is_blocked_between の async 版"""
+    return await _blocks_between(me, other).aexists()
+
+
+def exclude_hidden(qs, me):
+    """
+    いいね済み・ブロック関係の相手を除外する（アンチジョイン）。
+    ID の IN リストを DB に送り返さず、NOT EXISTS で1クエリに収める。
+    """
+    return qs.exclude(
+        Exists(Like.objects.filter(from_user=me, to_user=OuterRef("pk")))
+    ).exclude(
+        Exists(Block.objects.filter(blocker=me, blocked=OuterRef("pk")))
+    ).exclude(
+        Exists(Block.objects.filter(blocker=OuterRef("pk"), blocked=me))
+    )
+
+
+# ========== キャッシュを消す（signals.py から呼ばれる） ==========
+
+
+def like_added(like):
+    forget(like.from_user_id)
+
+
+def like_removed(like):
+    forget(like.from_user_id)
+
+
+def block_added(block):
+    forget(block.blocker_id)
+    forget(block.blocked_id)
+
+
+def block_removed(block):
+    forget(block.blocker_id)
+    forget(block.blocked_id)
+
+
+def forget(profile_id):
+    cache.delete(_cache_key(profile_id))
@@ -0,0 +1,64 @@
+# matching/rooms.py
+"""
+2人のチャットルームを引くためのヘルパー。
+
+ChatRoom は (user1, user2) を常に「小さい pk, 大きい pk」の順で持つ
+（ChatRoom.save() と CheckConstraint で保証）。
+なので Q(user1=a, user2=b) | Q(user1=b, user2=a) の OR は要らず、
+unique_chatroom_pair のインデックスを1回引けば見つかる。
+
+相手が何人いても arooms_with() なら1クエリで済む。
+"""
+from django.db.models import Q
+
+from .models import ChatRoom
+
+
+def _pk(profile):
+    return getattr(profile, "pk", profile)
+
+
+def ordered_pair(a, b):
+    """(小さい pk, 大きい pk)。プロフィールでも pk でもよい"""
+    a, b = _pk(a), _pk(b)
+    return (a, b) if a < b else (b, a)
+
+
+def room_between(a, b):
+    """2人のルームの QuerySet（0件 or 1件）"""
+    user1_id, user2_id = ordered_pair(a, b)
+    return ChatRoom.objects.filter(user1_id=user1_id, user2_id=user2_id)
+
+
+def get_or_create_room(a, b):
+    """2人のルームを返す（なければ作る）。(room, created)"""
+    user1_id, user2_id = ordered_pair(a, b)
+    # 同時に作られたときは get_or_create が IntegrityError を拾って取り直す
+    return ChatRoom.objects.get_or_create(user1_id=user1_id, user2_id=user2_id)
+
+
+def _rooms_with_query(me_id, partner_ids):
+    higher = [pid for pid in partner_ids if pid > me_id]  # 自分が user1 側
+    lower = [pid for pid in partner_ids if pid < me_id]   # 自分が user2 側
+    return ChatRoom.objects.filter(
+        Q(user1_id=me_id, user2_id__in=higher) | Q(user1_id__in=lower, user2_id=me_id)
+    )
+
+
+def _partner_id(room, me_id):
+    return room.user2_id if room.user1_id == me_id else room.user1_id
+
+
+async def arooms_with(me, partners):
+    """
+    自分と partners それぞれのルームを1クエリで引く。
+    {相手の pk: ChatRoom}（ルームがない相手は入らない）
+    """
+    me_id = _pk(me)
+    partner_ids = {_pk(p) for p in partners} - {me_id}
+    if not partner_ids:
+        return {}
+    return {
+        _partner_id(room, me_id): room
+        async for room in _rooms_with_query(me_id, partner_ids)
+    }
@@ -1,7 +1,8 @@
 # config/routing.py とかにある想定
 from django.urls import re_path
-from matching.consumers import CallConsumer
+from matching.consumers import CallConsumer, ChatConsumer
 
 websocket_urlpatterns = [
     re_path(r"ws/call/(?P<room_id>\d+)/$", CallConsumer.as_asgi()),
+    re_path(r"ws/chat/(?P<room_id>\d+)/$", ChatConsumer.as_asgi()),
 ]
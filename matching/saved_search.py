@@ -0,0 +1,274 @@
+# matching/saved_search.py
+"""
+プロフィール検索（profile_list）の「前回の条件」と「結果のスナップショット」。
+
+  前回の条件   : SearchCondition（1人1レコード）に保存しておき、
+                 条件なしで検索タブを開いたときはそれで検索する。
+  スナップショット : (自分, 条件のハッシュ) ごとに、並び順どおりの (id, sort_key) を
+                 SNAPSHOT_SIZE 件ずつのブロックにしてキャッシュに覚えておく。
+                 続きのページ・戻るボタン・タブの開き直しはこの ID から引くので、
+                 絞り込み + スコアリングの重いクエリを投げ直さない（pk IN の1クエリ）。
+                 おすすめ順・条件なしの先頭ブロックは、バッチで事前計算した Recommendation を使う。
+
+おすすめ順で先頭ブロックより先に進んだときは、前のブロックの最後の人の続きを
+次のブロックとして1回だけ並べてキャッシュする（カーソルに「どのブロックか」を入れておく）。
+新しい順 / ランダム順の先は SQL のキーセットページングで十分速いので、ブロックは先頭だけ。
+
+スナップショットのキーには2つのバージョンを混ぜてあり、上がると一斉に作り直しになる。
+
+  全体のバージョン   : 新規登録・プロフィールの検索項目の変更・退会（誰の結果にも影響しうる）
+  自分のバージョン   : 自分がいいねした / ブロックした・された（自分の結果から消える人がいる）
+
+バージョンを上げるのは signals.py。上げ忘れても SEARCH_SNAPSHOT_TIMEOUT 秒で消える。
+"""
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import recommendations, scoring
+from .models import SearchCondition, UserProfile
+from .pagination import encode_cursor, decode_cursor
+from .search import (
+    CURSOR_SALT,
+    PROFILE_PAGE_SIZE,
+    order_profiles,
+    parse_search_params,
+    afetch_profile_page,
+)
+
+# 検索条件として扱う GET パラメータ（どれかがあれば「条件を指定して開いた」）
+SEARCH_PARAM_NAMES = ("pref", "region", "gender", "purpose", "min_income", "photo_only", "age", "q", "order")
+
+# 変わると検索結果が変わりうる UserProfile のフィールド
+SEARCH_FIELDS = UserProfile.SEARCH_FIELDS
+
+# スナップショットの1ブロックの件数
+SNAPSHOT_SIZE = PROFILE_PAGE_SIZE * 10
+
+SNAPSHOT_KEY_PREFIX = "matching:search:snapshot"
+GLOBAL_VERSION_KEY = "matching:search:version"
+
+
+# ========== 前回の条件 ==========
+
+
+def has_search_params(params):
+    return any(name in params for name in SEARCH_PARAM_NAMES)
+
+
+def condition_to_params(condition):
+    """SearchCondition → parse_search_params に渡せる dict"""
+    return {
+        "pref": condition.prefecture,
+        "region": condition.region,
+        "gender": condition.gender or "",
+        "purpose": condition.purpose,
+        "min_income": "" if condition.income_min is None else str(condition.income_min),
+        "photo_only": "1" if condition.photo_only else "",
+        "age": condition.age_filter,
+        "q": condition.keyword,
+        "order": condition.order,
+    }
+
+
+def _apply_filters(condition, filters):
+    try:
+        income_min = int(filters["min_income"]) if filters["min_income"] else None
+    except ValueError:
+        income_min = None
+
+    condition.order = filters["order"]
+    condition.age_filter = filters["age"][:10]
+    condition.prefecture = filters["pref"][:10]
+    condition.region = filters["region"][:10]
+    condition.gender = filters["gender"][:1]
+    condition.income_min = income_min
+    condition.purpose = filters["purpose"][:100]
+    condition.photo_only = filters["photo_only"] == "1"
+    condition.keyword = filters["q"][:100]
+
+
+def _latest_condition(me):
+    return SearchCondition.objects.filter(owner=me).order_by("-last_used_at")
+
+
+async def aload_search_params(me):
+    """前回の検索条件（GET パラメータと同じ形の dict）。保存されていなければ None"""
+    condition = await _latest_condition(me).afirst()
+    if condition is None:
+        return None
+    return condition_to_params(condition)
+
+
+async def asave_search_conditions(me, filters):
+    """今回の検索条件を保存する（前回と同じなら書き込まない）"""
+    condition = await _latest_condition(me).afirst() or SearchCondition(owner=me)
+    before = condition_to_params(condition) if condition.pk else None
+    _apply_filters(condition, filters)
+    if condition_to_params(condition) != before:
+        await condition.asave()
+
+
+# ========== バージョン（signals.py から上げる） ==========
+
+
+def _profile_version_key(profile_id):
+    return f"{GLOBAL_VERSION_KEY}:{profile_id}"
+
+
+def bump_global_version():
+    cache.set(GLOBAL_VERSION_KEY, time.time_ns(), None)
+
+
+def bump_profile_versions(profile_ids):
+    version = time.time_ns()
+    cache.set_many({_profile_version_key(pid): version for pid in profile_ids}, None)
+
+
+async def _aversions(profile_id):
+    keys = [GLOBAL_VERSION_KEY, _profile_version_key(profile_id)]
+    found = await cache.aget_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        await cache.aset_many(missing, None)
+        found.update(missing)
+    return found[keys[0]], found[keys[1]]
+
+
+# ========== 結果のスナップショット ==========
+
+
+def condition_hash(filters, seed=None):
+    """検索条件（ランダム順ならシードも）→ 短いハッシュ"""
+    payload = json.dumps([filters, seed], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+async def _asnapshot_key(me, filters, seed, anchor=None):
+    global_version, my_version = await _aversions(me.pk)
+    digest = condition_hash(filters, seed)
+    key = f"{SNAPSHOT_KEY_PREFIX}:{me.pk}:{digest}:{global_version}:{my_version}"
+    if anchor is not None:
+        key += ":{}.{}".format(*anchor)
+    return key
+
+
+def _is_default_recommended(filters):
+    """条件なしのおすすめ順（= 事前計算の対象）か"""
+    return filters == parse_search_params({})
+
+
+async def _aget_snapshot(qs, me, filters, seed, anchor=None):
+    """
+    [(id, sort_key), ...]（並び順どおり、最大 SNAPSHOT_SIZE 件）。
+    anchor（(sort_key, id)）を渡すと、その人の続きから始まるブロック。
+    """
+    key = await _asnapshot_key(me, filters, seed, anchor)
+    entries = await cache.aget(key)
+    if entries is None and anchor is None and _is_default_recommended(filters):
+        entries = await recommendations.aload_entries(me, qs)
+        if entries is not None:
+            await cache.aset(key, entries, settings.SEARCH_SNAPSHOT_TIMEOUT)
+    if entries is None:
+        entries = await _arank(qs, me, filters["order"], seed, limit=SNAPSHOT_SIZE, after=anchor)
+        await cache.aset(key, entries, settings.SEARCH_SNAPSHOT_TIMEOUT)
+    return entries
+
+
+async def _arank(qs, me, order, seed, limit, after=None):
+    """[(id, sort_key), ...]（並び順どおり、after の続きから最大 limit 件）"""
+    if order == "recommended":
+        return await sync_to_async(scoring.rank_queryset)(qs, me, k=limit, after=after)
+
+    ordered = order_profiles(qs, order, seed=seed)
+    return [
+        (pk, sort_key)
+        async for pk, sort_key in ordered.values_list("id", "sort_key")[:limit]
+    ]
+
+
+def _decode(cursor, order):
+    """カーソル → (位置, ブロックの起点)。どちらも (sort_key, id) で、なければ None"""
+    data = decode_cursor(cursor, salt=CURSOR_SALT)
+    if not data or data.get("o") != order:
+        return None, None
+    anchor = data.get("b")
+    return (data["k"], data["id"]), (tuple(anchor) if anchor else None)
+
+
+def _start_of(entries, position):
+    """position の次の人がブロックの何番目か（先頭からなら 0、ブロックにいなければ None）"""
+    if position is None:
+        return 0
+    ids = [pk for pk, sort_key in entries]
+    try:
+        return ids.index(position[1]) + 1
+    except ValueError:
+        return None
+
+
+def _end_of(entries):
+    """ブロックの最後の人の位置（次のブロックの起点）"""
+    last_id, last_key = entries[-1]
+    return last_key, last_id
+
+
+def _is_full(entries):
+    """ブロックがいっぱい（= この先にもまだいるかもしれない）か"""
+    return len(entries) >= SNAPSHOT_SIZE
+
+
+async def afetch_page(qs, me, filters, cursor=None, seed=None, page_size=PROFILE_PAGE_SIZE):
+    """
+    検索タブの1ページ分のプロフィールと、次ページ用カーソル（なければ None）。
+    スナップショットのブロックから取り、足りなければ次のブロックから足す。
+    """
+    order = filters["order"]
+    position, anchor = _decode(cursor, order)
+    if order != "recommended":
+        anchor = None
+
+    entries = await _aget_snapshot(qs, me, filters, seed, anchor)
+    start = _start_of(entries, position)
+    if start is None:
+        if order != "recommended":
+            return await afetch_profile_page(qs, order, cursor=cursor, seed=seed, page_size=page_size)
+        # ブロックが作り直されてカーソルの人がいない → カーソルの位置から新しいブロックにする
+        anchor = position
+        entries = await _aget_snapshot(qs, me, filters, seed, anchor)
+        start = 0
+
+    chunk = entries[start:start + page_size + 1]
+    if len(chunk) <= page_size and _is_full(entries):
+        if order != "recommended":
+            return await afetch_profile_page(qs, order, cursor=cursor, seed=seed, page_size=page_size)
+        following = await _aget_snapshot(qs, me, filters, seed, _end_of(entries))
+        chunk += following[:page_size + 1 - len(chunk)]
+
+    page = chunk[:page_size]
+    # qs（絞り込み済み）から引くので、スナップショットのあとでいいね・ブロック・退会した人は出ない
+    by_id = await qs.ain_bulk([pk for pk, sort_key in page])
+
+    profiles = []
+    for pk, sort_key in page:
+        profile = by_id.get(pk)
+        if profile is not None:
+            profile.sort_key = sort_key
+            profiles.append(profile)
+
+    next_cursor = None
+    if len(chunk) > page_size:
+        last_id, last_key = page[-1]
+        cursor_data = {"o": order, "k": last_key, "id": last_id}
+        if order == "recommended":
+            # ページの最後の人がいるブロック（次のブロックに入っていれば、その起点）
+            in_block = start + page_size <= len(entries)
+            block_anchor = anchor if in_block else _end_of(entries)
+            cursor_data["b"] = list(block_anchor) if block_anchor else None
+        next_cursor = encode_cursor(cursor_data, salt=CURSOR_SALT)
+
+    return profiles, next_cursor
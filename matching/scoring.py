@@ -0,0 +1,325 @@
+# matching/scoring.py
+"""
+おすすめ順のスコアリング（検索タブと build_recommendations で共通）。
+
+全プロフィールの属性を整数コードにした表（1行 = 1プロフィール、行番号 = pk）を
+SCORING_DIR/profiles.npy に置き、各プロセスはそれを np.load(mmap_mode="r") で共有して読む。
+
+  alive      : 1 = いる / 0 = 退会・まだ載っていない
+  gender     : GENDER_CODES（0 = 未設定）
+  prefecture : PREF_CHOICES の順番 + 1（0 = 未設定）
+  region     : regions.REGIONS の順番 + 1（0 = 未設定。UserProfile.region から）
+  purpose    : PURPOSE_CHOICES の順番 + 1（0 = 未設定）
+  has_avatar : メイン画像があるか
+  age        : age_range を年代にしたもの（「30代」「34」「34歳」→ 30。0 = 不明）
+  income     : 年収（万円。-1 = 未入力）
+
+1人分のスコアは候補の行をまとめて取り出してベクトル演算1回で出し、
+上位だけ欲しいときは argpartition で K 件に絞ってから並べる。
+
+  自分にいいね済み +30 / 同県 +20 / 同じ地方 +10 / 隣の地方 +5 / 同じ年代 +3 / 同じ利用目的 +2
+  sort_key = スコア × SCORE_SCALE + id（(sort_key, id) の降順に並べる）
+
+表の更新は差分で行う（UserProfile の保存・削除で signals.py から refresh()）。
+行を書き換えるのはその場（r+ の memmap）、pk が表の大きさを超えたときだけ
+大きくした新しいファイルに差し替える。差し替えは inode で気づいて開き直す。
+作り直すときは python manage.py build_recommendations --full。
+"""
+import fcntl
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from .models import UserProfile, Like
+from .regions import REGIONS, REGION_DISTANCE
+
+DTYPE = np.dtype([
+    ("alive", "i1"),
+    ("gender", "i1"),
+    ("prefecture", "i1"),
+    ("region", "i1"),
+    ("purpose", "i1"),
+    ("has_avatar", "i1"),
+    ("age", "i2"),
+    ("income", "i4"),
+])
+ID_DTYPE = np.dtype("=i8")
+
+# 配点（sort_key = スコア × SCORE_SCALE + id）
+SCORE_LIKED_ME = 30  # 相手がもう自分にいいねしている（押せばすぐマッチ）
+SCORE_SAME_PREFECTURE = 20
+SCORE_SAME_REGION = 10
+SCORE_NEAR_REGION = 5
+SCORE_SAME_AGE = 3
+SCORE_SAME_PURPOSE = 2
+SCORE_SCALE = 1000
+
+GENDER_CODES = {"M": 1, "F": 2, "O": 3}
+OPPOSITE_GENDER = {1: 2, 2: 1}
+PREF_CODES = {code: i + 1 for i, (code, label) in enumerate(UserProfile.PREF_CHOICES)}
+REGION_CODES = {name: i + 1 for i, name in enumerate(REGIONS)}
+PURPOSE_CODES = {code: i + 1 for i, (code, label) in enumerate(UserProfile.PURPOSE_CHOICES)}
+
+
+def _region_points():
+    """地方コード × 地方コード → 地方の近さの点（0 = 未設定の行・列は 0 点）"""
+    points_by_distance = {0: SCORE_SAME_REGION, 1: SCORE_NEAR_REGION}
+    points = np.zeros((len(REGIONS) + 1, len(REGIONS) + 1), dtype=ID_DTYPE)
+    for (a, b), distance in REGION_DISTANCE.items():
+        points[REGION_CODES[a], REGION_CODES[b]] = points_by_distance.get(distance, 0)
+    return points
+
+
+REGION_POINTS = _region_points()
+
+EMPTY_ROW = (0,) * len(DTYPE)
+
+# その場で並べる（rank_queryset）ときに DB から取る候補の上限（新しい順）
+RANK_CANDIDATE_LIMIT = 5000
+
+# 表を大きくするときの余白（新規登録のたびに作り直さないように）
+GROW_MARGIN = 1024
+
+PROFILE_FIELDS = ("id", "gender", "prefecture", "region", "age_range", "purpose", "avatar", "income")
+
+AGE_RE = re.compile(r"\d+")
+
+_local = threading.local()
+
+
+# ========== エンコード ==========
+
+
+def age_bucket(age_range):
+    """「30代」「34」「34歳」→ 30（読めなければ 0）"""
+    match = AGE_RE.search(unicodedata.normalize("NFKC", age_range or ""))
+    if not match:
+        return 0
+    age = int(match.group())
+    return age // 10 * 10 if 10 <= age < 100 else 0
+
+
+def encode(gender, prefecture, region, age_range, purpose, avatar, income):
+    """1人分の属性 → DTYPE の1行（タプル）"""
+    return (
+        1,
+        GENDER_CODES.get(gender, 0),
+        PREF_CODES.get(prefecture, 0),
+        REGION_CODES.get(region, 0),
+        PURPOSE_CODES.get(purpose, 0),
+        1 if avatar else 0,
+        age_bucket(age_range),
+        -1 if income is None else income,
+    )
+
+
+def encode_profile(profile):
+    """UserProfile → DTYPE の1要素の配列（見る人の側に使う）"""
+    return np.array(
+        [encode(profile.gender, profile.prefecture, profile.region, profile.age_range,
+                profile.purpose, profile.avatar, profile.income)],
+        dtype=DTYPE,
+    )[0]
+
+
+def _encode_rows(rows, size):
+    """values_list(*PROFILE_FIELDS) の行 → 行番号 = pk の表"""
+    matrix = np.zeros(size, dtype=DTYPE)
+    for pk, *values in rows:
+        matrix[pk] = encode(*values)
+    return matrix
+
+
+# ========== ファイル（memmap）の読み書き ==========
+
+
+def _path():
+    return Path(settings.SCORING_DIR) / "profiles.npy"
+
+
+@contextmanager
+def _locked():
+    """書き込みはプロセスをまたいで1人ずつ"""
+    path = _path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield path
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _replace(path, matrix):
+    tmp = path.with_suffix(".tmp.npy")
+    np.save(tmp, matrix)
+    os.replace(tmp, path)
+
+
+def rebuild():
+    """DB から表を作り直す。載せたプロフィール数を返す"""
+    with _locked() as path:
+        rows = list(UserProfile.objects.values_list(*PROFILE_FIELDS).iterator())
+        size = max((row[0] for row in rows), default=0) + 1 + GROW_MARGIN
+        _replace(path, _encode_rows(rows, size))
+    return len(rows)
+
+
+def load():
+    """表（読み取り専用の memmap）。ファイルがなければ DB から作る"""
+    path = _path()
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        rebuild()
+        inode = os.stat(path).st_ino
+
+    mapped = getattr(_local, "mapped", None)
+    if mapped is None or mapped[0] != inode:
+        mapped = (inode, np.load(path, mmap_mode="r"))
+        _local.mapped = mapped
+    return mapped[1]
+
+
+def refresh(profile_ids):
+    """
+    指定したプロフィールの行だけ DB から読み直す（消えていれば alive = 0）。
+    表がまだなければ何もしない（最初に load() したときに全部作る）。
+    """
+    profile_ids = set(profile_ids)
+    if not profile_ids or not _path().exists():
+        return
+    rows = list(UserProfile.objects.filter(pk__in=profile_ids).values_list(*PROFILE_FIELDS))
+
+    with _locked() as path:
+        matrix = np.load(path, mmap_mode="r+")
+        needed = max(profile_ids) + 1
+        if needed > len(matrix):
+            grown = np.zeros(needed + GROW_MARGIN, dtype=DTYPE)
+            grown[:len(matrix)] = matrix
+            del matrix
+            matrix = grown
+        for pk in profile_ids:
+            matrix[pk] = EMPTY_ROW
+        for pk, *values in rows:
+            matrix[pk] = encode(*values)
+
+        if isinstance(matrix, np.memmap):
+            matrix.flush()
+        else:
+            _replace(path, matrix)
+
+
+def ensure(candidate_ids):
+    """候補が全員表に載っている状態の表を返す（載っていない人はその場で読み直す）"""
+    matrix = load()
+    ids = np.asarray(candidate_ids, dtype=ID_DTYPE)
+    outside = ids >= len(matrix)
+    missing = ids[outside].tolist()
+    inside = ids[~outside]
+    missing += inside[matrix["alive"][inside] == 0].tolist()
+    if missing:
+        refresh(missing)
+        matrix = load()
+    return matrix
+
+
+# ========== スコアリング ==========
+
+
+def sort_keys(matrix, viewer, candidate_ids, liked_me=()):
+    """viewer（encode_profile の1行）から見た candidate_ids それぞれの sort_key"""
+    ids = np.asarray(candidate_ids, dtype=ID_DTYPE)
+    rows = matrix[ids]
+    score = np.zeros(ids.size, dtype=ID_DTYPE)
+    # 地方は同じ / 隣かを表引きで（未設定どうしは 0 点）
+    score += REGION_POINTS[viewer["region"]][rows["region"]]
+    for field, points in (
+        ("prefecture", SCORE_SAME_PREFECTURE),
+        ("age", SCORE_SAME_AGE),
+        ("purpose", SCORE_SAME_PURPOSE),
+    ):
+        mine = viewer[field]
+        if mine:  # 自分が未設定の項目は加点しない
+            score += np.where(rows[field] == mine, points, 0)
+    if len(liked_me):
+        score += np.where(np.isin(ids, np.asarray(liked_me, dtype=ID_DTYPE)), SCORE_LIKED_ME, 0)
+    return score * SCORE_SCALE + ids
+
+
+def top_k(ids, keys, k=None, after=None):
+    """
+    (sort_key, id) の降順に並べた (ids, keys)。
+      after : (sort_key, id)。それより後ろ（カーソルの続き）だけ
+      k     : 先頭 k 件だけ（argpartition で絞ってから並べる）
+    """
+    ids = np.asarray(ids, dtype=ID_DTYPE)
+    keys = np.asarray(keys, dtype=ID_DTYPE)
+    if after is not None:
+        after_key, after_id = after
+        rest = (keys < after_key) | ((keys == after_key) & (ids < after_id))
+        ids, keys = ids[rest], keys[rest]
+
+    if k is not None and k < ids.size:
+        if k <= 0:
+            return ids[:0], keys[:0]
+        # k 番目に大きいキー以上だけ残す（同点は下の並べ替えで id の降順にそろえる）
+        kth = keys[np.argpartition(keys, -k)[-k]]
+        keep = keys >= kth
+        ids, keys = ids[keep], keys[keep]
+
+    order = np.lexsort((-ids, -keys))[:k]
+    return ids[order], keys[order]
+
+
+def candidate_ids_for(matrix, viewer_id, viewer, hidden=()):
+    """表の全員から、viewer の検索対象（自分以外・異性のみ・hidden 以外）の id"""
+    mask = matrix["alive"] == 1
+    if viewer_id < len(mask):
+        mask[viewer_id] = False
+    opposite = OPPOSITE_GENDER.get(int(viewer["gender"]))
+    if opposite:
+        mask &= matrix["gender"] == opposite
+    ids = np.flatnonzero(mask).astype(ID_DTYPE)
+    if len(hidden):
+        ids = ids[~np.isin(ids, np.asarray(hidden, dtype=ID_DTYPE))]
+    return ids
+
+
+def rank(matrix, viewer, candidate_ids, liked_me=(), k=None, after=None):
+    """candidate_ids をおすすめ順に並べた (ids, sort_keys)"""
+    keys = sort_keys(matrix, viewer, candidate_ids, liked_me)
+    return top_k(candidate_ids, keys, k=k, after=after)
+
+
+def candidate_rows(qs, me):
+    """qs → (id, 自分にいいね済みか) の行（新しい順）。スライスして1クエリで取る"""
+    return (
+        qs.annotate(
+            liked_me=Exists(Like.objects.filter(from_user=OuterRef("pk"), to_user=me))
+        )
+        .order_by("-id")
+        .values_list("id", "liked_me")
+    )
+
+
+def rank_queryset(qs, me, k=None, after=None, limit=RANK_CANDIDATE_LIMIT):
+    """
+    qs（filter_profiles の結果）を me から見たおすすめ順に並べた [(id, sort_key), ...]。
+    候補の id と「自分にいいねしたか」を1クエリで（新しい順に最大 limit 人）取り、並べるのは NumPy で行う。
+    候補がそれより多いときは、新しい limit 人の中での順位になる
+    （条件なしのおすすめ順は build_recommendations が全員から選んだものを使う）。
+    """
+    rows = list(candidate_rows(qs, me)[:limit])
+    candidate_ids = [pk for pk, liked in rows]
+    liked_me = [pk for pk, liked in rows if liked]
+    matrix = ensure(candidate_ids)
+    ids, keys = rank(matrix, encode_profile(me), candidate_ids, liked_me, k=k, after=after)
+    return list(zip(ids.tolist(), keys.tolist()))
@@ -0,0 +1,195 @@
+# matching/search.py
+"""
+プロフィール検索（profile_list）の絞り込みと並び順。
+
+  絞り込み          : filter_profiles（自分以外・異性・いいね済み / ブロック関係の除外 + 条件）
+  新しい順 / ランダム : 並び順のキーを SQL で annotate し、ORDER BY + LIMIT まで DB に任せる
+  おすすめ順        : matching.scoring（NumPy）でスコアを付けて並べる
+
+ページングはキーセット方式（matching.pagination）で、
+どの並び順でも「(sort_key, id) の降順で、カーソルより後ろ」を取る。
+キャッシュ・事前計算と組み合わせた1ページの取り出しは matching.saved_search。
+"""
+import secrets
+
+from django.db.models import Value, F, Q
+from django.db.models.functions import Mod
+
+from . import fulltext
+from .models import UserProfile
+from .pagination import encode_cursor, decode_cursor
+from .relations import exclude_hidden
+
+# 1ページ（1回のクエリ）で返す件数
+PROFILE_PAGE_SIZE = 24
+
+ORDER_CHOICES = ("recommended", "new", "random")
+
+CURSOR_SALT = "matching.search.cursor"
+
+# ランダム順用：id とシードから決まる擬似乱数キー（線形合同法）
+# シードが同じなら並びも同じなので、ページをまたいでも順番が崩れない。
+RANDOM_MULTIPLIER = 1103515245
+RANDOM_MODULUS = 2147483647
+RANDOM_SEED_SESSION_KEY = "profile_list_random_seed"
+
+def random_key_expression(seed):
+    """シードごとに決まるランダム順のキー式"""
+    return Mod(
+        F("id") * Value(RANDOM_MULTIPLIER) + Value(seed),
+        Value(RANDOM_MODULUS),
+    )
+
+
+def new_random_seed():
+    return secrets.randbelow(RANDOM_MODULUS)
+
+
+async def aget_random_seed(session, reset=False):
+    """
+    セッションごとのランダム順シードを返す。
+    reset=True のときは振り直す（ランダムタブを開き直したとき）。
+    """
+    seed = await session.aget(RANDOM_SEED_SESSION_KEY)
+    if reset or not isinstance(seed, int):
+        seed = new_random_seed()
+        await session.aset(RANDOM_SEED_SESSION_KEY, seed)
+    return seed
+
+
+# ========== 絞り込み ==========
+
+
+def parse_search_params(params):
+    """GET パラメータ → 検索条件 dict（テンプレートにもそのまま渡せる形）"""
+    order = params.get("order", "recommended")
+    if order not in ORDER_CHOICES:
+        order = "recommended"
+
+    return {
+        "pref": params.get("pref", "").strip(),
+        "region": params.get("region", "").strip(),
+        "gender": params.get("gender", "").strip(),
+        "purpose": params.get("purpose", "").strip(),
+        "min_income": params.get("min_income", "").strip(),
+        "photo_only": params.get("photo_only", ""),
+        "age": params.get("age", "any").strip(),
+        "q": params.get("q", "").strip(),
+        "order": order,
+    }
+
+
+def filter_profiles(me, filters):
+    """検索対象（自分以外・いいね済み/ブロック関係を除く）に条件を適用した QuerySet"""
+    # 自分以外
+    qs = UserProfile.objects.exclude(pk=me.pk)
+
+    # 性別が M/F のときだけ「異性のみ」フィルタ
+    if me.gender in ("M", "F"):
+        opposite = "F" if me.gender == "M" else "M"
+        qs = qs.filter(gender=opposite)
+
+    # いいね済み + ブロック関係のある相手は除外（NOT EXISTS のアンチジョイン）
+    qs = exclude_hidden(qs, me)
+
+    # 都道府県フィルタ
+    if filters["pref"]:
+        qs = qs.filter(prefecture=filters["pref"])
+
+    # 地方フィルタ（UserProfile.region のインデックスで引く）
+    if filters["region"]:
+        qs = qs.filter(region=filters["region"])
+
+    # 性別フィルタ（上の「異性のみ」と両立させたいなら AND になる）
+    if filters["gender"]:
+        qs = qs.filter(gender=filters["gender"])
+
+    # ★ 利用目的フィルタ
+    if filters["purpose"]:
+        qs = qs.filter(purpose=filters["purpose"])
+
+    # 年収下限（数値にならなければ無視）
+    if filters["min_income"]:
+        try:
+            qs = qs.filter(income__gte=int(filters["min_income"]))
+        except ValueError:
+            pass
+
+    # 写真ありのみ
+    if filters["photo_only"] == "1":
+        qs = qs.exclude(avatar="").exclude(avatar__isnull=True)
+
+    # 年齢フィルタ（自分と同じ age_range）
+    if filters["age"] == "near" and me.age_range:
+        qs = qs.filter(age_range=me.age_range)
+
+    # キーワード（自己紹介・職業・エリア・ニックネームの全文検索）
+    if filters["q"]:
+        qs = fulltext.filter_matching(qs, fulltext.PROFILE, filters["q"])
+
+    return qs
+
+
+# ========== 並び順 + キーセットページング ==========
+
+
+def order_profiles(qs, order, seed=None):
+    """
+    並び順のキーを sort_key として annotate し、(sort_key, id) の降順に並べる。
+      - new    : 新しい順（id）
+      - random : シード付きの擬似ランダム
+    おすすめ順は SQL では並べない（matching.scoring）。
+    """
+    if order == "new":
+        key = F("id")
+    elif order == "random":
+        key = random_key_expression(seed if seed is not None else new_random_seed())
+    else:
+        raise ValueError(f"{order} は SQL では並べられません")
+
+    return qs.annotate(sort_key=key).order_by("-sort_key", "-id")
+
+
+def cursor_position(cursor, order):
+    """カーソル → (sort_key, id)。なし・壊れている・別の並び順のものなら None"""
+    position = decode_cursor(cursor, salt=CURSOR_SALT)
+    if position and position.get("o") == order:
+        return position["k"], position["id"]
+    return None
+
+
+def _page_queryset(qs, order, cursor, seed, page_size):
+    """並び順 + カーソル位置 + LIMIT（page_size + 1 件）を付けた QuerySet"""
+    qs = order_profiles(qs, order, seed=seed)
+
+    position = cursor_position(cursor, order)
+    if position:
+        key, pk = position
+        qs = qs.filter(Q(sort_key__lt=key) | Q(sort_key=key, id__lt=pk))
+
+    return qs[: page_size + 1]
+
+
+def _page_result(rows, order, page_size):
+    """取ってきた行 → (そのページの行, 次ページ用カーソル)"""
+    profiles = rows[:page_size]
+
+    next_cursor = None
+    if len(rows) > page_size:
+        last = profiles[-1]
+        next_cursor = encode_cursor(
+            {"o": order, "k": last.sort_key, "id": last.id},
+            salt=CURSOR_SALT,
+        )
+
+    return profiles, next_cursor
+
+
+async def afetch_profile_page(qs, order, cursor=None, seed=None, page_size=PROFILE_PAGE_SIZE):
+    """
+    新しい順 / ランダム順の1ページ分のプロフィールと、次ページ用カーソル（なければ None）。
+    page_size + 1 件だけ取って「次があるか」を判定する。
+    """
+    rows = [p async for p in _page_queryset(qs, order, cursor, seed, page_size)]
+    return _page_result(rows, order, page_size)
+
@@ -0,0 +1,254 @@
+# matching/signals.py
+"""
+モデルの変更に合わせてキャッシュを更新するシグナルハンドラ。
+apps.MatchingConfig.ready() で読み込まれる。
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import (
+    relations, notifications, chat, images, matches, profiles, caching, fulltext, saved_search,
+    recommendations, scoring, rooms,
+)
+from .models import Like, Block, UserProfile, Message, ChatRoom, ProfilePhoto, BoardPost
+
+
+# ========== いいね / ブロック → マッチ・関係キャッシュ ==========
+
+
+@receiver(post_save, sender=Like)
+def on_like_saved(sender, instance, created, **kwargs):
+    if created:
+        # マッチは Like と同じトランザクションで作る
+        matches.like_added(instance)
+        transaction.on_commit(lambda: relations.like_added(instance))
+        transaction.on_commit(lambda: _invalidate_like_notifications(instance))
+
+
+@receiver(post_delete, sender=Like)
+def on_like_deleted(sender, instance, **kwargs):
+    matches.like_removed(instance)
+    transaction.on_commit(lambda: relations.like_removed(instance))
+    transaction.on_commit(lambda: _invalidate_like_notifications(instance))
+
+
+@receiver(post_save, sender=Block)
+def on_block_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: relations.block_added(instance))
+
+
+@receiver(post_delete, sender=Block)
+def on_block_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: relations.block_removed(instance))
+
+
+@receiver(post_delete, sender=UserProfile)
+def on_profile_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: relations.forget(instance.pk))
+    profiles.forget(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_changed(sender, instance, **kwargs):
+    # プロセス内の「自分のプロフィール」キャッシュを捨てる
+    profiles.forget(instance.user_id)
+
+
+# ========== 通知バッジのキャッシュ破棄 ==========
+
+
+def _invalidate_like_notifications(like):
+    # いいねした側（マッチ成立）・された側（新着いいね）の両方が変わりうる
+    notifications.invalidate_profiles([like.from_user_id, like.to_user_id])
+
+
+@receiver(post_save, sender=Message)
+def on_message_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: notifications.invalidate_room(instance.room_id))
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_saved(sender, instance, **kwargs):
+    # last_checked_* の更新（一覧を見た）でバッジが消えるように
+    if instance.user_id:
+        transaction.on_commit(lambda: notifications.invalidate_users([instance.user_id]))
+
+
+# ========== ブロック・ルーム削除 → 開いているチャットの WebSocket を閉じる ==========
+
+
+@receiver(post_save, sender=Block)
+def on_block_saved_chat(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    def close():
+        for room_id in rooms.room_between(instance.blocker_id, instance.blocked_id).values_list("id", flat=True):
+            chat.close_room_sockets(room_id)
+
+    transaction.on_commit(close)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def on_room_deleted_chat(sender, instance, **kwargs):
+    room_id = instance.pk
+    transaction.on_commit(lambda: chat.close_room_sockets(room_id))
+
+
+# ========== チャット一覧用の非正規化フィールド ==========
+
+
+@receiver(post_save, sender=ChatRoom)
+def on_room_saved(sender, instance, created, **kwargs):
+    if created:
+        chat.ensure_read_states(instance)
+
+
+@receiver(post_save, sender=Message)
+def on_message_recorded(sender, instance, created, **kwargs):
+    # メッセージと同じトランザクションで未読数・最新メッセージを更新する
+    if created:
+        chat.record_message(instance)
+
+
+# ========== 掲示板一覧の断片キャッシュ ==========
+
+
+@receiver(post_save, sender=BoardPost)
+def on_board_post_changed(sender, instance, **kwargs):
+    transaction.on_commit(caching.bump_board_version)
+
+
+@receiver(post_delete, sender=BoardPost)
+def on_board_post_deleted(sender, instance, **kwargs):
+    transaction.on_commit(caching.bump_board_version)
+
+
+# ========== 全文検索の索引 ==========
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_text_saved(sender, instance, update_fields=None, **kwargs):
+    # 保存と同じトランザクションで索引も書き換える
+    if fulltext.needs_reindex(fulltext.PROFILE, update_fields):
+        fulltext.index_object(instance, fulltext.PROFILE)
+
+
+@receiver(post_delete, sender=UserProfile)
+def on_profile_text_deleted(sender, instance, **kwargs):
+    fulltext.remove_object(instance.pk, fulltext.PROFILE)
+
+
+@receiver(post_save, sender=BoardPost)
+def on_board_post_text_saved(sender, instance, update_fields=None, **kwargs):
+    if fulltext.needs_reindex(fulltext.BOARD_POST, update_fields):
+        fulltext.index_object(instance, fulltext.BOARD_POST)
+
+
+@receiver(post_delete, sender=BoardPost)
+def on_board_post_text_deleted(sender, instance, **kwargs):
+    fulltext.remove_object(instance.pk, fulltext.BOARD_POST)
+
+
+# ========== プロフィール検索のスナップショット ==========
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def on_like_changed_search(sender, instance, **kwargs):
+    # いいねした相手は自分の検索結果から消える（取り消すと戻る）
+    transaction.on_commit(lambda: saved_search.bump_profile_versions([instance.from_user_id]))
+
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def on_block_changed_search(sender, instance, **kwargs):
+    ids = [instance.blocker_id, instance.blocked_id]
+    transaction.on_commit(lambda: saved_search.bump_profile_versions(ids))
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_changed_search(sender, instance, created, update_fields=None, **kwargs):
+    # 新規登録・検索項目の変更は誰の結果にも影響しうる（last_checked_* の更新などは無視）
+    if created or update_fields is None or set(update_fields) & saved_search.SEARCH_FIELDS:
+        transaction.on_commit(saved_search.bump_global_version)
+
+
+@receiver(post_delete, sender=UserProfile)
+def on_profile_deleted_search(sender, instance, **kwargs):
+    transaction.on_commit(saved_search.bump_global_version)
+
+
+# ========== おすすめの事前計算 ==========
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def on_like_changed_recommendation(sender, instance, **kwargs):
+    # いいねした側は候補から外れる人が、された側は「いいね済み」の加点が変わる
+    ids = [instance.from_user_id, instance.to_user_id]
+    transaction.on_commit(lambda: recommendations.mark_stale(ids))
+
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def on_block_changed_recommendation(sender, instance, **kwargs):
+    ids = [instance.blocker_id, instance.blocked_id]
+    transaction.on_commit(lambda: recommendations.mark_stale(ids))
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_changed_recommendation(sender, instance, created, update_fields=None, **kwargs):
+    if not (created or update_fields is None or set(update_fields) & saved_search.SEARCH_FIELDS):
+        return
+    # スコアリング用の表の自分の行を書き換える（新規登録なら行を足す）
+    # 他の人のおすすめには、search_updated_at を見て読むときに混ざる（recommendations.aload_entries）
+    transaction.on_commit(lambda: scoring.refresh([instance.pk]))
+    if not created:  # 新規登録ならまだ Recommendation がないので、次の差分実行で作られる
+        transaction.on_commit(lambda: recommendations.mark_stale([instance.pk]))
+
+
+@receiver(post_delete, sender=UserProfile)
+def on_profile_deleted_recommendation(sender, instance, **kwargs):
+    transaction.on_commit(lambda: scoring.refresh([instance.pk]))
+
+
+# ========== アップロード画像の EXIF 削除 / サムネイル / WebP ==========
+
+
+@receiver(pre_save, sender=UserProfile)
+def on_profile_avatar_saving(sender, instance, **kwargs):
+    images.strip_upload_metadata(instance, "avatar")
+
+
+@receiver(pre_save, sender=ProfilePhoto)
+def on_profile_photo_saving(sender, instance, **kwargs):
+    images.strip_upload_metadata(instance, "image")
+
+
+@receiver(pre_save, sender=BoardPost)
+def on_board_post_saving(sender, instance, **kwargs):
+    images.strip_upload_metadata(instance, "image")
+
+
+@receiver(pre_save, sender=Message)
+def on_message_image_saving(sender, instance, **kwargs):
+    images.strip_upload_metadata(instance, "image")
+
+
+@receiver(post_save, sender=UserProfile)
+def on_profile_avatar_saved(sender, instance, **kwargs):
+    images.enqueue_renditions(instance.avatar)
+
+
+@receiver(post_save, sender=ProfilePhoto)
+def on_profile_photo_saved(sender, instance, **kwargs):
+    images.enqueue_renditions(instance.image)
+
+
+@receiver(post_save, sender=BoardPost)
+def on_board_post_saved(sender, instance, **kwargs):
+    images.enqueue_renditions(instance.image)
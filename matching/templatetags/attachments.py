@@ -0,0 +1,17 @@
+# matching/templatetags/attachments.py
+"""
+チャット添付ファイルの署名付き URL をテンプレートから出すタグ。
+
+  {% load attachments %}
+  <img src="{% attachment_url m.image %}">
+"""
+from django import template
+
+from matching.attachments import attachment_url as _attachment_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def attachment_url(fieldfile):
+    return _attachment_url(fieldfile)
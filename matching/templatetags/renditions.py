@@ -0,0 +1,24 @@
+# matching/templatetags/renditions.py
+"""
+テンプレートからサムネイル / WebP の URL を引くためのタグ。
+
+  {% load renditions %}
+  {% rendition_url p.avatar "thumb" "webp" as avatar_webp %}
+  {% rendition_url p.avatar "thumb" as avatar_jpg %}
+  <picture>
+    {% if avatar_webp %}<source srcset="{{ avatar_webp }}" type="image/webp">{% endif %}
+    <img src="{{ avatar_jpg }}" ...>
+  </picture>
+
+JPEG は未生成なら元画像の URL、WebP は未生成なら空文字を返す。
+"""
+from django import template
+
+from matching.images import rendition_url as _rendition_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def rendition_url(fieldfile, rendition, fmt="jpg"):
+    return _rendition_url(fieldfile, rendition, fmt, fallback=(fmt != "webp"))
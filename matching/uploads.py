@@ -0,0 +1,205 @@
+# matching/uploads.py
+"""
+チャット動画の分割（チャンク）アップロード。
+
+1回の multipart POST で動画を丸ごと送ると、モバイル回線では
+ワーカーが何分も占有されるうえ、サイズ超過は全部受け取ってからでないとわからない。
+そこで:
+
+  1. start_upload   : ファイル名・種類・サイズを先に宣言（サイズ上限はここで判定）
+  2. append_chunk   : offset を指定してチャンクを一時ファイルに追記（上限は受信中も判定）
+  3. finish_upload  : 全部届いたらストレージへ移して Message を作る
+
+途中で切れても、サーバー側の received から続きを送れば再開できる。
+
+同じアップロードへの PUT が重なったとき（再送など）に一時ファイルへの書き込みが混ざらないよう、
+append_chunk は一時ファイルに排他ロック（flock）を取ってから offset を確かめて書く。
+ロックが取れなければ、もう一方の PUT が書いている最中なので 409 を返す。
+
+finish_upload も同じロックを取り、もうメッセージになっていればそれを返す。
+最後のチャンクの再送（返事を受け取る前に回線が切れたなど）が成功として返るようにするため。
+"""
+import fcntl
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatUpload, Message
+
+# Content-Type → 保存するときの拡張子
+VIDEO_EXTENSIONS = {
+    "video/mp4": ".mp4",
+    "video/quicktime": ".mov",
+}
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """アップロードを受け付けられないとき。status は返す HTTP ステータス"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_video_bytes():
+    return getattr(settings, "MAX_VIDEO_SIZE_MB", 30) * 1024 * 1024
+
+
+def temp_path(upload):
+    return Path(settings.CHAT_UPLOAD_TEMP_DIR) / f"{upload.pk}.part"
+
+
+def discard_upload(upload):
+    """一時ファイルごとアップロードを消す"""
+    try:
+        os.remove(temp_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def cleanup_stale_uploads():
+    """一定時間更新のない（放置された）アップロードを一時ファイルごと消す"""
+    limit = timezone.now() - timedelta(hours=settings.CHAT_UPLOAD_EXPIRY_HOURS)
+    for upload in ChatUpload.objects.filter(updated_at__lt=limit, message__isnull=True):
+        discard_upload(upload)
+
+
+def start_upload(room, me, filename, content_type, size):
+    """アップロードを始める（中身はまだ受け取らない）"""
+    allowed = getattr(settings, "ALLOWED_VIDEO_CONTENT_TYPES", [])
+    if content_type not in allowed or content_type not in VIDEO_EXTENSIONS:
+        raise UploadError("このファイル形式は送信できません。")
+
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("ファイルサイズが正しくありません。")
+    if size <= 0:
+        raise UploadError("空のファイルは送信できません。")
+    if size > max_video_bytes():
+        raise UploadError(
+            f"動画ファイルが大きすぎます（最大 {settings.MAX_VIDEO_SIZE_MB}MB まで）。",
+            status=413,
+        )
+
+    cleanup_stale_uploads()
+
+    upload = ChatUpload.objects.create(
+        room=room,
+        uploader=me,
+        filename=(filename or "")[:255],
+        content_type=content_type,
+        total_size=size,
+    )
+    Path(settings.CHAT_UPLOAD_TEMP_DIR).mkdir(parents=True, exist_ok=True)
+    temp_path(upload).touch()
+    return upload
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    offset の位置から length バイトを stream から読んで一時ファイルに書く。
+    書き込み後の受信済みバイト数を返す。
+    """
+    if length is None or length <= 0:
+        raise UploadError("チャンクが空です。")
+
+    with open(temp_path(upload), "r+b") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # 同じアップロードに別の PUT が書き込み中
+            raise UploadError("ほかのチャンクを受信中です。", status=409)
+
+        # ロックを取ってから DB の受信済み数を見直す（待っている間に進んでいることがある）
+        upload.received = (
+            ChatUpload.objects.filter(pk=upload.pk).values_list("received", flat=True).get()
+        )
+        if offset != upload.received:
+            # 再送・順番違い。クライアントは返した offset から送り直す
+            raise UploadError("offset が一致しません。", status=409)
+        if offset + length > upload.total_size:
+            discard_upload(upload)
+            raise UploadError("宣言したサイズを超えています。", status=413)
+
+        # 全体をメモリに載せず、少しずつ読んでそのまま書く
+        written = 0
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+        f.truncate(offset + written)
+        f.flush()
+
+        received = offset + written
+        ChatUpload.objects.filter(pk=upload.pk, received=offset).update(
+            received=received,
+            updated_at=timezone.now(),
+        )
+        # ロックはファイルを閉じると外れる
+
+    upload.received = received
+    return received
+
+
+def _finished_message(upload):
+    """もう作ってあるメッセージ（まだなら None）"""
+    message_id = ChatUpload.objects.filter(pk=upload.pk).values_list("message_id", flat=True).first()
+    if message_id is None:
+        return None
+    return Message.objects.select_related("sender").get(pk=message_id)
+
+
+def finish_upload(upload):
+    """
+    全部届いたアップロードから Message を作る。(message, created)
+    最後のチャンクの再送などで2回呼ばれても、2通目は作らずに最初のメッセージを返す。
+    """
+    try:
+        f = open(temp_path(upload), "rb")
+    except FileNotFoundError:
+        # もう一方のリクエストが仕上げて一時ファイルを消したあと
+        message = _finished_message(upload)
+        if message is None:
+            raise UploadError("アップロードが見つかりません。", status=404)
+        return message, False
+
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("ほかのチャンクを受信中です。", status=409)
+
+        # ロックを取ってから、もう仕上がっていないか・全部届いているかを DB で見直す
+        message = _finished_message(upload)
+        if message is not None:
+            return message, False
+        upload.received = (
+            ChatUpload.objects.filter(pk=upload.pk).values_list("received", flat=True).get()
+        )
+        if upload.received != upload.total_size:
+            raise UploadError("まだ全部届いていません。", status=409)
+
+        ext = VIDEO_EXTENSIONS[upload.content_type]
+        name = default_storage.save(f"chat_videos/{uuid.uuid4().hex}{ext}", File(f))
+
+        with transaction.atomic():
+            message = Message.objects.create(room=upload.room, sender=upload.uploader, video=name)
+            upload.message = message
+            upload.save(update_fields=["message", "updated_at"])
+
+    os.remove(temp_path(upload))
+    return message, True
@@ -12,6 +12,7 @@ urlpatterns = [
 
     # プロフィール一覧
     path("list/", views.profile_list, name="profile_list"),
+    path("list/more/", views.profile_list_more, name="profile_list_more"),
 
     # プロフィール新規作成フォーム
     path("new/", views.profile_form, name="profile_form"),
@@ -28,6 +29,10 @@ urlpatterns = [
 
     # チャットルーム
     path("chat/<int:room_id>/", views.chat_room, name="chat_room"),
+    path("chat/<int:room_id>/messages/", views.chat_history, name="chat_history"),
+    path("chat/attachments/<path:path>", views.chat_attachment, name="chat_attachment"),
+    path("chat/<int:room_id>/uploads/", views.chat_upload_start, name="chat_upload_start"),
+    path("chat/uploads/<uuid:upload_id>/", views.chat_upload_chunk, name="chat_upload_chunk"),
     path("chats/", views.chat_list, name="chat_list"),
 
     # 通話リクエスト関連
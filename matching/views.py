@@ -1,4 +1,4 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import logout as auth_logout
@@ -6,19 +6,21 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Q, Case, When, IntegerField
+from django.db.models import F, Exists, OuterRef
 from django.core.paginator import Paginator
 from django.core.mail import send_mail
 from django.conf import settings
 
 from datetime import datetime, timezone as dt_timezone
-from collections import Counter
-import random
+import asyncio
+
+from asgiref.sync import sync_to_async
 
 from .forms import ContactForm, UserProfileForm, BoardPostForm
 from .models import (
     UserProfile,
     Like,
+    Match,
     ChatRoom,
     Message,
     CallRequest,
@@ -28,6 +30,38 @@ from .models import (
     SearchCondition,
     ContactMessage,
     BoardPost,
+    ChatUpload,
+)
+from .profiles import get_current_profile, aget_current_profile, get_fresh_profile
+from .caching import cache_public_page, board_version
+from .fulltext import filter_matching, BOARD_POST
+from .regions import REGION_CHOICES
+from .saved_search import (
+    has_search_params,
+    aload_search_params,
+    asave_search_conditions,
+    afetch_page,
+)
+from .rooms import room_between, get_or_create_room, arooms_with
+from .matches import lock_pair, matches_of, is_matched, ais_matched
+from .chat import mark_room_read, fetch_message_page, message_payload, broadcast_message
+from .uploads import UploadError, start_upload, append_chunk, finish_upload, discard_upload
+from .relations import (
+    LIKED,
+    BLOCKING,
+    BLOCKED_BY,
+    aget_relations,
+    has_liked,
+    is_blocked_between,
+    ais_blocked_between,
+)
+from .images import rendition_url
+from .media import resolve_media_path, serve_file, media_cache_control
+from .attachments import is_attachment_path, verify_attachment
+from .search import (
+    parse_search_params,
+    filter_profiles,
+    aget_random_seed,
 )
 from .utils import (
     is_safe_file,
@@ -36,8 +70,12 @@ from .utils import (
     detect_file_type,
 )
 from django.contrib.auth import logout
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, Http404, HttpResponseNotAllowed
+from django.views.decorators.http import require_safe, require_POST
+from django.db import transaction
 from django.contrib.auth.models import User
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import urlencode
 
 def custom_404(request, exception):
     return render(request, "matching/404.html", status=404)
@@ -46,52 +84,29 @@ def custom_404(request, exception):
 def custom_500(request):
     # ★ テンプレートパスを "matching/500.html" にする
     return render(request, "matching/500.html", status=500)
-# 都道府県 → 地方グループ
-REGION_GROUPS = {
-    "北海道・東北": ["北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県"],
-    "関東": ["茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県"],
-    "中部": [
-        "新潟県",
-        "富山県",
-        "石川県",
-        "福井県",
-        "山梨県",
-        "長野県",
-        "岐阜県",
-        "静岡県",
-        "愛知県",
-    ],
-    "近畿": ["三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"],
-    "中国": ["鳥取県", "島根県", "岡山県", "広島県", "山口県"],
-    "四国": ["徳島県", "香川県", "愛媛県", "高知県"],
-    "九州・沖縄": [
-        "福岡県",
-        "佐賀県",
-        "長崎県",
-        "熊本県",
-        "大分県",
-        "宮崎県",
-        "鹿児島県",
-        "沖縄県",
-    ],
-}
-
-
-def get_region_name(prefecture: str) -> str | None:
-    """都道府県から地方名（REGION_GROUPS のキー）を返す"""
-    if not prefecture:
-        return None
-    for region, prefs in REGION_GROUPS.items():
-        if prefecture in prefs:
-            return region
-    return None
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    MEDIA_ROOT のファイル配信（django.views.static.serve の代わり）。
+    Range / ETag / 304 に対応し、MEDIA_ACCEL があれば送信はプロキシに任せる。
+    チャットの添付ファイルはここからは出さない（chat_attachment の署名付き URL のみ）。
+    """
+    if is_attachment_path(path):
+        raise Http404
+    fullpath = resolve_media_path(path)
+    return serve_file(
+        request,
+        fullpath,
+        cache_control=media_cache_control(path),
+        accel_path=settings.MEDIA_ACCEL_PREFIX + path,
+    )
 
 
 def is_blocked(me, other):
-    # 自分がブロックしている or 相手にブロックされている
-    return Block.objects.filter(
-        Q(blocker=me, blocked=other) | Q(blocker=other, blocked=me)
-    ).exists()
+    # 自分がブロックしている or 相手にブロックされている（DB に聞く）
+    return is_blocked_between(me, other)
 
 
 # ========== 通話関連 ==========
@@ -134,7 +149,7 @@ def reject_call_request(request, request_id):
 def send_call_request(request, room_id, mode):
     """チャット画面から通話ボタンを押した時に呼ばれる"""
     room = get_object_or_404(ChatRoom, id=room_id)
-    me = get_object_or_404(UserProfile, user=request.user)
+    me = get_current_profile(request)
 
     # ルームの相手
     if room.user1_id == me.id:
@@ -194,56 +209,48 @@ def call_room(request, room_id):
 # matching/views.py
 
 @login_required
-def like_inbox(request):
+async def like_inbox(request):
     """
     自分に届いている「いいね」の通知一覧。
     ・まだ相互いいねになっていない「片想いのいいね」
     ・最近新しく成立した「マッチ」
     の両方を表示する。
+    互いに関係のないクエリは asyncio.gather でまとめて投げる。
     """
-    me = get_current_profile(request)
-
-    # 自分が「いいね」した相手ID
-    liked_ids = Like.objects.filter(
-        from_user=me
-    ).values_list("to_user_id", flat=True)
-
-    # ① 片想いの「いいね」一覧
-    incoming_likes = (
-        Like.objects.filter(to_user=me)
-        .exclude(from_user_id__in=liked_ids)
-        .select_related("from_user")
-        .order_by("-id")
-    )
+    me = await aget_current_profile(request)
 
-    # ② 新しく成立した「マッチ」一覧
     last_checked_matches = me.last_checked_matches or datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
 
-    recent_liked_me_ids = Like.objects.filter(
-        to_user=me,
-        created_at__gt=last_checked_matches,
-    ).values_list("from_user_id", flat=True)
-
-    new_match_ids = set(recent_liked_me_ids) & set(liked_ids)
+    incoming_likes, recent_matches = await asyncio.gather(
+        # ① 片想いの「いいね」一覧（まだマッチになっていないもの）
+        alist(
+            Like.objects.filter(to_user=me)
+            .exclude(Exists(Match.objects.filter(profile=me, partner=OuterRef("from_user"))))
+            .select_related("from_user")
+            .order_by("-id")
+        ),
+        # ② 最後に確認してから成立した「マッチ」一覧
+        alist(matches_of(me, since=last_checked_matches)),
+    )
 
-    new_match_partners = UserProfile.objects.filter(id__in=new_match_ids)
+    new_match_partners = [match.partner for match in recent_matches]
 
-    new_matches = []
-    for partner in new_match_partners:
-        room = ChatRoom.objects.filter(
-            Q(user1=me, user2=partner) | Q(user1=partner, user2=me)
-        ).first()
+    # 相手ごとのルームは1クエリでまとめて引く
+    rooms = await arooms_with(me, new_match_partners)
 
-        new_matches.append({
+    new_matches = [
+        {
             "partner": partner,
-            "room": room,
-        })
+            "room": rooms.get(partner.pk),
+        }
+        for partner in new_match_partners
+    ]
 
     # 通知確認時刻を更新
     now = timezone.now()
     me.last_checked_likes = now
     me.last_checked_matches = now
-    me.save(update_fields=["last_checked_likes", "last_checked_matches"])
+    await me.asave(update_fields=["last_checked_likes", "last_checked_matches"])
 
     context = {
         "me": me,
@@ -251,7 +258,7 @@ def like_inbox(request):
         "new_matches": new_matches,
         "current_tab": "notice",
     }
-    return render(request, "matching/like_inbox.html", context)
+    return await arender(request, "matching/like_inbox.html", context)
 
 
 @login_required
@@ -259,20 +266,8 @@ def match_list(request):
     """相互いいねしている相手の一覧"""
     me = get_current_profile(request)
 
-    # 自分が「いいね」した相手
-    liked_ids = Like.objects.filter(from_user=me).values_list(
-        "to_user_id", flat=True
-    )
-
-    # 相手から「いいね」されている人
-    liked_me_ids = Like.objects.filter(to_user=me).values_list(
-        "from_user_id", flat=True
-    )
-
-    # 相互いいねになっている相手ID
-    mutual_ids = set(liked_ids) & set(liked_me_ids)
-
-    partners = UserProfile.objects.filter(id__in=mutual_ids)
+    # マッチした相手（新しい順）
+    partners = [match.partner for match in matches_of(me)]
 
     # ★ 「マッチ一覧を見た」時刻を更新
     me.last_checked_matches = timezone.now()
@@ -290,7 +285,8 @@ def match_list(request):
 
 @login_required
 def edit_my_profile(request):
-    me = get_current_profile(request)
+    # フォームは全フィールドを保存するので、キャッシュのコピーではなく DB の最新から作る
+    me = get_fresh_profile(request)
 
     if request.method == "POST":
         form = UserProfileForm(request.POST, request.FILES, instance=me)
@@ -344,6 +340,7 @@ def my_profile(request):
     )
 
 
+@cache_public_page
 def home(request):
     """ログイン前の入口ページ"""
     return render(request, "matching/home.html")
@@ -352,21 +349,18 @@ def home(request):
 # ========== 共通ヘルパー ==========
 
 
-def get_current_profile(request):
+async def alist(qs):
+    """QuerySet を async で評価して list にする"""
+    return [obj async for obj in qs]
+
+
+async def arender(request, template_name, context):
     """
-    ログイン中ユーザーに対応する UserProfile を返す。
-    なければ作る（ニックネームはユーザー名）。
+    async ビューからの render。
+    テンプレート内の遅延評価（関連の参照・コンテキストプロセッサ）は同期の ORM を使うので、
+    描画はスレッド側で行う。
     """
-    if not request.user.is_authenticated:
-        return None
-
-    profile, created = UserProfile.objects.get_or_create(
-        user=request.user,
-        defaults={
-            "nickname": request.user.username,
-        },
-    )
-    return profile
+    return await sync_to_async(render)(request, template_name, context)
 
 
 # ========== 認証まわり ==========
@@ -417,7 +411,8 @@ def signup(request):
                 profile.avatar = avatar
                 profile.save(update_fields=["avatar"])
 
-            auth_login(request, user)
+            # AUTHENTICATION_BACKENDS が2つあるので、どちらでログインさせるか指定する
+            auth_login(request, user, backend="matching.profiles.ProfileModelBackend")
             return redirect("profile_detail", pk=profile.pk)
     else:
         form = UserCreationForm()
@@ -429,120 +424,32 @@ def signup(request):
 
 
 @login_required
-def profile_list(request):
-    me = get_current_profile(request)
+async def profile_list(request):
+    me = await aget_current_profile(request)
+
+    # ▼ 絞り込み（GET パラメータ） ---------------------
+    # 条件なしで開いたときは前回の条件で検索し、条件付きなら今回の条件を保存する
+    params = request.GET
+    if has_search_params(params):
+        filters = parse_search_params(params)
+        await asave_search_conditions(me, filters)
+    else:
+        filters = parse_search_params(await aload_search_params(me) or params)
+    current_order = filters["order"]
+    qs = filter_profiles(me, filters)
 
-    # 自分以外
-    qs = UserProfile.objects.exclude(user=request.user)
-
-    # 性別が M/F のときだけ「異性のみ」フィルタ
-    if me.gender in ("M", "F"):
-        opposite = "F" if me.gender == "M" else "M"
-        qs = qs.filter(gender=opposite)
-
-    # いいね済み + ブロック関係のある相手は除外
-    liked_ids = Like.objects.filter(
-        from_user=me
-    ).values_list("to_user_id", flat=True)
-
-    blocked_by_me_ids = Block.objects.filter(
-        blocker=me
-    ).values_list("blocked_id", flat=True)
-
-    blocked_me_ids = Block.objects.filter(
-        blocked=me
-    ).values_list("blocker_id", flat=True)
-
-    hidden_ids = set(list(liked_ids) + list(blocked_by_me_ids) + list(blocked_me_ids))
-    if hidden_ids:
-        qs = qs.exclude(id__in=hidden_ids)
-
-    # ▼ 絞り込みパラメータ取得 -------------------------
-    pref = request.GET.get("pref", "").strip()
-    gender = request.GET.get("gender", "").strip()
-    purpose = request.GET.get("purpose", "").strip()
-    min_income_raw = request.GET.get("min_income", "").strip()
-    photo_only = request.GET.get("photo_only", "")
-    age_filter = request.GET.get("age", "any").strip()
-    current_order = request.GET.get("order", "recommended")
-
-    # 都道府県フィルタ
-    if pref:
-        qs = qs.filter(prefecture=pref)
-
-    # 性別フィルタ（上の「異性のみ」と両立させたいなら AND になる）
-    if gender:
-        qs = qs.filter(gender=gender)
-
-    # ★ 利用目的フィルタ
-    if purpose:
-        qs = qs.filter(purpose=purpose)
-
-    # 年収下限
-    min_income = None
-    if min_income_raw:
-        try:
-            min_income = int(min_income_raw)
-            qs = qs.filter(income__gte=min_income)
-        except ValueError:
-            min_income = None
-
-    # 写真ありのみ
-    if photo_only == "1":
-        qs = qs.exclude(avatar="").exclude(avatar__isnull=True)
-
-    # 年齢フィルタ（自分と同じ age_range）
-    if age_filter == "near" and me.age_range:
-        qs = qs.filter(age_range=me.age_range)
-
-    # 一旦 list 化して Python 側でスコアリング
-    profiles = list(qs)
-
-    # 地方ざっくり判定用
-    def get_region(pref_name):
-        table = {
-            "北海道": "北海道",
-            "青森県": "東北", "岩手県": "東北", "宮城県": "東北", "秋田県": "東北",
-            "山形県": "東北", "福島県": "東北",
-            "茨城県": "関東", "栃木県": "関東", "群馬県": "関東", "埼玉県": "関東",
-            "千葉県": "関東", "東京都": "関東", "神奈川県": "関東",
-            "新潟県": "中部", "富山県": "中部", "石川県": "中部", "福井県": "中部",
-            "山梨県": "中部", "長野県": "中部", "岐阜県": "中部",
-            "静岡県": "中部", "愛知県": "中部",
-            "三重県": "近畿", "滋賀県": "近畿", "京都府": "近畿",
-            "大阪府": "近畿", "兵庫県": "近畿", "奈良県": "近畿", "和歌山県": "近畿",
-            "鳥取県": "中国", "島根県": "中国", "岡山県": "中国",
-            "広島県": "中国", "山口県": "中国",
-            "徳島県": "四国", "香川県": "四国", "愛媛県": "四国", "高知県": "四国",
-            "福岡県": "九州", "佐賀県": "九州", "長崎県": "九州", "熊本県": "九州",
-            "大分県": "九州", "宮崎県": "九州", "鹿児島県": "九州", "沖縄県": "九州",
-        }
-        return table.get(pref_name or "", "")
+    # ▼ 並び順 + 1ページ目 -------------------------------
+    # 並べた結果の ID 列をスナップショットとして覚えておく（おすすめ順は matching.scoring で並べる）
+    # ランダム順はタブを開くたびにシードを振り直し、続きのページは同じシードで取る
+    seed = None
+    if current_order == "random":
+        seed = await aget_random_seed(request.session, reset=True)
 
-    # ▼ 並び順 -----------------------------------------
-    if current_order == "new":
-        profiles.sort(key=lambda p: p.id, reverse=True)
-    elif current_order == "random":
-        random.shuffle(profiles)
-    else:
-        # おすすめ：同県 > 同じ地方 > 年齢レンジ近い > 新しい
-        my_region = get_region(me.prefecture)
-
-        def score(p):
-            s = 0
-            if p.prefecture == me.prefecture:
-                s += 20
-            if my_region and get_region(p.prefecture) == my_region:
-                s += 10
-            if me.age_range and p.age_range and me.age_range == p.age_range:
-                s += 3
-            # ★ 利用目的が同じならちょっと加点
-            if me.purpose and p.purpose and me.purpose == p.purpose:
-                s += 2
-            s += p.id / 1000.0  # 新しいほど少し上に
-            return -s
-
-        profiles.sort(key=score)
+    profiles, next_cursor = await afetch_page(qs, me, filters, seed=seed)
+
+    # 続きのページ（JSON）の URL：同じ条件 + cursor
+    more_params = {name: value for name, value in filters.items() if value}
+    more_url = f"{reverse('profile_list_more')}?{urlencode(more_params)}"
 
     # フィルタ用の選択肢
 
@@ -550,17 +457,22 @@ def profile_list(request):
         "me": me,
         "profiles": profiles,
         "current_order": current_order,
-        "age_filter": age_filter,
+        "age_filter": filters["age"],
+        "next_cursor": next_cursor,
+        "more_url": more_url,
 
         # フィルタ状態
-        "pref": pref,
-        "gender": gender,
-        "purpose": purpose,
-        "min_income": min_income_raw,
-        "photo_only": photo_only,
+        "pref": filters["pref"],
+        "region": filters["region"],
+        "gender": filters["gender"],
+        "purpose": filters["purpose"],
+        "min_income": filters["min_income"],
+        "photo_only": filters["photo_only"],
+        "q": filters["q"],
 
         # 選択肢
         "pref_choices": UserProfile.PREF_CHOICES,
+        "region_choices": REGION_CHOICES,
         "gender_choices": UserProfile.GENDER_CHOICES,
         "purpose_choices": UserProfile.PURPOSE_CHOICES,
 
@@ -568,35 +480,83 @@ def profile_list(request):
 
     context["current_tab"] = "search"
 
-    return render(request, "matching/list.html", context)
-
+    return await arender(request, "matching/list.html", context)
+
+
+def profile_card_data(p):
+    """一覧カード1枚分の JSON（無限スクロールで追加するカード用）"""
+    return {
+        "id": p.pk,
+        "nickname": p.nickname,
+        "age_range": p.age_range,
+        "prefecture": p.prefecture,
+        "purpose": p.get_purpose_display() if p.purpose else "",
+        "avatar_url": rendition_url(p.avatar, "thumb"),
+        "avatar_webp_url": rendition_url(p.avatar, "thumb", "webp", fallback=False),
+        "detail_url": reverse("profile_detail", args=[p.pk]),
+        "like_url": reverse("send_like", args=[p.pk]),
+    }
 
 
 @login_required
-def profile_detail(request, pk):
-    profile = get_object_or_404(UserProfile, pk=pk)
-    me = get_current_profile(request)
+async def profile_list_more(request):
+    """
+    プロフィール一覧の「続き」を JSON で返す（無限スクロール用）。
+    GET パラメータは profile_list と同じ + cursor。
+    """
+    me = await aget_current_profile(request)
+
+    filters = parse_search_params(request.GET)
+    current_order = filters["order"]
+    qs = filter_profiles(me, filters)
+
+    seed = None
+    if current_order == "random":
+        seed = await aget_random_seed(request.session)
+
+    profiles, next_cursor = await afetch_page(
+        qs,
+        me,
+        filters,
+        cursor=request.GET.get("cursor"),
+        seed=seed,
+    )
 
-    iine_sent = False
-    can_chat = False
+    # サムネイルの有無はストレージを見るのでスレッド側で
+    cards = await sync_to_async(lambda: [profile_card_data(p) for p in profiles])()
 
-    if me and me != profile:
-        iine_sent = Like.objects.filter(
-            from_user=me, to_user=profile
-        ).exists()
+    return JsonResponse({
+        "profiles": cards,
+        "next_cursor": next_cursor,
+    })
 
-        you_to_me = Like.objects.filter(
-            from_user=profile, to_user=me
-        ).exists()
 
-        can_chat = iine_sent and you_to_me
 
-    is_blocked_flag = is_blocked(me, profile) if me and me != profile else False
-    blocked_by_me = Block.objects.filter(
-        blocker=me, blocked=profile
-    ).exists() if me and me != profile else False
+@login_required
+async def profile_detail(request, pk):
+    profile, me = await asyncio.gather(
+        aget_object_or_404(UserProfile, pk=pk),
+        aget_current_profile(request),
+    )
 
-    photos_qs = profile.photos.all()  # ★ここ
+    iine_sent = False
+    can_chat = False
+    is_blocked_flag = False
+    blocked_by_me = False
+
+    if me and me != profile:
+        # 自分側の関係（キャッシュ）・マッチ済みか・写真を同時に取る
+        relations, matched, photos = await asyncio.gather(
+            aget_relations(me.pk),
+            ais_matched(me, profile),
+            alist(profile.photos.all()),
+        )
+        iine_sent = profile.pk in relations[LIKED]
+        can_chat = matched
+        blocked_by_me = profile.pk in relations[BLOCKING]
+        is_blocked_flag = blocked_by_me or profile.pk in relations[BLOCKED_BY]
+    else:
+        photos = await alist(profile.photos.all())
 
     context = {
         "profile": profile,
@@ -605,9 +565,9 @@ def profile_detail(request, pk):
         "can_chat": can_chat,
         "is_blocked": is_blocked_flag,
         "blocked_by_me": blocked_by_me,
-        "photos": photos_qs,
+        "photos": photos,
     }
-    return render(request, "matching/detail.html", context)
+    return await arender(request, "matching/detail.html", context)
 
 
 def profile_form(request):
@@ -646,23 +606,17 @@ def send_like(request, pk):
         messages.error(request, "このユーザーにはアクションできません。")
         return redirect("profile_detail", pk=pk)
 
-    like, created = Like.objects.get_or_create(
-        from_user=me,
-        to_user=target,
-    )
-
-    mutual_like = Like.objects.filter(
-        from_user=target,
-        to_user=me,
-    ).exists()
-
-    if mutual_like:
-        existing = ChatRoom.objects.filter(
-            Q(user1=me, user2=target) | Q(user1=target, user2=me)
-        ).first()
+    if not has_liked(me, target):
+        # 相手からのいいねがあれば、同じトランザクションで Match も作られる（signals.py）
+        with transaction.atomic():
+            lock_pair(me, target)
+            Like.objects.get_or_create(
+                from_user=me,
+                to_user=target,
+            )
 
-        if not existing:
-            ChatRoom.objects.create(user1=me, user2=target)
+    if is_matched(me, target):
+        get_or_create_room(me, target)
 
     messages.success(request, "いいねを送信しました。")
     return redirect("profile_detail", pk=pk)
@@ -680,29 +634,25 @@ def start_chat(request, pk):
     if me == partner:
         return redirect("profile_detail", pk=pk)
 
-    me_to_you = Like.objects.filter(from_user=me, to_user=partner).exists()
-    you_to_me = Like.objects.filter(from_user=partner, to_user=me).exists()
-
-    if not (me_to_you and you_to_me):
+    if not is_matched(me, partner):
         return render(
             request,
             "matching/chat_locked.html",
             {"target": partner, "me": me},
         )
 
-    u1, u2 = sorted([me, partner], key=lambda u: u.pk)
-    room, created = ChatRoom.objects.get_or_create(user1=u1, user2=u2)
+    room, created = get_or_create_room(me, partner)
 
     return redirect("chat_room", room_id=room.id)
 
 
 @login_required
-def chat_room(request, room_id):
-    # ① チャットルーム取得
-    room = get_object_or_404(ChatRoom, id=room_id)
-
-    # ② 自分のプロフィール
-    me = get_current_profile(request)
+async def chat_room(request, room_id):
+    # ① チャットルーム取得 + ② 自分のプロフィール
+    room, me = await asyncio.gather(
+        aget_object_or_404(ChatRoom.objects.select_related("user1", "user2"), id=room_id),
+        aget_current_profile(request),
+    )
     if me is None:
         return redirect("profile_form")
 
@@ -716,18 +666,21 @@ def chat_room(request, room_id):
         messages.error(request, "このチャットルームには参加していません。")
         return redirect("chat_list")
 
-    # ブロックチェック
-    if is_blocked(me, partner):
+    # ブロックチェック（DB に聞く）
+    if await ais_blocked_between(me, partner):
         messages.error(
             request, "このユーザーとはチャットできません（ブロック中です）。"
         )
         return redirect("chat_list")
 
-    # ④ メッセージ一覧
-    messages_qs = Message.objects.filter(room=room).order_by("created_at")
+    # ⑥ メッセージ送信（ファイルの検査・保存があるので同期のまま）
+    if request.method == "POST":
+        return await sync_to_async(_post_chat_message)(request, room, me)
 
+    # ④ メッセージ一覧（最新の CHAT_PAGE_SIZE 件だけ。古いものは「さらに読み込む」で取得）
     # ⑤ 着信（未処理の通話リクエスト）1件拾う
-    incoming_call = (
+    (messages_qs, older_cursor), incoming_call = await asyncio.gather(
+        sync_to_async(fetch_message_page)(room),
         CallRequest.objects.filter(
             room=room,
             callee=me,
@@ -735,147 +688,280 @@ def chat_room(request, room_id):
             is_accepted__isnull=True,
         )
         .order_by("-created_at")
-        .first()
+        .afirst(),
     )
 
-    # ⑥ メッセージ送信
-    if request.method == "POST":
-        text = request.POST.get("message", "").strip()
-        uploaded_file = request.FILES.get("file")
+    # ⑦ 既読更新（未読数も 0 に戻す）
+    await sync_to_async(mark_room_read)(me, room)
 
-        msg = Message(room=room, sender=me)
+    # ⑧ テンプレートへ
+    context = {
+        "room": room,
+        "room_id": room.id,
+        "me": me,
+        "partner": partner,
+        "messages": messages_qs,
+        "older_cursor": older_cursor,
+        "incoming_call": incoming_call,
+        "current_tab": "chat",
+    }
+    return await arender(request, "matching/chat_room.html", context)
 
-        # テキスト
-        if text:
-            msg.text = text
 
-        # ファイル（画像 or 動画）
-        if uploaded_file:
-            # まず形式チェック（Content-Type + 拡張子）
-            if not is_safe_file(uploaded_file):
-                messages.error(
-                    request,
-                    "このファイル形式は送信できません。",
-                )
-                return redirect("chat_room", room_id=room.id)
+def _post_chat_message(request, room, me):
+    """チャットルームへのフォーム送信（テキスト / 画像 / 動画）"""
+    text = request.POST.get("message", "").strip()
+    uploaded_file = request.FILES.get("file")
+
+    msg = Message(room=room, sender=me)
+
+    # テキスト
+    if text:
+        msg.text = text
+
+    # ファイル（画像 or 動画）
+    if uploaded_file:
+        # まず形式チェック（Content-Type + 拡張子）
+        if not is_safe_file(uploaded_file):
+            messages.error(
+                request,
+                "このファイル形式は送信できません。",
+            )
+            return redirect("chat_room", room_id=room.id)
 
-            ftype = detect_file_type(uploaded_file)
-
-            # 画像の場合：必要ならリサイズ
-            if ftype == "image":
-                safe_image = resize_image_if_needed(uploaded_file)
-                msg.image = safe_image
-
-            # 動画の場合：サイズチェックだけ（変換はしない）
-            elif ftype == "video":
-                if not validate_video_size(uploaded_file):
-                    messages.error(
-                        request,
-                        f"動画ファイルが大きすぎます（最大 {settings.MAX_VIDEO_SIZE_MB}MB まで）。",
-                    )
-                    return redirect("chat_room", room_id=room.id)
-                msg.video = uploaded_file
-
-            # どちらでもない → 危険なので拒否
-            else:
+        ftype = detect_file_type(uploaded_file)
+
+        # 画像の場合：必要ならリサイズ
+        if ftype == "image":
+            safe_image = resize_image_if_needed(uploaded_file)
+            msg.image = safe_image
+
+        # 動画の場合：サイズチェックだけ（変換はしない）
+        elif ftype == "video":
+            if not validate_video_size(uploaded_file):
                 messages.error(
                     request,
-                    "送信できるのは画像（JPEG/PNG/GIF）と動画ファイルのみです。",
+                    f"動画ファイルが大きすぎます（最大 {settings.MAX_VIDEO_SIZE_MB}MB まで）。",
                 )
                 return redirect("chat_room", room_id=room.id)
+            msg.video = uploaded_file
 
-        # 何かしら内容がある場合だけ保存
-        if msg.text or msg.image or msg.video:
-            msg.save()
+        # どちらでもない → 危険なので拒否
         else:
-            messages.info(request, "空のメッセージは送信されません。")
+            messages.error(
+                request,
+                "送信できるのは画像（JPEG/PNG/GIF）と動画ファイルのみです。",
+            )
+            return redirect("chat_room", room_id=room.id)
+
+    # 何かしら内容がある場合だけ保存
+    # （送った本人はリダイレクトで読み直すが、相手の画面には WebSocket で流す）
+    if msg.text or msg.image or msg.video:
+        msg.save()
+        transaction.on_commit(lambda: broadcast_message(msg))
+    else:
+        messages.info(request, "空のメッセージは送信されません。")
+
+    return redirect("chat_room", room_id=room.id)
+
+
+@login_required
+def chat_history(request, room_id):
+    """
+    チャットの古いメッセージを JSON で返す（「さらに読み込む」用）。
+    ?before=<カーソル> より古い CHAT_PAGE_SIZE 件。
+    """
+    room = get_object_or_404(ChatRoom, id=room_id)
+    me = get_current_profile(request)
+
+    if room.user1_id == me.id:
+        partner = room.user2
+    elif room.user2_id == me.id:
+        partner = room.user1
+    else:
+        return JsonResponse({"error": "not a member"}, status=403)
+
+    if is_blocked(me, partner):
+        return JsonResponse({"error": "blocked"}, status=403)
 
-        return redirect("chat_room", room_id=room.id)
+    page, older_cursor = fetch_message_page(room, before=request.GET.get("before"))
 
-    # ⑦ 既読更新
-    read_state, created = ChatReadState.objects.get_or_create(
-        user=me,
-        room=room,
-        defaults={"last_read_at": timezone.now()},
+    return JsonResponse({
+        "messages": [message_payload(m) for m in page],
+        "older_cursor": older_cursor,
+    })
+
+
+
+def _chat_member(request, room_id):
+    """(room, me, partner)。参加者でない・ブロック関係なら None"""
+    room = get_object_or_404(ChatRoom, id=room_id)
+    me = get_current_profile(request)
+
+    if room.user1_id == me.id:
+        partner = room.user2
+    elif room.user2_id == me.id:
+        partner = room.user1
+    else:
+        return None
+
+    if is_blocked(me, partner):
+        return None
+    return room, me, partner
+
+
+@login_required
+@require_POST
+def chat_upload_start(request, room_id):
+    """
+    動画の分割アップロードを始める。
+    POST: filename / content_type / size → {"upload_id", "offset", "chunk_size", "upload_url"}
+    """
+    member = _chat_member(request, room_id)
+    if member is None:
+        return JsonResponse({"error": "このチャットには送信できません。"}, status=403)
+    room, me, partner = member
+
+    try:
+        upload = start_upload(
+            room,
+            me,
+            request.POST.get("filename", ""),
+            request.POST.get("content_type", ""),
+            request.POST.get("size"),
+        )
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    return JsonResponse(
+        {
+            "upload_id": str(upload.pk),
+            "offset": 0,
+            "chunk_size": settings.CHAT_UPLOAD_CHUNK_SIZE,
+            "upload_url": reverse("chat_upload_chunk", args=[upload.pk]),
+        },
+        status=201,
     )
-    read_state.last_read_at = timezone.now()
-    read_state.save(update_fields=["last_read_at"])
 
-    # ⑧ テンプレートへ
-    context = {
-        "room": room,
-        "room_id": room.id,
-        "me": me,
-        "partner": partner,
-        "messages": messages_qs,
-        "incoming_call": incoming_call,
-        "current_tab": "chat",
-    }
-    return render(request, "matching/chat_room.html", context)
 
 @login_required
-def chat_list(request):
-    """自分が参加しているチャットルーム一覧 + 未読数"""
+def chat_upload_chunk(request, upload_id):
+    """
+    分割アップロードのチャンク受け取り。
+      GET : 受信済みバイト数（再開用） → {"offset"}
+      PUT : Upload-Offset ヘッダの位置から本文を追記 → {"offset"}
+            最後のチャンクで Message を作り {"offset", "message"} を返す
+    完了したあとの GET / PUT（最後のチャンクの再送など）にも、完了時と同じ {"offset", "message"} を返す。
+    """
     me = get_current_profile(request)
+    upload = get_object_or_404(
+        ChatUpload.objects.select_related("room", "message__sender"),
+        pk=upload_id,
+        uploader=me,
+    )
+
+    if upload.message is not None:
+        return JsonResponse({"offset": upload.total_size, "message": message_payload(upload.message)})
+
+    if request.method == "GET":
+        return JsonResponse({"offset": upload.received, "size": upload.total_size})
+    if request.method != "PUT":
+        return HttpResponseNotAllowed(["GET", "PUT"])
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+        length = int(request.headers.get("Content-Length", ""))
+    except ValueError:
+        return JsonResponse({"error": "Upload-Offset / Content-Length が必要です。"}, status=400)
+
+    if offset == upload.total_size and length == 0:
+        # 全部届いたあとの空の PUT（409 で offset = 全体 を返されたクライアント）→ 仕上げだけやり直す
+        received = offset
+    else:
+        try:
+            received = append_chunk(upload, offset, request, length)
+        except UploadError as e:
+            return JsonResponse({"error": str(e), "offset": upload.received}, status=e.status)
+
+    if received < upload.total_size:
+        return JsonResponse({"offset": received})
+
+    # 全部届いた → メッセージにする（ブロックされていたら作らず、受け取った分も捨てる）
+    if _chat_member(request, upload.room_id) is None:
+        discard_upload(upload)
+        return JsonResponse({"error": "このチャットには送信できません。"}, status=403)
+
+    try:
+        message, created = finish_upload(upload)
+    except UploadError as e:
+        return JsonResponse({"error": str(e), "offset": upload.received}, status=e.status)
+    if not created:
+        return JsonResponse({"offset": received, "message": message_payload(message)})
+
+    transaction.on_commit(lambda: broadcast_message(message))
+    return JsonResponse({"offset": received, "message": message_payload(message)}, status=201)
+
+@require_safe
+def chat_attachment(request, path):
+    """
+    チャット添付ファイルの配信（署名付き URL）。
+    メンバー確認は URL を発行したときに済んでいるので、ここでは署名と期限だけ見る（DB なし）。
+    """
+    remaining = verify_attachment(path, request.GET.get("e"), request.GET.get("s"))
+    if remaining is None:
+        raise Http404
+
+    fullpath = resolve_media_path(path)
+    # 個人のチャットのファイルなので、共有のプロキシには載せずブラウザだけにキャッシュさせる（期限まで）
+    # （X-Accel-Redirect のパスは serve_file の中でパーセントエンコードされる）
+    return serve_file(
+        request,
+        fullpath,
+        cache_control=f"private, max-age={remaining}",
+        accel_path=settings.MEDIA_ACCEL_PREFIX + path,
+    )
 
-    # 新しいルーム順に並べる（あとで先に見つけたものだけ採用する）
-    rooms = ChatRoom.objects.filter(
-        Q(user1=me) | Q(user2=me)
-    ).order_by("-created_at")
+@login_required
+async def chat_list(request):
+    """自分が参加しているチャットルーム一覧 + 未読数"""
+    me = await aget_current_profile(request)
+
+    # 非正規化済みの ChatReadState だけで一覧を作る（1クエリ）
+    # 最終アクティビティ順に並べ、同じ相手のルームは先に見つけたものだけ採用する
+    states = (
+        ChatReadState.objects.filter(user=me)
+        .select_related("room__user1", "room__user2")
+        .order_by(F("last_activity_at").desc(nulls_last=True), "-room_id")
+    )
 
     room_infos_dict = {}  # key: partner.id, value: room_info
 
-    for room in rooms:
-        # 相手プロフィールを先に決める
+    async for state in states:
+        room = state.room
         partner = room.user2 if room.user1_id == me.id else room.user1
 
         # すでにこの相手とのルームを追加済みならスキップ
         if partner.id in room_infos_dict:
             continue
 
-        # 最新メッセージ
-        latest = (
-            Message.objects.filter(room=room).order_by("-created_at").first()
-        )
-
-        # 既読状態を取得（なければ2000年を既読時刻として作成）
-        read_state, _ = ChatReadState.objects.get_or_create(
-            user=me,
-            room=room,
-            defaults={
-                "last_read_at": datetime(2000, 1, 1, tzinfo=dt_timezone.utc),
-            },
-        )
-
-        # 未読数カウント（自分以外のメッセージだけ）
-        unread_count = 0
-        if latest and latest.created_at > read_state.last_read_at:
-            unread_count = (
-                Message.objects.filter(
-                    room=room,
-                    created_at__gt=read_state.last_read_at,
-                )
-                .exclude(sender=me)
-                .count()
-            )
-
         room_infos_dict[partner.id] = {
             "room": room,
             "partner": partner,
-            "latest_message": latest,
-            "unread_count": unread_count,
+            "has_message": state.last_message_id is not None,
+            "preview": state.last_message_preview,
+            "last_activity_at": state.last_activity_at,
+            "unread_count": state.unread_count,
         }
 
-    # dict → list に変換（表示順は created_at 降順のまま）
+    # dict → list に変換（表示順は最終アクティビティ降順のまま）
     room_infos = list(room_infos_dict.values())
 
     context = {
         "me": me,
         "room_infos": room_infos,
-        "rooms": rooms,          # もしテンプレでまだ使ってるなら残してOK
         "current_tab": "chat",
     }
-    return render(request, "matching/chat_list.html", context)
+    return await arender(request, "matching/chat_list.html", context)
 
 
 
@@ -888,9 +974,7 @@ def block_user(request, pk):
         Block.objects.get_or_create(blocker=me, blocked=target)
 
     # チャットルームがあれば削除してもOK（任意）
-    ChatRoom.objects.filter(
-        Q(user1=me, user2=target) | Q(user1=target, user2=me)
-    ).delete()
+    room_between(me, target).delete()
 
     messages.info(request, "ユーザーをブロックしました。")
     return redirect("profile_list")
@@ -906,8 +990,6 @@ def unblock_user(request, pk):
     messages.info(request, "ブロックを解除しました。")
     return redirect("profile_detail", pk=pk)
 
-from django.core.paginator import Paginator
-from django.contrib.auth.decorators import login_required
 
 @login_required
 def board_list(request):
@@ -916,6 +998,7 @@ def board_list(request):
     # GETパラメータ
     call_only = request.GET.get("call_only", "")
     gender = request.GET.get("gender", "")  # 'M' / 'F' / '' を想定
+    q = request.GET.get("q", "").strip()
 
     # 通話募集だけ
     if call_only == "1":
@@ -925,14 +1008,25 @@ def board_list(request):
     if gender in ["M", "F"]:
         posts = posts.filter(author__gender=gender)
 
+    # キーワード（タイトル・本文の全文検索）
+    if q:
+        posts = filter_matching(posts, BOARD_POST, q)
+
     paginator = Paginator(posts, 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_number = request.GET.get("page") or "1"
+
+    # 投稿リストはテンプレート側で断片キャッシュする。
+    # キャッシュに当たればページの取得（COUNT + SELECT）自体を行わないよう遅延させる
+    page_obj = SimpleLazyObject(lambda: paginator.get_page(page_number))
 
     context = {
         "page_obj": page_obj,
+        "page_number": page_number,
         "call_only": call_only,
         "gender": gender,
+        "q": q,
+        "board_version": board_version(),
+        "board_cache_timeout": settings.BOARD_CACHE_TIMEOUT,
         "current_tab": "board",
     }
     return render(request, "matching/board_list.html", context)
@@ -980,15 +1074,19 @@ def board_detail(request, pk):
         },
     )
 
+@cache_public_page
 def ladies_free(request):
     return render(request, "matching/ladies_free.html", {"current_tab": "me"})
 
+@cache_public_page
 def terms(request):
     return render(request, "matching/terms.html")
 
+@cache_public_page
 def privacy(request):
     return render(request, "matching/privacy.html")
 
+@cache_public_page
 def rules(request):
     return render(request, "matching/rules.html")
 